@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Benchmarks `DBTBlueGreen.main` end to end against an in-process fake Snowflake and a fake `dbt` executable, both
+offline. For each scenario it reports the wall clock time, the time spent only in the orchestration code (wall clock
+minus the time the fake Snowflake or the fake dbt were busy), the number of Snowflake logins and round trips, and the
+rate at which dbt log lines were consumed.
+
+Run from the repository root:
+    python -m benchmarks.bench_orchestration
+    python -m benchmarks.bench_orchestration --scenario schema_swap --nodes 2000 --latency clone_database=2
+    python -m benchmarks.bench_orchestration --max-overhead 1.5 --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from benchmarks.fake_snowflake import FakeSnowflake
+from src.connection_pool import ConnectionPool
+from src.main import DBTBlueGreen
+
+BLUE_DATABASE = 'BENCH'
+GREEN_DATABASE = 'BENCH_STAGING'
+BLUE_SCHEMAS = ['INFORMATION_SCHEMA', 'PUBLIC', 'RAW'] + [f'SCHEMA_{i}' for i in range(5)]
+
+# Keyword arguments for DBTBlueGreen.main, plus the setup of the fake account and dbt for each scenario.
+SCENARIOS = {
+    'database_clone': {'main': {}},
+    'clone_by_schema': {'main': {'clone_by_schema': True}},
+    'schema_swap': {'main': {'schema_swap': True}},
+    'existing_green': {'main': {'drop_on_existing_db': True}, 'green_exists': True},
+    'no_swap': {'main': {'no_swap': True}},
+    'standby': {'main': {'use_standby': True}, 'standby_exists': True},
+    'build_failure': {'main': {}, 'fail': True},
+}
+
+
+class BenchmarkResult:
+    """
+    The measurements of one benchmark run.
+    """
+
+    def __init__(self, scenario: str):
+        self.scenario = scenario
+        self.wall_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.build_seconds = 0.0
+        self.connections = 0
+        self.round_trips: Dict[str, int] = {}
+        self.statements = 0
+        self.log_lines = 0
+        self.succeeded = False
+
+    @property
+    def overhead_seconds(self) -> float:
+        return max(0.0, self.wall_seconds - self.busy_seconds)
+
+    @property
+    def log_lines_per_second(self) -> float:
+        return self.log_lines / self.build_seconds if self.build_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {'scenario': self.scenario, 'wall_seconds': self.wall_seconds, 'busy_seconds': self.busy_seconds,
+                'overhead_seconds': self.overhead_seconds, 'build_seconds': self.build_seconds,
+                'connections': self.connections, 'round_trips': sum(self.round_trips.values()),
+                'round_trips_by_kind': self.round_trips, 'statements': self.statements, 'log_lines': self.log_lines,
+                'log_lines_per_second': self.log_lines_per_second, 'succeeded': self.succeeded}
+
+
+@contextmanager
+def patched_environ(values: Dict[str, str]):
+    """
+    Sets environment variables for the duration of the block.
+    """
+    saved = dict(os.environ)
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def install_fake_dbt(bin_dir: str):
+    """
+    Writes a `dbt` executable to `bin_dir` that runs `fake_dbt.py` with this interpreter.
+    """
+    fake_dbt = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_dbt.py')
+    path = os.path.join(bin_dir, 'dbt')
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake_dbt}" "$@"\n')
+    os.chmod(path, 0o755)
+
+
+def run_scenario(scenario: str, nodes: int, lines_per_node: int, node_seconds: float, threads: int,
+                 latency: Dict[str, float], default_latency: float, login_latency: float) -> BenchmarkResult:
+    """
+    Runs one blue/green deploy against fresh fakes.
+
+    Returns:
+        A BenchmarkResult
+    """
+    config = SCENARIOS[scenario]
+    result = BenchmarkResult(scenario)
+    work_dir = tempfile.mkdtemp(prefix='bench_blue_green_')
+    try:
+        bin_dir = os.path.join(work_dir, 'bin')
+        dbt_root = os.path.join(work_dir, 'transform')
+        os.makedirs(bin_dir)
+        os.makedirs(dbt_root)
+        install_fake_dbt(bin_dir)
+        stats_file = os.path.join(work_dir, 'dbt_stats.jsonl')
+
+        databases = {BLUE_DATABASE: BLUE_SCHEMAS}
+        if config.get('green_exists'):
+            databases[GREEN_DATABASE] = BLUE_SCHEMAS
+        if config.get('standby_exists'):
+            databases[f'{GREEN_DATABASE}_STANDBY'] = BLUE_SCHEMAS
+        server = FakeSnowflake(databases, latency=latency, default_latency=default_latency,
+                               login_latency=login_latency)
+
+        env = {'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+               'DBT_EXECUTION_MODE': 'subprocess',
+               'DBT_THREAD_COUNT': str(threads),
+               'MANIFEST_FOUND': 'false',
+               'DBT_DEPS_CACHE_DIR': os.path.join(work_dir, 'cache', 'deps'),
+               'DBT_PARSE_CACHE_DIR': os.path.join(work_dir, 'cache', 'partial_parse'),
+               'BLUE_GREEN_METRICS_DIR': os.path.join(work_dir, 'metrics'),
+               'BLUE_GREEN_RUN_HISTORY_DB': os.path.join(work_dir, 'run_history.sqlite'),
+               'FAKE_DBT_NODES': str(nodes),
+               'FAKE_DBT_LINES_PER_NODE': str(lines_per_node),
+               'FAKE_DBT_NODE_SECONDS': str(node_seconds),
+               'FAKE_DBT_STATS': stats_file}
+        if config.get('fail'):
+            env['FAKE_DBT_FAIL'] = str(nodes // 2)
+
+        with patched_environ(env):
+            ConnectionPool.reset_shared()
+            # The pool is shared by the whole run, so creating it first makes every class use the fake connector.
+            ConnectionPool.get_shared(pool_size=threads, connect_function=server.connect)
+            blue_green = None
+            start = time.time()
+            try:
+                blue_green = DBTBlueGreen(BLUE_DATABASE, GREEN_DATABASE, thread_count=threads, dbt_root=dbt_root,
+                                          query_tag='bench')
+                blue_green.main(snapshot_select=None, snapshot_exclude=None, seed_select=None, seed_exclude=None,
+                                run_select=None, run_exclude=None, test_select=None, test_exclude=None,
+                                do_run=True, **config['main'])
+                result.succeeded = True
+            except subprocess.CalledProcessError:
+                if not config.get('fail'):
+                    raise
+            finally:
+                result.wall_seconds = time.time() - start
+                ConnectionPool.reset_shared()
+
+        dbt_intervals = []
+        if os.path.exists(stats_file):
+            with open(stats_file) as f:
+                dbt_intervals = [(x['start'], x['end']) for x in map(json.loads, f)]
+        result.busy_seconds = server.busy_seconds(dbt_intervals, start, start + result.wall_seconds)
+        result.build_seconds = blue_green._timer.phase_totals().get('build', 0.0) if blue_green else 0.0
+        result.connections = server.connections
+        result.round_trips = dict(server.round_trips)
+        result.statements = len(server.statements)
+        # Three header events, four events plus the extra lines per node, and two summary events.
+        result.log_lines = 5 + nodes * (4 + lines_per_node)
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def summarize(results: List[BenchmarkResult]) -> dict:
+    """
+    Returns the median of each measurement over repeated runs of one scenario.
+    """
+    rows = [x.to_dict() for x in results]
+    summary = {'scenario': results[0].scenario, 'runs': len(results), 'succeeded': all(x.succeeded for x in results)}
+    for key in ('wall_seconds', 'busy_seconds', 'overhead_seconds', 'build_seconds', 'connections', 'round_trips',
+                'statements', 'log_lines', 'log_lines_per_second'):
+        summary[key] = statistics.median(x[key] for x in rows)
+    summary['round_trips_by_kind'] = rows[-1]['round_trips_by_kind']
+    return summary
+
+
+def print_table(summaries: List[dict]):
+    header = (f'{"scenario":<16}{"wall s":>9}{"overhead s":>12}{"logins":>8}{"round trips":>13}{"statements":>12}'
+              f'{"log lines/s":>13}')
+    print(header)
+    print('-' * len(header))
+    for x in summaries:
+        print(f'{x["scenario"]:<16}{x["wall_seconds"]:>9.3f}{x["overhead_seconds"]:>12.3f}{x["connections"]:>8.0f}'
+              f'{x["round_trips"]:>13.0f}{x["statements"]:>12.0f}{x["log_lines_per_second"]:>13.0f}')
+
+
+def parse_latency(values: Optional[List[str]]) -> Dict[str, float]:
+    latency = {}
+    for value in values or []:
+        kind, _, seconds = value.partition('=')
+        latency[kind] = float(seconds)
+    return latency
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the blue/green orchestration against offline fakes.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='A scenario to run. May be repeated. Defaults to every scenario.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario. The median is reported.')
+    parser.add_argument('--nodes', type=int, default=500, help='Models in the fake dbt project.')
+    parser.add_argument('--lines-per-node', type=int, default=20, help='Extra dbt log events per model.')
+    parser.add_argument('--node-seconds', type=float, default=0.0, help='Seconds the fake dbt spends per model.')
+    parser.add_argument('--threads', type=int, default=6, help='The thread count of the run.')
+    parser.add_argument('--latency', action='append',
+                        help='Fake Snowflake latency as kind=seconds, such as clone_database=2. May be repeated.')
+    parser.add_argument('--default-latency', type=float, default=0.0,
+                        help='Latency of statement kinds without a --latency.')
+    parser.add_argument('--login-latency', type=float, default=0.0, help='Seconds each Snowflake login takes.')
+    parser.add_argument('--log-file', help='Write the run logs here. Defaults to a temporary file.')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    parser.add_argument('--max-overhead', type=float,
+                        help='Exit with an error if any scenario spends longer than this many seconds in the '
+                             'orchestration code.')
+    args = parser.parse_args(argv)
+
+    # Log to a file at INFO like a production run, so the cost of logging is part of the measurement.
+    log_file = args.log_file or os.path.join(tempfile.gettempdir(), 'bench_blue_green.log')
+    handler = logging.FileHandler(log_file, mode='w')
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)"))
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+
+    latency = parse_latency(args.latency)
+    summaries = []
+    for scenario in args.scenario or list(SCENARIOS):
+        results = [run_scenario(scenario, args.nodes, args.lines_per_node, args.node_seconds, args.threads, latency,
+                                args.default_latency, args.login_latency) for _ in range(max(1, args.repeat))]
+        summaries.append(summarize(results))
+
+    root.removeHandler(handler)
+    handler.close()
+    print_table(summaries)
+    print(f'Logs written to {log_file}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+    if args.max_overhead is not None:
+        slow = [x for x in summaries if x['overhead_seconds'] > args.max_overhead]
+        for x in slow:
+            print(f'{x["scenario"]} spent {x["overhead_seconds"]:.3f} seconds in orchestration, over the '
+                  f'{args.max_overhead:.3f} second budget.')
+        if slow:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
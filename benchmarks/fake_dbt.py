@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+A stand-in for the `dbt` executable that runs offline. It accepts the commands a blue/green run issues (deps, parse,
+ls and build) and writes the same kind of JSON log events and artifacts dbt does, at a configurable volume.
+
+Configured through environment variables:
+    FAKE_DBT_NODES: The number of models in the fake project. Defaults to 200.
+    FAKE_DBT_SCHEMAS: The number of schemas the models are spread over. Defaults to 5.
+    FAKE_DBT_LINES_PER_NODE: Extra debug events logged per node, such as SQL statements. Defaults to 20.
+    FAKE_DBT_NODE_SECONDS: Seconds each node takes to build. Defaults to 0.
+    FAKE_DBT_FAIL: Set to a node index to make that node fail.
+    FAKE_DBT_STATS: A file the start and end time of each invocation are appended to as a JSON line.
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+INVOCATION_ID = str(uuid.uuid4())
+SQL = ('create or replace transient table {relation} as (\n'
+       '    select id, customer_id, order_date, status, amount, updated_at\n'
+       '    from {upstream}\n'
+       '    where updated_at > (select coalesce(max(updated_at), \'1900-01-01\') from {relation})\n'
+       ');')
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def emit(name: str, msg: str, data: dict = None, level: str = 'info'):
+    event = {'data': data or {},
+             'info': {'category': '', 'code': '', 'extra': {}, 'invocation_id': INVOCATION_ID, 'level': level,
+                      'msg': msg, 'name': name, 'pid': os.getpid(), 'thread': 'MainThread', 'ts': now()}}
+    sys.stdout.write(json.dumps(event) + '\n')
+
+
+def option(args, flag, default=None):
+    return args[args.index(flag) + 1] if flag in args and args.index(flag) + 1 < len(args) else default
+
+
+def project_nodes():
+    count = int(os.environ.get('FAKE_DBT_NODES', 200))
+    schemas = int(os.environ.get('FAKE_DBT_SCHEMAS', 5))
+    nodes = {}
+    for i in range(count):
+        unique_id = f'model.bench.model_{i}'
+        parent = f'model.bench.model_{i - 1}' if i % 10 else None
+        nodes[unique_id] = {'unique_id': unique_id, 'resource_type': 'model', 'name': f'model_{i}',
+                            'fqn': ['bench', f'model_{i}'], 'schema': f'schema_{i % schemas}',
+                            'alias': f'model_{i}', 'checksum': {'name': 'sha256', 'checksum': str(i)},
+                            'config': {'materialized': 'table'},
+                            'depends_on': {'nodes': [parent] if parent else [], 'macros': []}}
+    return nodes
+
+
+def selected_nodes(args, nodes):
+    select = option(args, '--select')
+    if not select or 'fqn:' not in select:
+        return list(nodes.values())
+    names = {x.split('.')[-1] for x in select.split() if x.startswith('fqn:')}
+    return [x for x in nodes.values() if x['name'] in names]
+
+
+def node_info(node, status, started_at=None, finished_at=None):
+    return {'materialized': 'table', 'meta': {}, 'node_finished_at': finished_at or '', 'node_name': node['name'],
+            'node_path': f'{node["name"]}.sql',
+            'node_relation': {'alias': node['alias'], 'database': 'BENCH', 'schema': node['schema'],
+                              'relation_name': f'BENCH.{node["schema"]}.{node["alias"]}'},
+            'node_started_at': started_at or '', 'node_status': status, 'resource_type': 'model',
+            'unique_id': node['unique_id']}
+
+
+def build(args, target_path):
+    nodes = selected_nodes(args, project_nodes())
+    lines_per_node = int(os.environ.get('FAKE_DBT_LINES_PER_NODE', 20))
+    node_seconds = float(os.environ.get('FAKE_DBT_NODE_SECONDS', 0))
+    fail = os.environ.get('FAKE_DBT_FAIL')
+    total = len(nodes)
+    start = time.time()
+    emit('MainReportVersion', 'Running with dbt=1.8.0')
+    emit('FoundStats', f'Found {total} models, 0 tests, 0 seeds, 0 sources')
+    emit('ConcurrencyLine', f'Concurrency: {option(args, "--threads", 1)} threads (target=\'bench\')')
+
+    results = []
+    errors = 0
+    for i, node in enumerate(nodes):
+        started_at = now()
+        relation = f'BENCH.{node["schema"]}.{node["alias"]}'
+        emit('NodeStart', f'Began running node {node["unique_id"]}', {'node_info': node_info(node, 'started')},
+             level='debug')
+        emit('LogStartLine', f'{i + 1} of {total} START sql table model {relation}',
+             {'index': i + 1, 'total': total, 'node_info': node_info(node, 'started', started_at)})
+        for j in range(lines_per_node):
+            emit('SQLQuery', f'On {node["unique_id"]}: /* query {j} */ ' + SQL.format(relation=relation,
+                                                                                     upstream='BENCH.RAW.ORDERS'),
+                 {'conn_name': node['unique_id'], 'sql': SQL, 'node_info': node_info(node, 'started', started_at)},
+                 level='debug')
+        if node_seconds:
+            time.sleep(node_seconds)
+        status = 'error' if fail is not None and int(fail) == i else 'success'
+        errors += status == 'error'
+        finished_at = now()
+        run_result = {'status': status, 'execution_time': node_seconds, 'message': 'SUCCESS 1' if status == 'success'
+                      else f'Database Error in model {node["name"]}', 'thread': 'Thread-1'}
+        emit('LogModelResult', f'{i + 1} of {total} {"OK created" if status == "success" else "ERROR creating"} sql '
+                               f'table model {relation} [{status.upper()} in {node_seconds:.2f}s]',
+             {'status': status, 'index': i + 1, 'total': total, 'execution_time': node_seconds,
+              'node_info': node_info(node, status, started_at, finished_at)},
+             level='info' if status == 'success' else 'error')
+        emit('NodeFinished', f'Finished running node {node["unique_id"]}',
+             {'node_info': node_info(node, status, started_at, finished_at), 'run_result': run_result}, level='debug')
+        results.append(dict(run_result, unique_id=node['unique_id'], timing=[], adapter_response={}, failures=None))
+
+    elapsed = time.time() - start
+    emit('StatsLine', f'Done. PASS={total - errors} WARN=0 ERROR={errors} SKIP=0 TOTAL={total}',
+         {'stats': {'pass': total - errors, 'warn': 0, 'error': errors, 'skip': 0, 'total': total}})
+    emit('CommandCompleted', f'Command `dbt build` {"succeeded" if not errors else "failed"}',
+         {'completed_at': now(), 'elapsed': elapsed, 'success': not errors}, level='debug')
+    write_json(os.path.join(target_path, 'run_results.json'),
+               {'metadata': {'invocation_id': INVOCATION_ID}, 'results': results, 'elapsed_time': elapsed, 'args': {}})
+    return 1 if errors else 0
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def main(argv) -> int:
+    command, args = (argv[0], argv[1:]) if argv else ('', [])
+    target_path = option(args, '--target-path', os.environ.get('DBT_TARGET_PATH', 'target'))
+    code = 0
+    if command == 'deps':
+        emit('DepsStartPackageInstall', 'Installing dbt-labs/dbt_utils')
+        os.makedirs('dbt_packages', exist_ok=True)
+        emit('DepsInstallInfo', 'Installed from version 1.1.1')
+    elif command == 'parse':
+        write_json(os.path.join(target_path, 'manifest.json'), {'nodes': project_nodes(), 'macros': {}})
+        emit('ParseCmdPerfInfoPath', 'Performance info: target/perf_info.json')
+    elif command == 'ls':
+        keys = (option(args, '--output-keys') or 'unique_id').split()
+        for node in selected_nodes(args, project_nodes()):
+            sys.stdout.write(json.dumps({k: node.get(k) for k in keys}) + '\n')
+    elif command == 'build':
+        code = build(args, target_path)
+    else:
+        sys.stderr.write(f'Unsupported command {command}\n')
+        code = 2
+    return code
+
+
+if __name__ == '__main__':
+    invocation_start = time.time()
+    exit_code = main(sys.argv[1:])
+    sys.stdout.flush()
+    stats_file = os.environ.get('FAKE_DBT_STATS')
+    if stats_file:
+        with open(stats_file, 'a') as f:
+            f.write(json.dumps({'command': sys.argv[1:2], 'start': invocation_start, 'end': time.time()}) + '\n')
+    sys.exit(exit_code)
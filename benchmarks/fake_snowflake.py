@@ -0,0 +1,304 @@
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+class FakeQueryStatus:
+    """
+    Stands in for the connector's QueryStatus enum. Only `name` is read by the orchestration code.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeSnowflake:
+    """
+    An in-process stand-in for a Snowflake account. It keeps just enough state (databases and their schemas) to answer
+    the statements a blue/green run issues, adds a configurable latency per kind of statement and counts every round
+    trip, so a benchmark can measure what the orchestration costs on top of the work Snowflake itself does.
+    """
+
+    # The first pattern matching a statement decides its kind, which selects its latency.
+    STATEMENT_KINDS = [
+        ('show_databases', re.compile(r'^show databases like\s+\'(?P<name>[^\']+)\'', re.I)),
+        ('show_schemas', re.compile(r'^show schemas in database\s+(?P<name>[\w$]+)', re.I)),
+        ('clone_database', re.compile(r'^create (or replace )?database\s+(?P<target>[\w$]+)\s+clone\s+'
+                                      r'(?P<source>[\w$]+)', re.I)),
+        ('clone_schema', re.compile(r'^create (or replace )?schema\s+(?P<target>[\w$]+\.[\w$"]+)\s+clone\s+'
+                                    r'(?P<source>[\w$]+\.[\w$"]+)', re.I)),
+        ('create_schema', re.compile(r'^create (or replace )?schema\s+(if not exists\s+)?(?P<target>[\w$]+\.[\w$"]+)',
+                                     re.I)),
+        ('create_database', re.compile(r'^create (or replace )?database\s+(if not exists\s+)?(?P<target>[\w$]+)',
+                                       re.I)),
+        ('swap_database', re.compile(r'^alter database\s+(?P<first>[\w$]+)\s+swap with\s+(?P<second>[\w$]+)', re.I)),
+        ('rename_database', re.compile(r'^alter database\s+(if exists\s+)?(?P<source>[\w$]+)\s+rename to\s+'
+                                       r'(?P<target>[\w$]+)', re.I)),
+        ('swap_schema', re.compile(r'^alter schema\s+(?P<first>[\w$]+\.[\w$"]+)\s+swap with\s+'
+                                   r'(?P<second>[\w$]+\.[\w$"]+)', re.I)),
+        ('rename_schema', re.compile(r'^alter schema\s+(?P<source>[\w$]+\.[\w$"]+)\s+rename to\s+'
+                                     r'(?P<target>[\w$]+\.[\w$"]+)', re.I)),
+        ('drop_database', re.compile(r'^drop database\s+(if exists\s+)?(?P<name>[\w$]+)', re.I)),
+        ('describe_database', re.compile(r'^describe database\s+(?P<name>[\w$]+)', re.I)),
+        ('grant', re.compile(r'^grant\s', re.I)),
+        ('query_history', re.compile(r'information_schema\.query_history', re.I)),
+        ('standby_status', re.compile(r'information_schema\.databases.*database_name = \'(?P<name>[^\']+)\'',
+                                      re.I | re.S)),
+        ('alter_session', re.compile(r'^alter session\s', re.I)),
+        ('select', re.compile(r'^select\s', re.I)),
+    ]
+
+    def __init__(self,
+                 databases: Optional[Dict[str, List[str]]] = None,
+                 latency: Optional[Dict[str, float]] = None,
+                 default_latency: float = 0.0,
+                 login_latency: float = 0.0):
+        """
+        Args:
+            databases: The databases that exist at the start, mapped to their schema names.
+            latency: Seconds each kind of statement takes on the fake server, keyed by the kinds in `STATEMENT_KINDS`.
+            default_latency: Seconds taken by kinds missing from `latency`.
+            login_latency: Seconds each new connection takes to log in.
+        """
+        self.databases: Dict[str, List[str]] = {k.upper(): [x.upper() for x in v] for k, v in (databases or {}).items()}
+        self.created: Dict[str, float] = {x: time.time() for x in self.databases}
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.login_latency = login_latency
+        self.connections = 0
+        self.round_trips = Counter()
+        self.statements: List[str] = []
+        # (start, end) of the time the fake server spent on each statement and login.
+        self.busy: List[Tuple[float, float]] = []
+        self._queries: Dict[str, Tuple[float, Optional[Exception]]] = {}
+        self._lock = threading.Lock()
+
+    def connect(self, query_tag: str = None, **kwargs) -> 'FakeConnection':
+        """
+        Opens a connection. Has the signature of the connect function the ConnectionPool expects.
+        """
+        start = time.time()
+        if self.login_latency:
+            time.sleep(self.login_latency)
+        with self._lock:
+            self.connections += 1
+            self.round_trips['login'] += 1
+            self.busy.append((start, time.time()))
+        return FakeConnection(self, query_tag)
+
+    def classify(self, sql: str) -> Tuple[str, Optional[re.Match]]:
+        """
+        Returns the kind of a statement and the match of its pattern.
+        """
+        sql = sql.strip()
+        for kind, pattern in self.STATEMENT_KINDS:
+            match = pattern.search(sql)
+            if match:
+                return kind, match
+        return 'other', None
+
+    def run(self, sql: str, asynchronous: bool = False,
+            num_statements: Optional[int] = None) -> Tuple[str, List[tuple], List[tuple]]:
+        """
+        Applies a statement, or several separated by semicolons, to the fake account.
+
+        Args:
+            sql: The statement.
+            asynchronous: Return straight away and let the statement finish in the background.
+            num_statements: The number of statements in `sql`. Like Snowflake, the count must match.
+
+        Returns:
+            The query ID, the result rows and the cursor description of the last statement.
+        """
+        statements = [x.strip() for x in re.split(r';\s*\n', sql) if x.strip()] if num_statements else [sql]
+        if num_statements and num_statements != len(statements):
+            raise Exception(f'Actual statement count {len(statements)} did not match the desired statement count '
+                            f'{num_statements}.')
+        start = time.time()
+        latency = 0.0
+        rows, description, error = [], [], None
+        with self._lock:
+            for statement in statements:
+                kind, match = self.classify(statement)
+                latency += self.latency.get(kind, self.default_latency)
+                self.statements.append(statement)
+                try:
+                    rows, description = self._apply(kind, match)
+                except Exception as e:
+                    # Like Snowflake, a multi-statement query stops at the first error.
+                    rows, description, error = [], [], e
+                    break
+            query_id = f'fake-{len(self.statements):08d}'
+            self._queries[query_id] = (start + latency, error)
+            self.busy.append((start, start + latency))
+        if not asynchronous:
+            if latency:
+                time.sleep(latency)
+            if error is not None:
+                raise error
+        return query_id, rows, description
+
+    def count(self, round_trip: str):
+        with self._lock:
+            self.round_trips[round_trip] += 1
+
+    def query_status(self, query_id: str) -> FakeQueryStatus:
+        with self._lock:
+            self.round_trips['status'] += 1
+            finish, error = self._queries[query_id]
+        if time.time() < finish:
+            return FakeQueryStatus('RUNNING')
+        if error is not None:
+            raise error
+        return FakeQueryStatus('SUCCESS')
+
+    def busy_seconds(self, extra: Optional[List[Tuple[float, float]]] = None, window_start: float = float('-inf'),
+                     window_end: float = float('inf')) -> float:
+        """
+        Returns the length of the union of the server's busy intervals and any extra intervals, such as the time the
+        fake dbt was running, within a time window. Time outside of this union is time spent only in the
+        orchestration code.
+        """
+        intervals = sorted((max(start, window_start), min(end, window_end)) for start, end in self.busy + (extra or [])
+                           if end > window_start and start < window_end)
+        total = 0.0
+        current_start, current_end = None, None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            total += current_end - current_start
+        return total
+
+    def _apply(self, kind: str, match: Optional[re.Match]) -> Tuple[List[tuple], List[tuple]]:
+        if kind == 'show_databases':
+            pattern = match.group('name').upper().replace('%', '.*').replace('_', '.')
+            rows = [(None, x) for x in sorted(self.databases) if re.fullmatch(pattern, x)]
+            return rows, [('created_on',), ('name',)]
+        if kind == 'show_schemas':
+            rows = [(None, x) for x in self._database(match.group('name'))]
+            return rows, [('created_on',), ('name',)]
+        if kind == 'standby_status':
+            name = match.group('name').upper()
+            rows = [(time.time() - self.created[name], False)] if name in self.databases else []
+            return rows, [('age_seconds',), ('blue_changed',)]
+        if kind == 'describe_database':
+            self._database(match.group('name'))
+            return [], []
+        if kind == 'query_history':
+            return [(query_id, 0) for query_id in self._queries], [('query_id',), ('total_elapsed_time',)]
+        if kind in ('clone_database', 'create_database'):
+            target = match.group('target').upper()
+            schemas = list(self._database(match.group('source'))) if kind == 'clone_database' else ['PUBLIC']
+            if target in self.databases and 'or replace' not in match.group(0).lower():
+                if kind == 'create_database' and 'if not exists' in match.group(0).lower():
+                    return [], []
+                raise Exception(f'Object {target} already exists.')
+            self.databases[target] = schemas
+            self.created[target] = time.time()
+        elif kind in ('clone_schema', 'create_schema'):
+            database, schema = self._split(match.group('target'))
+            if schema not in self._database(database):
+                self.databases[database].append(schema)
+        elif kind == 'swap_database':
+            first, second = match.group('first').upper(), match.group('second').upper()
+            self.databases[first], self.databases[second] = self._database(second), self._database(first)
+        elif kind == 'rename_database':
+            source, target = match.group('source').upper(), match.group('target').upper()
+            if source in self.databases:
+                self.databases[target] = self.databases.pop(source)
+                self.created[target] = self.created.pop(source)
+            elif 'if exists' not in match.group(0).lower():
+                raise Exception(f'Database {source} does not exist.')
+        elif kind == 'swap_schema':
+            for name in (match.group('first'), match.group('second')):
+                database, schema = self._split(name)
+                if schema not in self._database(database):
+                    raise Exception(f'Schema {name} does not exist.')
+        elif kind == 'rename_schema':
+            source_database, schema = self._split(match.group('source'))
+            target_database, _ = self._split(match.group('target'))
+            self._database(source_database).remove(schema)
+            self._database(target_database).append(schema)
+        elif kind == 'drop_database':
+            name = match.group('name').upper()
+            if name not in self.databases and 'if exists' not in match.group(0).lower():
+                raise Exception(f'Database {name} does not exist.')
+            self.databases.pop(name, None)
+        return [], []
+
+    def _database(self, name: str) -> List[str]:
+        name = name.upper()
+        if name not in self.databases:
+            raise Exception(f'Database {name} does not exist or not authorized.')
+        return self.databases[name]
+
+    @staticmethod
+    def _split(name: str) -> Tuple[str, str]:
+        database, schema = name.split('.', 1)
+        return database.upper(), schema.strip('"').upper()
+
+
+class FakeCursor:
+    """
+    The parts of a SnowflakeCursor used by the orchestration code.
+    """
+
+    def __init__(self, con: 'FakeConnection'):
+        self.con = con
+        self.sfqid = None
+        self.description = []
+        self._rows = []
+
+    def execute(self, sql: str, params=None):
+        self.con.server.count('execute')
+        self.sfqid, self._rows, self.description = self.con.server.run(sql)
+        return self
+
+    def execute_async(self, sql: str, num_statements: Optional[int] = None):
+        self.con.server.count('execute_async')
+        self.sfqid, self._rows, self.description = self.con.server.run(sql, asynchronous=True,
+                                                                       num_statements=num_statements)
+        return {'queryId': self.sfqid}
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    The parts of a SnowflakeConnection used by the orchestration code.
+    """
+
+    def __init__(self, server: FakeSnowflake, query_tag: Optional[str] = None):
+        self.server = server
+        self.query_tag = query_tag
+        self._closed = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id: str) -> FakeQueryStatus:
+        return self.server.query_status(query_id)
+
+    @staticmethod
+    def is_still_running(status: FakeQueryStatus) -> bool:
+        return status.name == 'RUNNING'
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        self._closed = True
@@ -0,0 +1,358 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+
+class ArtifactCache:
+    """
+    A local directory of cached build artifacts. Entries are files named by a content hash. Reading an entry bumps its
+    modification time, and eviction removes the least recently used entries once the cache holds more than
+    `max_entries` files or `max_bytes` bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: The directory holding the cache entries. Created if it does not exist.
+            max_entries: The most entries to keep.
+            max_bytes: The most bytes to keep across all entries.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entries(self) -> List[str]:
+        """
+        Returns the paths of every cache entry, least recently used first.
+        """
+        paths = []
+        for root, _, files in os.walk(self.cache_dir):
+            paths.extend(os.path.join(root, x) for x in files if not x.startswith('.tmp'))
+        return sorted(paths, key=os.path.getmtime)
+
+    def touch(self, path: str):
+        """
+        Marks an entry as recently used.
+
+        Returns:
+            None
+        """
+        os.utime(path, None)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is within its limits.
+
+        Returns:
+            None
+        """
+        entries = self.entries()
+        total_bytes = sum(os.path.getsize(x) for x in entries)
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries) or
+                           (self.max_bytes is not None and total_bytes > self.max_bytes)):
+            path = entries.pop(0)
+            total_bytes -= os.path.getsize(path)
+            os.remove(path)
+            self.logger.info(f'Evicted {path} from the cache.')
+
+    @staticmethod
+    def hash_values(values: Iterable[str]) -> str:
+        """
+        Returns a short sha256 of a sequence of strings.
+        """
+        digest = hashlib.sha256()
+        for value in values:
+            digest.update(value.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()[:32]
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """
+        Returns the sha256 of a file, or `missing` if it does not exist.
+        """
+        if not os.path.exists(path):
+            return 'missing'
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def dbt_version() -> str:
+        """
+        Returns the installed dbt-core version, falling back to `dbt --version` when dbt-core is not importable from
+        this interpreter.
+        """
+        try:
+            from importlib.metadata import version
+            return version('dbt-core')
+        except Exception:
+            pass
+        try:
+            result = subprocess.run(['dbt', '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            match = re.search(r'\d+\.\d+\.\d+\S*', result.stdout)
+            return match.group(0) if match else result.stdout.strip()
+        except Exception:
+            return 'unknown'
+
+
+class DepsCache(ArtifactCache):
+    """
+    Caches the installed dbt packages. Entries are keyed by the package definitions and the dbt version, so a hit
+    restores exactly what `dbt deps` would have installed and the command can be skipped.
+    """
+
+    PACKAGE_FILES = ('packages.yml', 'dependencies.yml', 'package-lock.yml')
+
+    def __init__(self, project_dir: str, cache_dir: str, max_entries: int = 5):
+        """
+        Args:
+            project_dir: The dbt project directory.
+            cache_dir: The directory holding the cached package archives.
+            max_entries: The number of package archives to keep.
+        """
+        super().__init__(cache_dir, max_entries=max_entries)
+        self.project_dir = project_dir
+        self.packages_dir = os.path.join(project_dir, self._packages_install_path())
+
+    def key(self) -> str:
+        """
+        Returns the cache key for the project's current package definitions.
+        """
+        values = [self.dbt_version()]
+        for name in self.PACKAGE_FILES:
+            values.extend([name, self.hash_file(os.path.join(self.project_dir, name))])
+        return self.hash_values(values)
+
+    def restore(self, key: str) -> bool:
+        """
+        Replaces the project's packages directory with a cached copy.
+
+        Args:
+            key: The cache key from `key`.
+
+        Returns:
+            True on a cache hit.
+        """
+        archive = self._archive_path(key)
+        if not os.path.exists(archive):
+            self.logger.info(f'dbt deps cache miss for key {key}.')
+            return False
+
+        try:
+            with tarfile.open(archive, 'r:gz') as tar:
+                members = self._safe_members(tar)
+                if os.path.exists(self.packages_dir):
+                    shutil.rmtree(self.packages_dir)
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(os.path.dirname(self.packages_dir), members=members, filter='data')
+                else:
+                    tar.extractall(os.path.dirname(self.packages_dir), members=members)
+        except (tarfile.TarError, OSError, ValueError) as e:
+            # A corrupt or tampered entry is a miss. dbt deps reinstalls the packages and the entry is replaced.
+            self.logger.warning(f'Discarding the dbt deps cache entry {archive}: {e}')
+            os.remove(archive)
+            if os.path.exists(self.packages_dir):
+                shutil.rmtree(self.packages_dir)
+            return False
+        self.touch(archive)
+        self.logger.info(f'dbt deps cache hit for key {key}. Restored {self.packages_dir} and skipped dbt deps.')
+        return True
+
+    def save(self, key: str):
+        """
+        Stores the project's packages directory under a cache key.
+
+        Args:
+            key: The cache key from `key`, taken before `dbt deps` ran.
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.packages_dir):
+            return
+        # Write to a temporary file first so a concurrent run never reads a partial archive.
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        with tarfile.open(tmp_path, 'w:gz') as tar:
+            tar.add(self.packages_dir, arcname=os.path.basename(self.packages_dir))
+        os.replace(tmp_path, self._archive_path(key))
+        self.logger.info(f'Saved {self.packages_dir} to the dbt deps cache with key {key}.')
+        self.evict()
+
+    def _archive_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'deps-{key}.tar.gz')
+
+    def _safe_members(self, tar: tarfile.TarFile) -> List[tarfile.TarInfo]:
+        """
+        Returns the members of a package archive, raising ValueError if any of them would be written outside the
+        packages directory or is anything but a plain file, directory or link within it. Python versions without
+        extraction filters rely on this check alone.
+        """
+        root = os.path.realpath(self.packages_dir)
+        base = os.path.dirname(root)
+        members = tar.getmembers()
+        for member in members:
+            path = os.path.realpath(os.path.join(base, member.name))
+            if path != root and not path.startswith(root + os.sep):
+                raise ValueError(f'Archive member {member.name} is outside {self.packages_dir}')
+            if member.issym() or member.islnk():
+                link_base = os.path.dirname(path) if member.issym() else base
+                target = os.path.realpath(os.path.join(link_base, member.linkname))
+                if not target.startswith(root + os.sep):
+                    raise ValueError(f'Archive member {member.name} links outside {self.packages_dir}')
+            elif not (member.isfile() or member.isdir()):
+                raise ValueError(f'Archive member {member.name} is not a file or directory')
+        return members
+
+    def _packages_install_path(self) -> str:
+        project_file = os.path.join(self.project_dir, 'dbt_project.yml')
+        if os.path.exists(project_file):
+            with open(project_file) as f:
+                match = re.search(r'^packages-install-path:\s*["\']?([^"\'\s#]+)', f.read(), re.MULTILINE)
+            if match:
+                return match.group(1)
+        return 'dbt_packages'
+
+
+class PartialParseCache(ArtifactCache):
+    """
+    Persists dbt's `target/partial_parse.msgpack` between runs on ephemeral workers. Entries are grouped by the dbt
+    version, target and the environment variables that affect parsing, and keyed within the group by a hash of the
+    project files. An exact match restores the parse state of identical project content. Otherwise the newest entry
+    in the group is restored and dbt's own partial parsing re-parses only the files that changed.
+    """
+
+    PARSE_FILE = 'partial_parse.msgpack'
+    # Directories that never affect parsing.
+    SKIP_DIRS = {'target', 'logs', '.git', '.venv', 'venv', '__pycache__', 'node_modules'}
+    PROJECT_EXTENSIONS = ('.sql', '.yml', '.yaml', '.csv', '.md', '.py', '.jinja', '.sqlfluff')
+    # Environment variables that select what dbt parses, besides the ones the project reads with env_var().
+    PARSE_ENV_VARS = ('DBT_TARGET', 'DBT_PROFILE')
+    ENV_VAR_PATTERN = re.compile(r'env_var\(\s*[\'"]([^\'"]+)[\'"]')
+    # Credentials never feed the key. dbt checks the connection itself and re-parses when the profile changed.
+    SECRET_PATTERN = re.compile(r'PASSWORD|SECRET|TOKEN|KEY|PASSPHRASE', re.IGNORECASE)
+
+    def __init__(self,
+                 project_dir: str,
+                 cache_dir: str,
+                 max_bytes: int = 500 * 1024 * 1024,
+                 target: Optional[str] = None,
+                 env_vars: Optional[List[str]] = None,
+                 target_path: str = 'target',
+                 env: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            project_dir: The dbt project directory.
+            cache_dir: The directory holding the cached parse files. May be on a shared volume.
+            max_bytes: The most bytes to keep across all cached parse files.
+            target: The dbt target the project is parsed for.
+            env_vars: The environment variables that affect parsing. Defaults to `PARSE_ENV_VARS` and the variables
+                      the project reads with `env_var()`. Names that look like credentials are always left out.
+            target_path: The dbt target directory, relative to the project directory.
+            env: Environment variables dbt runs with on top of this process's environment.
+        """
+        super().__init__(cache_dir, max_bytes=max_bytes)
+        self.project_dir = project_dir
+        self.target = target
+        self.env_vars = env_vars
+        self.env = dict(os.environ, **(env or {}))
+        self.parse_file = os.path.join(project_dir, target_path, self.PARSE_FILE)
+
+    def family_key(self) -> str:
+        """
+        Returns the hash of everything besides the project files that invalidates a parse.
+        """
+        names = self.env_vars if self.env_vars is not None else self.PARSE_ENV_VARS + tuple(self.project_env_vars())
+        values = [self.dbt_version(), self.target or 'default']
+        for name in sorted(set(x for x in names if not self.SECRET_PATTERN.search(x))):
+            values.extend([name, self.env.get(name, '')])
+        return self.hash_values(values)
+
+    def project_env_vars(self) -> List[str]:
+        """
+        Returns the environment variables the project's models, macros and configs read with `env_var()`.
+        """
+        names = set()
+        for path in self._project_files():
+            # profiles.yml only holds connection settings, which do not change what dbt parses.
+            if os.path.basename(path) == 'profiles.yml':
+                continue
+            with open(path, errors='replace') as f:
+                names.update(self.ENV_VAR_PATTERN.findall(f.read()))
+        return sorted(names)
+
+    def content_key(self) -> str:
+        """
+        Returns the hash of the project files, including installed packages.
+        """
+        values = []
+        for path in self._project_files():
+            values.extend([os.path.relpath(path, self.project_dir), self.hash_file(path)])
+        return self.hash_values(values)
+
+    def _project_files(self) -> List[str]:
+        files = []
+        for root, dirs, names in os.walk(self.project_dir):
+            dirs[:] = sorted(x for x in dirs if x not in self.SKIP_DIRS)
+            files.extend(os.path.join(root, x) for x in sorted(names) if x.endswith(self.PROJECT_EXTENSIONS))
+        return files
+
+    def restore(self) -> bool:
+        """
+        Copies the best matching cached parse file into the project's target directory.
+
+        Returns:
+            True if a parse file was restored.
+        """
+        family_dir = os.path.join(self.cache_dir, self.family_key())
+        exact = os.path.join(family_dir, f'{self.content_key()}.msgpack')
+        if os.path.exists(exact):
+            source = exact
+            self.logger.info('Partial parse cache hit for the current project content.')
+        else:
+            # Skip the temporary files `save` writes before renaming them into place.
+            candidates = sorted((os.path.join(family_dir, x) for x in os.listdir(family_dir)
+                                 if not x.startswith('.tmp')),
+                                key=os.path.getmtime) if os.path.isdir(family_dir) else []
+            if not candidates:
+                self.logger.info('Partial parse cache miss. dbt will parse the whole project.')
+                return False
+            source = candidates[-1]
+            self.logger.info('Partial parse cache restored the newest parse for this dbt version, target and '
+                             'environment. dbt will re-parse the changed files.')
+
+        os.makedirs(os.path.dirname(self.parse_file), exist_ok=True)
+        shutil.copyfile(source, self.parse_file)
+        self.touch(source)
+        return True
+
+    def save(self):
+        """
+        Stores the project's current parse file in the cache.
+
+        Returns:
+            None
+        """
+        if not os.path.exists(self.parse_file):
+            return
+        family_dir = os.path.join(self.cache_dir, self.family_key())
+        os.makedirs(family_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=family_dir)
+        os.close(fd)
+        shutil.copyfile(self.parse_file, tmp_path)
+        os.replace(tmp_path, os.path.join(family_dir, f'{self.content_key()}.msgpack'))
+        self.logger.info('Saved the dbt partial parse file to the cache.')
+        self.evict()
@@ -0,0 +1,193 @@
+import logging
+import time
+from typing import Dict, List, Optional
+
+from snowflake.connector import SnowflakeConnection, errors
+
+from src.retry import RetryPolicy
+
+
+class QueryStatusUnknown(Exception):
+    """
+    The status of a submitted query could not be read. The query may still be running on the server, so it must not
+    be submitted again.
+    """
+
+
+class AsyncQuery:
+    """
+    A statement submitted to Snowflake with `execute_async`.
+    """
+
+    def __init__(self, query_id: str, sql: str, label: Optional[str] = None):
+        self.query_id = query_id
+        self.sql = sql
+        self.label = label or sql
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.status = None
+        # Filled in from Snowflake's query history by AsyncQueryRunner.fetch_elapsed
+        self.elapsed_seconds = None
+
+    @property
+    def wall_seconds(self) -> Optional[float]:
+        """Seconds from submission until the poll that saw the query finish."""
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+
+class AsyncQueryRunner:
+    """
+    Submits statements as asynchronous Snowflake queries and polls them with exponential backoff. Several queries can
+    be waited on at once, so independent DDL runs side by side on the server.
+
+    A transient error while checking a query's status is retried against the same query ID rather than failing the
+    query, as the query itself may still be running. If the status still cannot be read, QueryStatusUnknown is
+    raised, which callers must not answer by submitting the statement again.
+    """
+
+    def __init__(self,
+                 con: SnowflakeConnection,
+                 poll_initial: float = 0.5,
+                 poll_max: float = 10,
+                 backoff: float = 1.5,
+                 retry: Optional[RetryPolicy] = None):
+        """
+        Args:
+            con: The Snowflake connection to submit queries on.
+            poll_initial: Seconds to wait before the second status check.
+            poll_max: The longest wait between status checks.
+            backoff: The multiplier applied to the wait after each check.
+            retry: The retry policy for status checks. Defaults to one from the `SNOWFLAKE_RETRY_*` env vars.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.con = con
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.backoff = backoff
+        self.retry = retry or RetryPolicy.from_env()
+
+    def submit(self, sql: str, label: Optional[str] = None, num_statements: Optional[int] = None) -> AsyncQuery:
+        """
+        Submits a statement without waiting for it to complete.
+
+        Args:
+            sql: The statement to run.
+            label: A short description used in logs. Defaults to the statement.
+            num_statements: The number of statements in `sql` when it holds several, separated by semicolons.
+
+        Returns:
+            The submitted AsyncQuery
+        """
+        cursor = self.con.cursor()
+        if num_statements:
+            cursor.execute_async(sql, num_statements=num_statements)
+        else:
+            cursor.execute_async(sql)
+        query = AsyncQuery(cursor.sfqid, sql, label)
+        self.logger.debug(f'Submitted query {query.query_id}: {query.label}')
+        return query
+
+    def wait(self, queries: List[AsyncQuery], timeout: Optional[float] = None) -> List[AsyncQuery]:
+        """
+        Polls until every query has finished. Raises the Snowflake error of the first failed query.
+
+        Args:
+            queries: The queries to wait on.
+            timeout: Give up after this many seconds. Waits forever if not set.
+
+        Returns:
+            The queries, with their final status set.
+        """
+        start = time.time()
+        delay = self.poll_initial
+        pending = list(queries)
+        while pending:
+            for query in list(pending):
+                status = self._status(query)
+                if not self.con.is_still_running(status):
+                    query.status = status.name
+                    query.finished_at = time.time()
+                    pending.remove(query)
+            if not pending:
+                break
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError(f'Timed out after {timeout} seconds waiting on queries '
+                                   f'{", ".join(x.query_id for x in pending)}')
+            time.sleep(delay)
+            delay = min(delay * self.backoff, self.poll_max)
+        return queries
+
+    def _status(self, query: AsyncQuery):
+        """
+        Reads the status of a query, raising its Snowflake error if it failed.
+        """
+        def retryable(error: BaseException) -> bool:
+            # A ProgrammingError is the query's own failure, which no amount of polling changes.
+            return self.retry.is_retryable(error) and not isinstance(error, errors.ProgrammingError)
+
+        try:
+            return self.retry.call(lambda: self.con.get_query_status_throw_if_error(query.query_id),
+                                   f'check the status of query {query.query_id}', retryable=retryable)
+        except Exception as e:
+            if not retryable(e):
+                raise
+            raise QueryStatusUnknown(f'Unable to read the status of query {query.query_id} ({query.label}): {e}') from e
+
+    def run(self, sql: str, label: Optional[str] = None) -> AsyncQuery:
+        """
+        Submits a statement and waits for it to complete.
+
+        Args:
+            sql: The statement to run.
+            label: A short description used in logs. Defaults to the statement.
+
+        Returns:
+            The finished AsyncQuery
+        """
+        return self.wait([self.submit(sql, label)])[0]
+
+    def run_batch(self, statements: List[str], label: Optional[str] = None) -> AsyncQuery:
+        """
+        Runs several statements in order as a single multi-statement query, so they cost one submission and one set
+        of status checks instead of one each. Snowflake stops at the first failed statement. The statements before it
+        stay applied, as DDL always commits straight away.
+
+        Args:
+            statements: The statements to run, in order.
+            label: A short description used in logs.
+
+        Returns:
+            The finished AsyncQuery
+        """
+        statements = [x.strip().rstrip(';') + ';' for x in statements]
+        return self.wait([self.submit('\n'.join(statements), label, num_statements=len(statements))])[0]
+
+    def fetch_elapsed(self, queries: List[AsyncQuery]) -> Dict[str, float]:
+        """
+        Looks up the server side duration of finished queries in the session's query history and stores it on each
+        query as `elapsed_seconds`. Queries missing from the history fall back to the polled wall clock time.
+
+        Args:
+            queries: The finished queries.
+
+        Returns:
+            A dict of query ID to elapsed seconds.
+        """
+        elapsed = {}
+        query_ids = ', '.join(f"'{x.query_id}'" for x in queries)
+        try:
+            cursor = self.con.cursor()
+            cursor.execute(f'select query_id, total_elapsed_time '
+                           f'from table(information_schema.query_history_by_session(result_limit => 10000)) '
+                           f'where query_id in ({query_ids});')
+            for query_id, total_elapsed_ms in cursor.fetchall():
+                elapsed[query_id] = total_elapsed_ms / 1000
+        except Exception as e:
+            self.logger.debug(f'Unable to read query history: {e}')
+
+        for query in queries:
+            query.elapsed_seconds = elapsed.get(query.query_id, query.wall_seconds)
+            elapsed[query.query_id] = query.elapsed_seconds
+        return elapsed
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
 
 from snowflake.connector import connect as sf_connect
 from snowflake.connector import SnowflakeConnection
@@ -8,6 +9,7 @@ import threading
 import os
 import argparse
 import logging
+from src.async_query import AsyncQuery, AsyncQueryRunner
 from src.core import Core
 
 class CloneDB(Core):
@@ -28,12 +30,15 @@ class CloneDB(Core):
                  user: Optional[str] = None,
                  password: Optional[str] = None,
                  query_tag: Optional[str] = None,
-                 unit_test: Optional[bool] = False):
+                 unit_test: Optional[bool] = False,
+                 clone_by_schema: Optional[bool] = None):
         """
         Blue/Green deployment for Snowflake databases.
         Args:
             blue_database: The current production database.
             green_database: The temporary database where the build will occur.
+            clone_by_schema: Clone each schema individually on a pool of `thread_count` workers instead of issuing a
+                             single `create database ... clone`. Defaults to the `CLONE_BY_SCHEMA` env var.
         """
         super().__init__(blue_database,
                          green_database,
@@ -54,8 +59,9 @@ class CloneDB(Core):
         self.time_check = self.start_time
         self._list_of_schemas_to_exclude = ['INFORMATION_SCHEMA', 'ACCOUNT_USAGE', 'SECURITY', 'SNOWFLAKE', 'UTILS',
                                             'PUBLIC']
-
-
+        if clone_by_schema is None:
+            clone_by_schema = os.environ.get('CLONE_BY_SCHEMA', 'false').lower() == 'true'
+        self._clone_by_schema = clone_by_schema
 
     def clone_blue_db_to_green(self):
         """
@@ -68,10 +74,32 @@ class CloneDB(Core):
         self.time_check = time.time()
         self.logger.info(f"Cloning blue DB {self.blue_database} to green DB {self.green_database}")
         # Clone the blue DB to the green DB
-        self.clone_database(self.blue_database, self.green_database)
-        # self.clone_database_schemas(self.blue_database, self.green_database)
+        if self._clone_by_schema:
+            self.clone_database_schemas(self.blue_database, self.green_database)
+        else:
+            query = self.clone_database(self.blue_database, self.green_database)
+            if query is not None:
+                AsyncQueryRunner(self.con).fetch_elapsed([query])
+                self.logger.info(f'Snowflake reports the clone took {query.elapsed_seconds} seconds '
+                                 f'(query ID {query.query_id}).')
         self.logger.info(f"Cloning complete. Blue DB {self.blue_database} cloned to green DB {self.green_database}")
-        self.logger.info(f'Clone process took {time.time() - self.start_time} seconds.')
+        self.logger.info(f'Clone process took {time.time() - self.time_check} seconds.')
+
+    def clone_schemas_to_green(self, schemas: List[str]):
+        """
+        Entry point for schema swap mode. Clones only the given schemas from the blue database to the green database.
+
+        Args:
+            schemas: The names of the schemas to clone.
+
+        Returns:
+            None
+        """
+        self.time_check = time.time()
+        self.logger.info(f"Cloning schemas {', '.join(schemas)} from blue DB {self.blue_database} to green DB "
+                         f"{self.green_database}")
+        self.clone_database_schemas(self.blue_database, self.green_database, schemas)
+        self.logger.info(f'Clone process took {time.time() - self.time_check} seconds.')
 
     def drop_database(self):
         """
@@ -82,9 +110,10 @@ class CloneDB(Core):
             None
         """
         self.logger.info(f"Dropping green DB: {self.green_database}")
-        self.con.cursor().execute(f"drop database if exists {self.green_database};")
+        sql = f"drop database if exists {self.green_database};"
+        self._retry.call(lambda: self._execute_ddl(sql), f'drop {self.green_database}')
 
-    def clone_database(self, blue_database: str, green_database: str):
+    def clone_database(self, blue_database: str, green_database: str) -> AsyncQuery:
         """
         Clones the the blue database to the green database
 
@@ -93,10 +122,96 @@ class CloneDB(Core):
             blue_database: The name of the blue database (prod)
 
         Returns:
-            None
+            The finished clone query, or None if a retried clone turned out to have succeeded.
         """
         clone_sql =  f"create database {green_database} clone {blue_database};"
-        self.con.cursor().execute(clone_sql)
+        return self._retry.call(lambda: self._execute_ddl(clone_sql)[0], f'clone {blue_database} to {green_database}',
+                                is_done=lambda: self._check_if_database_exists(green_database))
+
+    def clone_database_schemas(self, blue_database: str, green_database: str,
+                               schemas: Optional[List[str]] = None) -> Dict[str, float]:
+        """
+        Creates an empty green database and clones each schema of the blue database into it concurrently. A full copy
+        matches `create database ... clone`: every schema but INFORMATION_SCHEMA is cloned, and the empty PUBLIC
+        schema Snowflake creates with the database is replaced by the blue database's own.
+
+        Args:
+            blue_database: The name of the blue database (prod)
+            green_database: The name of the green database (staging).
+            schemas: Only clone these schemas. Schemas that do not exist in the blue database are created empty.
+                     Defaults to every schema in the blue database.
+
+        Returns:
+            A dict of schema name to the number of seconds the clone of that schema took.
+        """
+        create_sql = f"create database {green_database};"
+        self._retry.call(lambda: self._execute_ddl(create_sql), f'create {green_database}',
+                         is_done=lambda: self._check_if_database_exists(green_database))
+        blue_schemas = self.list_schemas(blue_database)
+        if schemas is None:
+            drop_sql = f'drop schema if exists {green_database}."PUBLIC";'
+            self._retry.call(lambda: self._execute_ddl(drop_sql), f'drop {green_database}.PUBLIC')
+            schemas = [x for x in blue_schemas if x != 'INFORMATION_SCHEMA']
+        else:
+            new_schemas = [x for x in schemas if x not in blue_schemas]
+            for schema in new_schemas:
+                self.logger.info(f'Schema {schema} does not exist in {blue_database}. Creating it empty.')
+            statements = [f'create schema if not exists {green_database}."{x}";' for x in new_schemas]
+            self._retry.call(lambda: self._execute_ddl(*statements), f'create schemas in {green_database}')
+            schemas = [x for x in schemas if x in blue_schemas]
+        self.logger.info(f'Cloning {len(schemas)} schemas from {blue_database} with {self._thread_count} threads')
+
+        timings = {}
+        with ThreadPoolExecutor(max_workers=max(1, self._thread_count)) as executor:
+            futures = {executor.submit(self.clone_schema, blue_database, green_database, schema): schema
+                       for schema in schemas}
+            for future in as_completed(futures):
+                schema = futures[future]
+                timings[schema] = future.result()
+                self.logger.info(f'Cloned schema {schema} in {timings[schema]:.2f} seconds.')
+
+        if timings:
+            slowest = max(timings, key=timings.get)
+            self.logger.info(f'Schema clone total {sum(timings.values()):.2f} seconds across {len(timings)} schemas. '
+                             f'Slowest schema {slowest} took {timings[slowest]:.2f} seconds.')
+        return timings
+
+    def clone_schema(self, blue_database: str, green_database: str, schema: str) -> float:
+        """
+        Clones a single schema from the blue database into the green database.
+
+        Args:
+            blue_database: The name of the blue database (prod)
+            green_database: The name of the green database (staging).
+            schema: The name of the schema to clone.
+
+        Returns:
+            The number of seconds the clone took, as reported by Snowflake.
+        """
+        runner = AsyncQueryRunner(self.con, retry=self._retry)
+        sql = f'create schema {green_database}."{schema}" clone {blue_database}."{schema}";'
+        query = self._retry.call(lambda: runner.run(sql), f'clone schema {schema} to {green_database}',
+                                 is_done=lambda: schema in self.list_schemas(green_database))
+        if query is None:
+            # A retried clone that had already succeeded. Its duration is unknown.
+            return 0.0
+        runner.fetch_elapsed([query])
+        return query.elapsed_seconds
+
+    def list_schemas(self, database: str) -> List[str]:
+        """
+        Lists the schemas in a database.
+
+        Args:
+            database: The name of the database.
+
+        Returns:
+            A list of schema names.
+        """
+        cursor = self.con.cursor()
+        cursor.execute(f"show schemas in database {database};")
+        name_index = [x[0] for x in cursor.description].index('name')
+        return [row[name_index] for row in cursor.fetchall()]
 
 if __name__ == "__main__":
     '''
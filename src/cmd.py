@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 
+from src.garbage_collector import DatabaseGarbageCollector
 from src.main import DBTBlueGreen
+from src.multi_target import DeployTarget, MultiTargetDeploy
 from src.logging_setup import setup_logging
 
 if __name__ == "__main__":
@@ -50,11 +53,69 @@ if __name__ == "__main__":
     # green DB still exists after 10 minutes, the system will drop the green DB and proceed with the blue/green swap.
     parser.add_argument('--stomp-on-green', action='store_true', help='If set, the script will test if the green DB exists, wait 10 min, then drop the green database if whatever process created it is not complete. ')
 
+    parser.add_argument('--clone-by-schema', action='store_true', default=None,
+                        help='Clone the blue database one schema at a time on a thread pool instead of with a single '
+                             'database clone.')
+
+    parser.add_argument('--schema-swap', action='store_true',
+                        help='Only clone, build and swap the schemas written to by the dbt selection instead of the '
+                             'whole database.')
+
+    parser.add_argument('--use-lease', action='store_true',
+                        help='Queue for a lease on the green database instead of checking whether it exists. The '
+                             'lease tables live in the schema set by the BLUE_GREEN_LEASE_SCHEMA env var.')
+
+    parser.add_argument('--use-standby', action='store_true', default=None,
+                        help='Claim the pre-cloned standby database instead of cloning the blue database, and refresh '
+                             'the standby after a successful run.')
+    parser.add_argument('--refresh-standby', action='store_true',
+                        help='Instead of a deploy, replace the standby database with a fresh clone of the blue '
+                             'database. Meant to be scheduled.')
+
+    parser.add_argument('--warehouse-size', type=str,
+                        help='Resize the DATACOVES__MAIN__WAREHOUSE warehouse to this size, such as MEDIUM, for the '
+                             'build and restore it afterwards.')
+
+    parser.add_argument('--targets', type=str,
+                        help='Deploy several databases from the project in one process, as a comma separated list of '
+                             'BLUE or BLUE:GREEN pairs. Replaces --blue-db and --green-db.')
+    parser.add_argument('--max-concurrency', type=int,
+                        help='With --targets, the most databases deployed at once. Defaults to the '
+                             'BLUE_GREEN_MAX_CONCURRENCY env var, or 4.')
+
+    parser.add_argument('--garbage-collect', action='store_true',
+                        help='Instead of a deploy, drop the staging and _ERROR databases of the blue database that are '
+                             'past their retention period.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='With --garbage-collect, only list the databases that would be dropped.')
+    parser.add_argument('--staging-retention-hours', type=float,
+                        help='With --garbage-collect, drop staging databases older than this. Defaults to the '
+                             'BLUE_GREEN_STAGING_RETENTION_HOURS env var, or 24.')
+    parser.add_argument('--error-retention-hours', type=float,
+                        help='With --garbage-collect, drop _ERROR databases older than this. Defaults to the '
+                             'BLUE_GREEN_ERROR_RETENTION_HOURS env var, or 168.')
+    parser.add_argument('--keep-errors', type=int,
+                        help='With --garbage-collect, always keep this many of the newest _ERROR databases. Defaults '
+                             'to the BLUE_GREEN_KEEP_ERROR_DATABASES env var, or 1.')
+    parser.add_argument('--gc-other-staging', action='store_true', default=None,
+                        help='With --garbage-collect, also drop other <blue>_..._STAGING databases past the staging '
+                             'retention, such as the ones left by --no-swap runs. Defaults to the '
+                             'BLUE_GREEN_GC_OTHER_STAGING env var, or false.')
+
     args = parser.parse_args()
 
-    dbt = DBTBlueGreen(blue_database=args.blue_db, green_database=args.green_db)
-    print('launch_blue_green.py. Starting run.')
-    dbt.main(
+    if args.garbage_collect:
+        collector = DatabaseGarbageCollector(blue_database=args.blue_db, green_database=args.green_db,
+                                             query_tag=args.query_tag,
+                                             staging_retention_hours=args.staging_retention_hours,
+                                             error_retention_hours=args.error_retention_hours,
+                                             keep_errors=args.keep_errors,
+                                             drop_other_staging=args.gc_other_staging)
+        collector.collect(dry_run=args.dry_run)
+        collector.close()
+        raise SystemExit(0)
+
+    main_kwargs = dict(
         snapshot_select=args.snapshot_select,
         snapshot_exclude=args.snapshot_exclude,
         seed_select=args.seed_select,
@@ -73,5 +134,27 @@ if __name__ == "__main__":
         drop_on_existing_db=args.drop_on_existing_db,
         fail_fast=args.fail_fast,
         dbt_target=args.dbt_target,
-        stomp_on_green=args.stomp_on_green
+        stomp_on_green=args.stomp_on_green,
+        clone_by_schema=args.clone_by_schema,
+        schema_swap=args.schema_swap,
+        use_lease=args.use_lease,
+        use_standby=args.use_standby,
+        warehouse_size=args.warehouse_size
     )
+
+    if args.targets:
+        max_concurrency = args.max_concurrency or int(os.environ.get('BLUE_GREEN_MAX_CONCURRENCY', 4))
+        deploy = MultiTargetDeploy([DeployTarget.parse(x) for x in args.targets.split(',') if x.strip()],
+                                   max_concurrency=max_concurrency, query_tag=args.query_tag,
+                                   database_env_var=os.environ.get('BLUE_GREEN_DBT_DATABASE_ENV_VAR',
+                                                                   'DATACOVES__MAIN__DATABASE'))
+        print('launch_blue_green.py. Starting multi-target run.')
+        outcomes = deploy.run(**main_kwargs)
+        raise SystemExit(0 if all(x.success for x in outcomes) else 1)
+
+    dbt = DBTBlueGreen(blue_database=args.blue_db, green_database=args.green_db, query_tag=args.query_tag)
+    if args.refresh_standby:
+        dbt.refresh_standby(wait=True)
+        raise SystemExit(0)
+    print('launch_blue_green.py. Starting run.')
+    dbt.main(**main_kwargs)
@@ -0,0 +1,249 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from snowflake.connector import SnowflakeConnection
+
+
+class PooledSession:
+    """
+    A Snowflake session held by the pool, along with the query tag it is currently set to and the number of callers
+    using it.
+    """
+
+    def __init__(self, con: SnowflakeConnection, query_tag: str):
+        self.con = con
+        self.query_tag = query_tag
+        self.users = 0
+        self.last_used = time.time()
+
+
+class ConnectionPool:
+    """
+    A pool of Snowflake sessions shared by every class in a run. Callers asking for the same query tag share the same
+    session (the Snowflake connector is thread safe), so a run only logs in once per query tag. The pool never holds
+    more than `pool_size` sessions. When it is full, an idle session is re-tagged with `alter session` rather than
+    opening a new one.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 pool_size: int = 20,
+                 connect_function: Optional[Callable[..., SnowflakeConnection]] = None,
+                 health_check_interval: float = 300,
+                 **connect_kwargs):
+        """
+        Args:
+            pool_size: The maximum number of open sessions.
+            connect_function: A function that takes `query_tag` and `connect_kwargs` and returns a new connection.
+            health_check_interval: Idle sessions older than this many seconds are checked with `select 1` before
+                                   they are reused.
+            connect_kwargs: Keyword arguments passed to `connect_function`, such as account, user and password.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.pool_size = max(1, pool_size)
+        self.health_check_interval = health_check_interval
+        self._connect_function = connect_function
+        self._connect_kwargs = connect_kwargs
+        self._sessions: List[PooledSession] = []
+        self._pending = 0
+        self._condition = threading.Condition()
+        self.logins = 0
+
+    @classmethod
+    def get_shared(cls, pool_size: int = 20, **kwargs) -> 'ConnectionPool':
+        """
+        Returns the pool shared by the whole process, creating it on first use. Later callers asking for a larger
+        pool grow it to their size.
+
+        Args:
+            pool_size: The minimum pool size the caller needs. This follows the configured thread count.
+            kwargs: Passed to the constructor when the pool is created.
+
+        Returns:
+            The shared ConnectionPool
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(pool_size=pool_size, **kwargs)
+                atexit.register(cls._shared.close_all)
+            else:
+                cls._shared.resize(pool_size)
+            return cls._shared
+
+    @classmethod
+    def reset_shared(cls):
+        """
+        Closes and forgets the shared pool. Mostly useful for tests and benchmarks.
+
+        Returns:
+            None
+        """
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.close_all()
+            cls._shared = None
+
+    def resize(self, pool_size: int):
+        """
+        Grows the pool to at least `pool_size` sessions.
+
+        Args:
+            pool_size: The new minimum pool size.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            if pool_size > self.pool_size:
+                self.pool_size = pool_size
+                self._condition.notify_all()
+
+    def acquire(self, query_tag: str) -> SnowflakeConnection:
+        """
+        Gets a session for a query tag. Must be paired with a call to `release`.
+
+        Args:
+            query_tag: The QUERY_TAG the session should be set to.
+
+        Returns:
+            A Snowflake connection
+        """
+        with self._condition:
+            while True:
+                session = self._find_session(query_tag)
+                if session is not None:
+                    session.users += 1
+                    session.last_used = time.time()
+                    return session.con
+
+                if len(self._sessions) + self._pending < self.pool_size:
+                    self._pending += 1
+                    break
+
+                idle = [x for x in self._sessions if x.users == 0]
+                if idle:
+                    session = min(idle, key=lambda x: x.last_used)
+                    if self._retag(session, query_tag):
+                        session.users += 1
+                        session.last_used = time.time()
+                        return session.con
+                    continue
+
+                self._condition.wait()
+
+        # Log in outside of the lock so other threads can keep using existing sessions.
+        try:
+            con = self._connect_function(query_tag=query_tag, **self._connect_kwargs)
+        except Exception:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._pending -= 1
+            self.logins += 1
+            session = PooledSession(con, query_tag)
+            session.users = 1
+            self._sessions.append(session)
+            self.logger.info(f'Opened Snowflake session {self.logins} with query tag {query_tag} '
+                             f'({len(self._sessions)} of {self.pool_size} pooled sessions in use).')
+            return con
+
+    def release(self, con: SnowflakeConnection):
+        """
+        Returns a session acquired with `acquire` to the pool. The session is kept open for reuse.
+
+        Args:
+            con: The connection to release.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            for session in self._sessions:
+                if session.con is con:
+                    session.users = max(0, session.users - 1)
+                    session.last_used = time.time()
+            self._condition.notify_all()
+
+    @contextmanager
+    def connection(self, query_tag: str):
+        """
+        Context manager that acquires a session for the duration of the block.
+
+        Args:
+            query_tag: The QUERY_TAG the session should be set to.
+
+        Yields:
+            A Snowflake connection
+        """
+        con = self.acquire(query_tag)
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def close_all(self):
+        """
+        Closes every pooled session and logs the number of logins made during the run.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            sessions = self._sessions
+            self._sessions = []
+        for session in sessions:
+            try:
+                session.con.close()
+            except Exception as e:
+                self.logger.debug(f'Error closing Snowflake session: {e}')
+        if self.logins:
+            self.logger.info(f'Snowflake logins this run: {self.logins}')
+
+    def _find_session(self, query_tag: str) -> Optional[PooledSession]:
+        """
+        Finds a healthy session already set to the query tag. Unhealthy sessions are dropped from the pool. Must be
+        called while holding the pool lock.
+        """
+        for session in list(self._sessions):
+            if session.query_tag != query_tag:
+                continue
+            if self._is_healthy(session):
+                return session
+            self._sessions.remove(session)
+        return None
+
+    def _retag(self, session: PooledSession, query_tag: str) -> bool:
+        """
+        Points an idle session at a new query tag. Returns False, and drops the session, if it is no longer usable.
+        Must be called while holding the pool lock.
+        """
+        try:
+            if not self._is_healthy(session):
+                raise Exception('session failed its health check')
+            session.con.cursor().execute(f"alter session set query_tag = '{query_tag}';")
+            session.query_tag = query_tag
+            return True
+        except Exception as e:
+            self.logger.info(f'Discarding pooled Snowflake session: {e}')
+            self._sessions.remove(session)
+            return False
+
+    def _is_healthy(self, session: PooledSession) -> bool:
+        if session.con.is_closed():
+            return False
+        if session.users == 0 and time.time() - session.last_used > self.health_check_interval:
+            try:
+                session.con.cursor().execute('select 1;')
+            except Exception as e:
+                self.logger.info(f'Pooled Snowflake session failed its health check: {e}')
+                return False
+        return True
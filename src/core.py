@@ -1,5 +1,6 @@
 import time
-from typing import Optional
+from datetime import datetime
+from typing import Dict, List, Optional
 
 from snowflake.connector import connect as sf_connect
 from snowflake.connector import SnowflakeConnection
@@ -8,6 +9,14 @@ import os
 import argparse
 import logging
 
+from src.async_query import AsyncQuery, AsyncQueryRunner
+from src.connection_pool import ConnectionPool
+from src.retry import RetryPolicy
+
+# The query tag of runs started without one. Unrelated runs share it, so it says nothing about who ran a query.
+DEFAULT_QUERY_TAG = 'blue_green_tag_not_set'
+
+
 class Core:
 
     def __init__(self,
@@ -35,23 +44,22 @@ class Core:
         self.time_check = self.start_time
         self._list_of_schemas_to_exclude = ['INFORMATION_SCHEMA', 'ACCOUNT_USAGE', 'SECURITY', 'SNOWFLAKE', 'UTILS',
                                             'PUBLIC']
+        self._query_tag = DEFAULT_QUERY_TAG if not query_tag else f'{query_tag}_blue_green'
+        self._retry = RetryPolicy.from_env()
+        self._warehouse = os.environ.get('DATACOVES__MAIN__WAREHOUSE', warehouse)
+        self.con = None
         if not self.unit_test:
-            account=os.environ.get('DATACOVES__MAIN__ACCOUNT', account),
-            warehouse=os.environ.get('DATACOVES__MAIN__WAREHOUSE', warehouse),
-            database=os.environ.get('DATACOVES__MAIN__DATABASE', database),
-            role=os.environ.get('DATACOVES__MAIN__ROLE', role),
-            schema=os.environ.get('DATACOVES__MAIN__SCHEMA', schema),
-            user=os.environ.get('DATACOVES__MAIN__USER', user),
-            password=os.environ.get('DATACOVES__MAIN__PASSWORD', password),
-            query_tag = 'blue_green_tag_not_set' if not query_tag else f'{query_tag}_blue_green'
-            self.con = self.snowflake_connection(query_tag=query_tag,
-                                                 account=account,
-                                                 warehouse=warehouse,
-                                                 database=database,
-                                                 role=role,
-                                                 schema=schema,
-                                                 user=user,
-                                                 password=password)
+            # Every class in the run shares one pool, so sessions with the same query tag are only logged in once.
+            self.pool = ConnectionPool.get_shared(pool_size=thread_count,
+                                                  connect_function=self.snowflake_connection,
+                                                  account=os.environ.get('DATACOVES__MAIN__ACCOUNT', account),
+                                                  warehouse=self._warehouse,
+                                                  database=os.environ.get('DATACOVES__MAIN__DATABASE', database),
+                                                  role=os.environ.get('DATACOVES__MAIN__ROLE', role),
+                                                  schema=os.environ.get('DATACOVES__MAIN__SCHEMA', schema),
+                                                  user=os.environ.get('DATACOVES__MAIN__USER', user),
+                                                  password=os.environ.get('DATACOVES__MAIN__PASSWORD', password))
+            self.con = self.pool.acquire(self._query_tag)
         if blue_database is None:
             self.blue_database = os.environ.get('DATACOVES__MAIN__DATABASE', None)
             if self.blue_database is None:
@@ -64,6 +72,79 @@ class Core:
             self.green_database = green_database
         self._thread_count = thread_count
 
+    def _execute_ddl(self, *statements: str) -> List[AsyncQuery]:
+        """
+        Submits one or more independent statements as asynchronous queries and waits for all of them to finish.
+        Statements that depend on each other must be passed in separate calls.
+
+        Args:
+            statements: The SQL statements to run.
+
+        Returns:
+            The finished queries, with their Snowflake query IDs.
+        """
+        runner = AsyncQueryRunner(self.con, retry=self._retry)
+        return runner.wait([runner.submit(sql) for sql in statements])
+
+    def _execute_batch(self, *statements: str, label: Optional[str] = None) -> AsyncQuery:
+        """
+        Runs statements that must happen in order as one multi-statement query, in a single round trip. Snowflake
+        does not allow DDL inside an explicit transaction, so a failure part way leaves the earlier statements
+        applied.
+
+        Args:
+            statements: The SQL statements to run, in order.
+            label: A short description used in logs.
+
+        Returns:
+            The finished query, with its Snowflake query ID.
+        """
+        return AsyncQueryRunner(self.con, retry=self._retry).run_batch(list(statements), label)
+
+    def _check_if_database_exists(self, database):
+        """
+        Check if the green database exists and fail if it does
+
+        Returns:
+            None
+        """
+        query = f"SHOW DATABASES LIKE '{database}'"
+        cursor = self.con.cursor()
+        cursor.execute(query)
+        result = cursor.fetchone()
+        if result is not None:
+            return True
+        else:
+            return False
+
+    def _created_on(self, show_sql: str) -> Dict[str, datetime]:
+        """
+        Runs a `show databases` or `show schemas` command and returns when each object was created. Swaps and renames
+        keep the creation time of an object, so it tells which object ended up under which name.
+
+        Args:
+            show_sql: The show command.
+
+        Returns:
+            A dict of object name to creation time.
+        """
+        cursor = self.con.cursor()
+        cursor.execute(show_sql)
+        columns = [x[0] for x in cursor.description]
+        name_index, created_index = columns.index('name'), columns.index('created_on')
+        return {row[name_index]: row[created_index] for row in cursor.fetchall()}
+
+    def close(self):
+        """
+        Releases the Snowflake session back to the shared pool.
+
+        Returns:
+            None
+        """
+        if self.con is not None:
+            self.pool.release(self.con)
+            self.con = None
+
     @staticmethod
     def snowflake_connection(query_tag: str,
                              account: str,
@@ -0,0 +1,181 @@
+import json
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+# dbt's JSON log levels mapped to python logging levels.
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warn': logging.WARNING,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+# Node statuses that count as a failure of the run.
+FAILED_STATUSES = {'error', 'fail', 'runtime error'}
+
+
+class NodeStatus:
+    """
+    The state of one dbt node in the run. Only the fields needed for reporting are kept.
+    """
+
+    __slots__ = ('unique_id', 'status', 'execution_time', 'started_at', 'finished_at', 'message')
+
+    def __init__(self, unique_id: str):
+        self.unique_id = unique_id
+        self.status = 'started'
+        self.execution_time = None
+        self.started_at = None
+        self.finished_at = None
+        self.message = None
+
+
+class DbtRunStatus:
+    """
+    Builds a compact model of a dbt run from its structured log events as they stream in. Each event updates a small
+    record for its node and is then discarded, so memory grows with the number of nodes rather than the volume of
+    output.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.nodes: Dict[str, NodeStatus] = {}
+        self.status_counts = Counter()
+        # The totals from dbt's final StatsLine event, such as pass, warn, error and skip.
+        self.stats: Dict[str, int] = {}
+        self.success: Optional[bool] = None
+        self.elapsed: Optional[float] = None
+        self.events = 0
+        self.errors: List[str] = []
+
+    @property
+    def failed_nodes(self) -> List[NodeStatus]:
+        """The nodes that finished with an error or a failing test."""
+        return [x for x in self.nodes.values() if x.status in FAILED_STATUSES]
+
+    @property
+    def error_count(self) -> int:
+        """The number of errors reported by dbt, or counted from the finished nodes if no summary was seen."""
+        if 'error' in self.stats:
+            return self.stats['error']
+        return len(self.failed_nodes)
+
+    def handle_line(self, line: str) -> bool:
+        """
+        Parses one line of dbt output and logs it. Lines that are not JSON events are logged unchanged.
+
+        Args:
+            line: A line of dbt stdout.
+
+        Returns:
+            True if the line was a JSON log event.
+        """
+        line = line.strip()
+        if not line:
+            return False
+        if line.startswith('{'):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = None
+            if isinstance(event, dict) and 'info' in event:
+                self.handle_event(event)
+                info = event['info']
+                if info.get('msg'):
+                    self.logger.log(LOG_LEVELS.get(info.get('level'), logging.INFO), info['msg'])
+                return True
+        self.logger.info(line)
+        return False
+
+    def handle_event(self, event: dict):
+        """
+        Updates the status model from one dbt JSON log event.
+
+        Args:
+            event: A parsed dbt log event with `info` and `data` keys.
+
+        Returns:
+            None
+        """
+        self.events += 1
+        name = event['info'].get('name')
+        data = event.get('data') or {}
+
+        if name == 'NodeStart':
+            node_info = data.get('node_info') or {}
+            node = self._node(node_info.get('unique_id'))
+            if node is not None:
+                node.started_at = node_info.get('node_started_at')
+
+        elif name == 'NodeFinished':
+            node_info = data.get('node_info') or {}
+            run_result = data.get('run_result') or {}
+            node = self._node(node_info.get('unique_id'))
+            if node is not None:
+                self._finish_node(node, run_result.get('status') or node_info.get('node_status'),
+                                  run_result.get('execution_time'), run_result.get('message'))
+                node.started_at = node_info.get('node_started_at') or node.started_at
+                node.finished_at = node_info.get('node_finished_at')
+
+        elif name == 'StatsLine':
+            self.stats = {k: v for k, v in (data.get('stats') or {}).items() if isinstance(v, int)}
+
+        elif name == 'CommandCompleted':
+            self.success = data.get('success')
+            self.elapsed = data.get('elapsed')
+
+        elif name in ('MainEncounteredError', 'RunResultError', 'RunResultFailure'):
+            message = data.get('exc') or data.get('msg') or event['info'].get('msg')
+            if message and len(self.errors) < 100:
+                self.errors.append(message)
+
+    def add_run_results(self, results):
+        """
+        Updates the status model from the structured results of an in-process dbt run.
+
+        Args:
+            results: A dbt RunExecutionResult, or anything with a `results` list of RunResult objects.
+
+        Returns:
+            None
+        """
+        for result in getattr(results, 'results', None) or []:
+            node = self._node(result.node.unique_id)
+            status = getattr(result.status, 'value', result.status)
+            self._finish_node(node, str(status), result.execution_time, result.message)
+        self.elapsed = getattr(results, 'elapsed_time', self.elapsed)
+
+    def summary(self) -> str:
+        """
+        Returns a one line summary of the run.
+        """
+        counts = ', '.join(f'{k}={v}' for k, v in sorted(self.status_counts.items()))
+        slowest = max((x for x in self.nodes.values() if x.execution_time is not None),
+                      key=lambda x: x.execution_time, default=None)
+        text = f'{len(self.nodes)} nodes ({counts or "none finished"}), {self.error_count} errors'
+        if self.elapsed is not None:
+            text += f', {self.elapsed:.1f}s elapsed'
+        if slowest is not None:
+            text += f', slowest {slowest.unique_id} {slowest.execution_time:.1f}s'
+        return text
+
+    def _node(self, unique_id: Optional[str]) -> Optional[NodeStatus]:
+        if not unique_id:
+            return None
+        node = self.nodes.get(unique_id)
+        if node is None:
+            node = NodeStatus(unique_id)
+            self.nodes[unique_id] = node
+        return node
+
+    def _finish_node(self, node: NodeStatus, status: Optional[str], execution_time: Optional[float],
+                     message: Optional[str]):
+        if node.status != 'started':
+            self.status_counts[node.status] -= 1
+        node.status = (status or 'unknown').lower()
+        node.execution_time = execution_time
+        self.status_counts[node.status] += 1
+        if node.status in FAILED_STATUSES:
+            node.message = message
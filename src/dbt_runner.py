@@ -0,0 +1,139 @@
+import logging
+import os
+from typing import Any, List, Optional
+
+from src.dbt_events import DbtRunStatus
+
+try:
+    from dbt.cli.main import dbtRunner
+except ImportError:
+    dbtRunner = None
+
+
+class DbtCommandResult:
+    """
+    The outcome of a dbt command, whichever way it was run.
+    """
+
+    def __init__(self,
+                 command: str,
+                 success: bool,
+                 return_code: int = 0,
+                 results: Any = None,
+                 exception: Optional[BaseException] = None,
+                 status: Optional[DbtRunStatus] = None):
+        """
+        Args:
+            command: The dbt sub command, such as `build`.
+            success: True if dbt reported success.
+            return_code: The process exit code, or the equivalent for an in-process run.
+            results: The structured result from dbt's programmatic runner, such as a RunExecutionResult or a list of
+                     nodes for `ls`. None for subprocess runs.
+            exception: The exception raised inside dbt, if any.
+            status: The per-node status model of the run, built from dbt's log events or structured results.
+        """
+        self.command = command
+        self.success = success
+        self.return_code = return_code
+        self.results = results
+        self.exception = exception
+        self.status = status
+
+    def __bool__(self):
+        return self.success
+
+
+class InProcessDbtRunner:
+    """
+    Runs dbt commands inside this process with dbt's programmatic runner (`dbtRunner`, dbt-core 1.5+). This avoids
+    paying interpreter start up, adapter imports and project parsing for every command. The project is parsed once and
+    the manifest is handed to every later command in the run. `dbt deps` invalidates the manifest.
+    """
+
+    # Commands that load the project and can take a pre-parsed manifest.
+    MANIFEST_COMMANDS = {'build', 'run', 'test', 'seed', 'snapshot', 'compile', 'ls', 'list', 'run-operation'}
+    # Flags that change what the parse produces and must be passed to the parse as well.
+    PARSE_FLAGS = ('--target', '--vars', '--profile')
+
+    def __init__(self, project_dir: str):
+        """
+        Args:
+            project_dir: The dbt project directory.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.project_dir = os.path.abspath(project_dir)
+        self._manifest = None
+        self._manifest_key = None
+
+    @staticmethod
+    def is_available() -> bool:
+        """
+        Returns True if dbt-core with the programmatic runner is installed in this environment.
+        """
+        return dbtRunner is not None
+
+    def invoke(self, command: str, args: List[str]) -> DbtCommandResult:
+        """
+        Runs a dbt command.
+
+        Args:
+            command: The dbt sub command, such as `build`.
+            args: The command line arguments for the sub command.
+
+        Returns:
+            A DbtCommandResult
+        """
+        manifest = None
+        if command in self.MANIFEST_COMMANDS:
+            manifest = self.get_manifest(args)
+
+        result = self._invoke(command, args, manifest)
+        if command == 'deps':
+            # Installed packages change what the project parses to.
+            self._manifest = None
+        elif command == 'parse' and result.success:
+            self._manifest = result.results
+            self._manifest_key = self._parse_args(args)
+        return result
+
+    def get_manifest(self, args: List[str]):
+        """
+        Returns the parsed manifest for the project, parsing it if it has not been parsed with the same target and
+        vars yet.
+
+        Args:
+            args: The arguments of the command that needs the manifest.
+
+        Returns:
+            The dbt Manifest, or None if the parse failed.
+        """
+        parse_args = self._parse_args(args)
+        if self._manifest is None or self._manifest_key != parse_args:
+            self.logger.info('Parsing the dbt project once for this run.')
+            self.invoke('parse', parse_args)
+        return self._manifest
+
+    def _invoke(self, command: str, args: List[str], manifest=None) -> DbtCommandResult:
+        cli_args = [command] + args + ['--project-dir', self.project_dir]
+        if 'DBT_PROFILES_DIR' not in os.environ and '--profiles-dir' not in args and \
+                os.path.exists(os.path.join(self.project_dir, 'profiles.yml')):
+            cli_args += ['--profiles-dir', self.project_dir]
+
+        self.logger.info(f'Running in-process command: dbt {" ".join([command] + args)}')
+        runner = dbtRunner(manifest=manifest) if manifest is not None else dbtRunner()
+        res = runner.invoke(cli_args)
+        if res.exception is not None:
+            return_code = 2
+        else:
+            return_code = 0 if res.success else 1
+        status = DbtRunStatus()
+        status.success = res.success
+        status.add_run_results(res.result)
+        return DbtCommandResult(command, res.success, return_code, res.result, res.exception, status)
+
+    def _parse_args(self, args: List[str]) -> List[str]:
+        parse_args = []
+        for flag in self.PARSE_FLAGS:
+            if flag in args:
+                parse_args.extend([flag, args[args.index(flag) + 1]])
+        return parse_args
@@ -0,0 +1,216 @@
+import os
+import re
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from src.core import Core
+from src.green_waiter import GreenDatabaseWaiter
+from src.utilities import Utilities
+
+
+class OrphanedDatabase:
+    """
+    A staging or error database left behind by a blue/green run.
+    """
+
+    def __init__(self, name: str, kind: str, created_at: Optional[datetime]):
+        self.name = name
+        # `staging` for a green database, `error` for a failure snapshot.
+        self.kind = kind
+        self.created_at = created_at
+
+    @property
+    def age_hours(self) -> Optional[float]:
+        if self.created_at is None:
+            return None
+        return (Utilities.get_current_utc_time() - self.created_at).total_seconds() / 3600
+
+
+class DatabaseGarbageCollector(Core):
+    """
+    Finds the green database and its failure snapshots (`<green>_ERROR_<timestamp>`) left behind for a blue database
+    and drops the ones that are past their retention period. The newest failure snapshots are always kept, and a green
+    database with queries still running against it is never dropped.
+
+    Other `<blue>_..._STAGING` databases, such as the ones `--no-swap` runs for pull requests leave on purpose, are
+    only collected with `drop_other_staging`.
+    """
+
+    ERROR_SUFFIX = '_ERROR'
+    TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+    def __init__(self,
+                 blue_database: str,
+                 green_database: str = None,
+                 thread_count: int = 20,
+                 account: Optional[str] = None,
+                 warehouse: Optional[str] = None,
+                 database: Optional[str] = None,
+                 role: Optional[str] = None,
+                 schema: Optional[str] = None,
+                 user: Optional[str] = None,
+                 password: Optional[str] = None,
+                 query_tag: Optional[str] = None,
+                 unit_test: Optional[bool] = False,
+                 staging_retention_hours: Optional[float] = None,
+                 error_retention_hours: Optional[float] = None,
+                 keep_errors: Optional[int] = None,
+                 drop_other_staging: Optional[bool] = None):
+        """
+        Args:
+            blue_database: The production database. Only databases named after it are considered.
+            green_database: The green database used by deploys of the blue database.
+            staging_retention_hours: Drop green databases older than this. Defaults to the
+                                     `BLUE_GREEN_STAGING_RETENTION_HOURS` env var, or 24.
+            error_retention_hours: Drop failure snapshots older than this. Defaults to the
+                                   `BLUE_GREEN_ERROR_RETENTION_HOURS` env var, or 168.
+            keep_errors: Always keep this many of the newest failure snapshots. Defaults to the
+                         `BLUE_GREEN_KEEP_ERROR_DATABASES` env var, or 1.
+            drop_other_staging: Also collect other `<blue>_..._STAGING` databases and their failure snapshots.
+                                Defaults to the `BLUE_GREEN_GC_OTHER_STAGING` env var, or False.
+        """
+        super().__init__(blue_database,
+                         green_database,
+                         thread_count,
+                         account,
+                         warehouse,
+                         database,
+                         role,
+                         schema,
+                         user,
+                         password,
+                         query_tag,
+                         unit_test)
+
+        self.logger = logging.getLogger(__name__)
+        if staging_retention_hours is None:
+            staging_retention_hours = float(os.environ.get('BLUE_GREEN_STAGING_RETENTION_HOURS', 24))
+        if error_retention_hours is None:
+            error_retention_hours = float(os.environ.get('BLUE_GREEN_ERROR_RETENTION_HOURS', 168))
+        if keep_errors is None:
+            keep_errors = int(os.environ.get('BLUE_GREEN_KEEP_ERROR_DATABASES', 1))
+        self.staging_retention_hours = staging_retention_hours
+        self.error_retention_hours = error_retention_hours
+        if drop_other_staging is None:
+            drop_other_staging = os.environ.get('BLUE_GREEN_GC_OTHER_STAGING', 'false').lower() == 'true'
+        self.keep_errors = keep_errors
+        self.drop_other_staging = drop_other_staging
+
+    @classmethod
+    def error_database_name(cls, green_database: str, when: Optional[datetime] = None) -> str:
+        """
+        Returns the name a failed green database is renamed to, such as `ANALYTICS_STAGING_ERROR_20240101120000`.
+
+        Args:
+            green_database: The green database.
+            when: The time of the failure in UTC. Defaults to now.
+
+        Returns:
+            The failure snapshot name
+        """
+        when = when or Utilities.get_current_utc_time()
+        return f'{green_database}{cls.ERROR_SUFFIX}_{when.strftime(cls.TIMESTAMP_FORMAT)}'
+
+    def list_orphans(self) -> List[OrphanedDatabase]:
+        """
+        Lists the green database and its failure snapshots, and with `drop_other_staging` the other staging databases
+        of the blue database and their failure snapshots. Names are matched exactly, so a database that only shares
+        a prefix with the blue or green database, such as `PRODUCT_STAGING` for `PROD`, is never listed.
+
+        Returns:
+            The orphaned databases, oldest first.
+        """
+        greens = [re.escape(self.green_database)]
+        if self.drop_other_staging:
+            greens.append(rf'{re.escape(self.blue_database)}_.+_STAGING')
+        pattern = re.compile(rf'^(?P<green>{"|".join(greens)})'
+                             rf'(?P<error>{self.ERROR_SUFFIX}(_(?P<timestamp>\d{{14}}))?)?$', re.I)
+
+        prefixes = {self.green_database, self.blue_database} if self.drop_other_staging else {self.green_database}
+        rows = {}
+        for prefix in prefixes:
+            rows.update(self._show_databases(prefix))
+
+        orphans = []
+        for name, created_on in rows.items():
+            match = pattern.match(name)
+            if not match:
+                continue
+            created_at = self._to_utc(created_on)
+            if match.group('timestamp'):
+                # The rename keeps the creation time of the green database, so the failure time comes from the name.
+                created_at = datetime.strptime(match.group('timestamp'), self.TIMESTAMP_FORMAT)
+            orphans.append(OrphanedDatabase(name, 'error' if match.group('error') else 'staging', created_at))
+        return sorted(orphans, key=lambda x: x.created_at or datetime.min)
+
+    def _show_databases(self, prefix: str) -> List[tuple]:
+        """
+        Returns the name and creation time of the databases whose name starts with `prefix`.
+        """
+        cursor = self.con.cursor()
+        cursor.execute(f"show databases like '{prefix}%';")
+        columns = [x[0] for x in cursor.description]
+        name_index, created_index = columns.index('name'), columns.index('created_on')
+        return [(x[name_index], x[created_index]) for x in cursor.fetchall()]
+
+    def expired(self, orphans: List[OrphanedDatabase]) -> List[OrphanedDatabase]:
+        """
+        Applies the retention policy.
+
+        Args:
+            orphans: The databases from `list_orphans`.
+
+        Returns:
+            The databases that should be dropped.
+        """
+        expired = []
+        errors = sorted((x for x in orphans if x.kind == 'error'), key=lambda x: x.created_at or datetime.min,
+                        reverse=True)
+        for orphan in errors[self.keep_errors:]:
+            if orphan.age_hours is not None and orphan.age_hours > self.error_retention_hours:
+                expired.append(orphan)
+
+        for orphan in orphans:
+            if orphan.kind != 'staging' or orphan.age_hours is None or \
+                    orphan.age_hours <= self.staging_retention_hours:
+                continue
+            activity = GreenDatabaseWaiter(self.con, orphan.name, ignore_query_tags=[self._query_tag]).get_activity()
+            if activity is not None and activity.running:
+                self.logger.info(f'Keeping {orphan.name}: {activity.running} queries are still running against it.')
+                continue
+            expired.append(orphan)
+        return expired
+
+    def collect(self, dry_run: bool = False) -> List[str]:
+        """
+        Drops every expired staging and error database in parallel.
+
+        Args:
+            dry_run: Only log what would be dropped.
+
+        Returns:
+            The names of the expired databases.
+        """
+        orphans = self.list_orphans()
+        for orphan in orphans:
+            age = 'unknown age' if orphan.age_hours is None else f'{orphan.age_hours:.1f} hours old'
+            self.logger.info(f'Found {orphan.kind} database {orphan.name} ({age}).')
+
+        expired = [x.name for x in self.expired(orphans)]
+        if not expired:
+            self.logger.info('No expired staging or error databases.')
+        elif dry_run:
+            self.logger.info(f'Dry run. Would drop: {", ".join(expired)}')
+        else:
+            self.logger.info(f'Dropping expired databases: {", ".join(expired)}')
+            self._execute_ddl(*[f'drop database if exists {x};' for x in expired])
+        return expired
+
+    @staticmethod
+    def _to_utc(value) -> Optional[datetime]:
+        if not isinstance(value, datetime):
+            return None
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
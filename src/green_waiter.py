@@ -0,0 +1,162 @@
+import logging
+import time
+from typing import Callable, List, Optional
+
+from snowflake.connector import SnowflakeConnection
+
+from src.core import DEFAULT_QUERY_TAG
+
+
+class GreenActivity:
+    """
+    A summary of the queries other sessions have recently run against the green database.
+    """
+
+    def __init__(self, running: int, last_activity_seconds: Optional[float], query_tags: List[str]):
+        self.running = running
+        # Seconds since the most recent query touching the green database ended, or None if none were found.
+        self.last_activity_seconds = last_activity_seconds
+        self.query_tags = query_tags
+
+
+class GreenDatabaseWaiter:
+    """
+    Waits for another run to finish with the green database before it is stomped on. The database is checked on a
+    short, growing interval rather than once a minute. Query history is used to tell a run that is still working from
+    one that has been abandoned, so an abandoned green database can be dropped straight away.
+    """
+
+    def __init__(self,
+                 con: SnowflakeConnection,
+                 green_database: str,
+                 timeout_minutes: float = 10,
+                 idle_minutes: float = 5,
+                 initial_interval: float = 5,
+                 max_interval: float = 60,
+                 backoff: float = 2,
+                 ignore_query_tags: Optional[List[str]] = None):
+        """
+        Args:
+            con: The Snowflake connection to check with.
+            green_database: The green database another run may be using.
+            timeout_minutes: Stop waiting and drop the database after this many minutes.
+            idle_minutes: Treat the database as abandoned when nothing is running against it and no query has touched
+                          it for this many minutes.
+            initial_interval: Seconds to wait before the second check.
+            max_interval: The longest wait between checks.
+            backoff: The multiplier applied to the wait after each check.
+            ignore_query_tags: Query tags that do not identify the run using the green database, such as the caller's
+                               own tag. The default tag of untagged runs is always ignored.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.con = con
+        self.green_database = green_database
+        self.timeout_minutes = timeout_minutes
+        self.idle_minutes = idle_minutes
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.ignore_query_tags = sorted(set(ignore_query_tags or []) | {DEFAULT_QUERY_TAG})
+
+    def wait(self, database_exists: Callable[[str], bool]) -> bool:
+        """
+        Waits until the green database is gone, has been abandoned, or the timeout expires.
+
+        Args:
+            database_exists: A function that returns True if the named database exists.
+
+        Returns:
+            True if the green database still exists and should be dropped, False if it was removed by its owner.
+        """
+        start = time.time()
+        interval = self.initial_interval
+        while True:
+            if not database_exists(self.green_database):
+                self.logger.info(f'Green database {self.green_database} was removed by its owner after '
+                                 f'{time.time() - start:.0f} seconds.')
+                return False
+
+            activity = self.get_activity()
+            if activity is not None:
+                tags = ', '.join(activity.query_tags) or 'none'
+                self.logger.info(f'Green database {self.green_database}: {activity.running} running queries, '
+                                 f'last activity {activity.last_activity_seconds} seconds ago, query tags: {tags}')
+                # No history at all may just mean the other run's queries are not visible to this role, so only a
+                # database with a known idle period is treated as abandoned.
+                if activity.running == 0 and activity.last_activity_seconds is not None and \
+                        activity.last_activity_seconds > self.idle_minutes * 60:
+                    self.logger.info(f'Green database {self.green_database} has been idle for more than '
+                                     f'{self.idle_minutes} minutes and is treated as abandoned.')
+                    return True
+
+            elapsed = time.time() - start
+            if elapsed >= self.timeout_minutes * 60:
+                self.logger.info(f'Green database {self.green_database} still exists after '
+                                 f'{self.timeout_minutes} minutes.')
+                return True
+
+            sleep_for = min(interval, self.timeout_minutes * 60 - elapsed)
+            self.logger.info(f'Waiting {sleep_for:.0f} seconds for green database {self.green_database}')
+            time.sleep(sleep_for)
+            interval = min(interval * self.backoff, self.max_interval)
+
+    @staticmethod
+    def name_pattern(database: str) -> str:
+        """
+        Returns a regular expression matching a database name only where it is not part of a longer identifier.
+        """
+        name = ''.join('[$]' if x == '$' else x for x in database.upper())
+        return f'(^|[^A-Z0-9_$]){name}([^A-Z0-9_$]|$)'
+
+    def get_activity(self) -> Optional[GreenActivity]:
+        """
+        Reads the recent query history for queries from other sessions that touch the green database, either by
+        running in it or naming it as a whole identifier, so `<green>_STANDBY` or `<green>_ERROR_...` do not count.
+        Any other query carrying the same QUERY_TAG as those queries is counted too, so the other run's dbt work is seen
+        even when it does not name the green database. Tags in `ignore_query_tags` are shared with unrelated runs and
+        are not followed.
+
+        Returns:
+            A GreenActivity, or None if the query history could not be read.
+        """
+        lookback_minutes = int(max(self.idle_minutes, self.timeout_minutes)) + 1
+        green_filter = (f"database_name = '{self.green_database.upper()}' "
+                        f"or regexp_instr(query_text, '{self.name_pattern(self.green_database)}', 1, 1, 0, 'i') > 0")
+        ignored_tags = ', '.join("'" + x.replace("'", "''") + "'" for x in self.ignore_query_tags)
+        sql = f"""
+            with history as (
+                select execution_status, end_time, query_tag, database_name, query_text
+                from table(information_schema.query_history(
+                    end_time_range_start => dateadd('minute', -{lookback_minutes}, current_timestamp()),
+                    result_limit => 10000))
+                where session_id != current_session()
+            ),
+            green_tags as (
+                select distinct query_tag from history
+                where ({green_filter}) and coalesce(query_tag, '') != '' and query_tag not in ({ignored_tags})
+            )
+            select execution_status, end_time, query_tag,
+                   datediff('second', end_time, current_timestamp()) as seconds_since_end
+            from history
+            where ({green_filter}) or query_tag in (select query_tag from green_tags)
+        """
+        try:
+            cursor = self.con.cursor()
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        except Exception as e:
+            self.logger.info(f'Unable to read query history for {self.green_database}: {e}')
+            return None
+
+        running = 0
+        last_activity_seconds = None
+        query_tags = set()
+        for status, end_time, query_tag, seconds_since_end in rows:
+            if query_tag:
+                query_tags.add(query_tag)
+            if status in ('RUNNING', 'QUEUED', 'RESUMING_WAREHOUSE', 'BLOCKED'):
+                running += 1
+            elif seconds_since_end is not None:
+                if last_activity_seconds is None or seconds_since_end < last_activity_seconds:
+                    last_activity_seconds = seconds_since_end
+        return GreenActivity(running, last_activity_seconds, sorted(query_tags))
@@ -0,0 +1,323 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a lease holder finds that its lease has expired or been taken over.
+    """
+
+
+class LeaseBackend(ABC):
+    """
+    Stores leases and the queue of contenders waiting for them in two tables. Times are epoch seconds read from the
+    database's own clock, never from the contenders' clocks, so clock skew between runners cannot let two owners hold
+    a lease or expire a live one. Subclasses provide the connection, the placeholder style, the current time
+    expression and the statements that differ between databases.
+    """
+
+    placeholder = '%s'
+    # A SQL expression for the current epoch time in seconds on the database server.
+    now_sql = ''
+
+    def __init__(self, con, table_prefix: str = 'BLUE_GREEN'):
+        """
+        Args:
+            con: A DB-API connection.
+            table_prefix: Prefix for the lease and queue table names. May include a database and schema.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.con = con
+        self.lease_table = f'{table_prefix}_LEASES'
+        self.queue_table = f'{table_prefix}_LEASE_QUEUE'
+        self._lock = threading.Lock()
+
+    def setup(self):
+        """
+        Creates the lease tables if they do not exist.
+
+        Returns:
+            None
+        """
+        self._execute(f'create table if not exists {self.lease_table} (resource varchar primary key, '
+                      f'owner varchar, acquired_at float, heartbeat_at float, expires_at float)')
+        self._execute(f'create table if not exists {self.queue_table} (resource varchar, owner varchar, '
+                      f'enqueued_at float, heartbeat_at float)')
+
+    def try_acquire(self, resource: str, owner: str, ttl: float) -> bool:
+        """
+        Takes the lease on a resource if it is free, expired or already held by the owner.
+
+        Args:
+            resource: The name of the locked resource, such as the green database.
+            owner: A unique ID for the contender.
+            ttl: Seconds until the lease expires unless it is renewed with a heartbeat.
+
+        Returns:
+            True if the owner now holds the lease.
+        """
+        self._ensure_lease_row(resource)
+        p, now = self.placeholder, self.now_sql
+        self._execute(f'update {self.lease_table} set owner = {p}, acquired_at = {now}, heartbeat_at = {now}, '
+                      f'expires_at = {now} + {p} '
+                      f'where resource = {p} and (owner is null or owner = {p} or expires_at < {now})',
+                      (owner, ttl, resource, owner))
+        holder = self.holder(resource)
+        return holder is not None and holder[0] == owner
+
+    def heartbeat(self, resource: str, owner: str, ttl: float) -> bool:
+        """
+        Extends a held lease.
+
+        Returns:
+            False if the owner no longer holds the lease.
+        """
+        p, now = self.placeholder, self.now_sql
+        self._execute(f'update {self.lease_table} set heartbeat_at = {now}, expires_at = {now} + {p} '
+                      f'where resource = {p} and owner = {p}', (ttl, resource, owner))
+        holder = self.holder(resource)
+        return holder is not None and holder[0] == owner
+
+    def release(self, resource: str, owner: str):
+        """
+        Gives up a held lease. Does nothing if the owner does not hold it.
+
+        Returns:
+            None
+        """
+        p = self.placeholder
+        self._execute(f'update {self.lease_table} set owner = null, expires_at = 0 '
+                      f'where resource = {p} and owner = {p}', (resource, owner))
+
+    def holder(self, resource: str) -> Optional[Tuple[str, float]]:
+        """
+        Returns the owner and expiry time of an unexpired lease, or None if the resource is free.
+        """
+        p = self.placeholder
+        rows = self._execute(f'select owner, expires_at from {self.lease_table} '
+                             f'where resource = {p} and owner is not null and expires_at >= {self.now_sql}',
+                             (resource,), fetch=True)
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def enqueue(self, resource: str, owner: str):
+        """
+        Adds a contender to the back of the queue for a resource.
+
+        Returns:
+            None
+        """
+        p, now = self.placeholder, self.now_sql
+        self._execute(f'delete from {self.queue_table} where resource = {p} and owner = {p}', (resource, owner))
+        self._execute(f'insert into {self.queue_table} (resource, owner, enqueued_at, heartbeat_at) '
+                      f'select {p}, {p}, {now}, {now}', (resource, owner))
+
+    def dequeue(self, resource: str, owner: str):
+        """
+        Removes a contender from the queue.
+
+        Returns:
+            None
+        """
+        p = self.placeholder
+        self._execute(f'delete from {self.queue_table} where resource = {p} and owner = {p}', (resource, owner))
+
+    def queue_heartbeat(self, resource: str, owner: str):
+        """
+        Marks a queued contender as still waiting.
+
+        Returns:
+            None
+        """
+        p = self.placeholder
+        self._execute(f'update {self.queue_table} set heartbeat_at = {self.now_sql} '
+                      f'where resource = {p} and owner = {p}', (resource, owner))
+
+    def queue_head(self, resource: str, stale_after: float) -> Optional[str]:
+        """
+        Drops contenders that stopped sending heartbeats and returns the owner at the front of the queue.
+
+        Args:
+            resource: The name of the locked resource.
+            stale_after: Seconds without a heartbeat after which a queued contender is dropped.
+
+        Returns:
+            The owner at the front of the queue, or None if the queue is empty.
+        """
+        p = self.placeholder
+        self._execute(f'delete from {self.queue_table} where resource = {p} and heartbeat_at < {self.now_sql} - {p}',
+                      (resource, stale_after))
+        rows = self._execute(f'select owner from {self.queue_table} where resource = {p} '
+                             f'order by enqueued_at, owner limit 1', (resource,), fetch=True)
+        return rows[0][0] if rows else None
+
+    @abstractmethod
+    def _ensure_lease_row(self, resource: str):
+        """
+        Inserts a free lease row for the resource if there is none.
+        """
+
+    def _execute(self, sql: str, params: tuple = (), fetch: bool = False):
+        with self._lock:
+            cursor = self.con.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall() if fetch else None
+
+
+class SnowflakeLeaseBackend(LeaseBackend):
+    """
+    Lease tables stored in Snowflake. The tables must live outside the blue and green databases so they are not
+    cloned or swapped, for example in an admin schema set by `BLUE_GREEN_LEASE_SCHEMA`.
+    """
+
+    now_sql = 'date_part(epoch_millisecond, current_timestamp()) / 1000'
+
+    def __init__(self, con, schema: str):
+        """
+        Args:
+            con: A Snowflake connection.
+            schema: The fully qualified schema holding the lease tables, such as `ADMIN.BLUE_GREEN`.
+        """
+        super().__init__(con, f'{schema}.BLUE_GREEN')
+
+    def _ensure_lease_row(self, resource: str):
+        # Snowflake does not enforce primary keys, so a merge is used to avoid duplicate rows.
+        self._execute(f'merge into {self.lease_table} t using (select %s as resource) s on t.resource = s.resource '
+                      f'when not matched then insert (resource, owner, expires_at) values (s.resource, null, 0)',
+                      (resource,))
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Lease tables stored in a local SQLite database. Used by the tests and for local runs.
+    """
+
+    placeholder = '?'
+    # strftime('%s') only has whole seconds.
+    now_sql = "((julianday('now') - 2440587.5) * 86400.0)"
+
+    def __init__(self, path: str = ':memory:'):
+        """
+        Args:
+            path: The SQLite database file.
+        """
+        super().__init__(sqlite3.connect(path, check_same_thread=False, isolation_level=None))
+
+    def _ensure_lease_row(self, resource: str):
+        self._execute(f'insert or ignore into {self.lease_table} (resource, owner, expires_at) values (?, null, 0)',
+                      (resource,))
+
+
+class Lease:
+    """
+    A lease on a named resource. `acquire` joins a FIFO queue of contenders and waits its turn. The holder keeps the
+    lease alive from a background heartbeat thread, so a lease left by a crashed run expires after `ttl` seconds.
+    """
+
+    def __init__(self,
+                 backend: LeaseBackend,
+                 resource: str,
+                 owner: Optional[str] = None,
+                 ttl: float = 300,
+                 heartbeat_interval: Optional[float] = None,
+                 poll_interval: float = 5,
+                 timeout: Optional[float] = None):
+        """
+        Args:
+            backend: Where the lease is stored.
+            resource: The name of the resource to lock, such as the green database.
+            owner: A unique ID for this contender. Defaults to host, process ID and a random suffix.
+            ttl: Seconds a lease or queue entry survives without a heartbeat.
+            heartbeat_interval: Seconds between heartbeats. Defaults to a third of the ttl.
+            poll_interval: Seconds between checks while queued.
+            timeout: Give up waiting after this many seconds. Waits forever if not set.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self.resource = resource
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval or ttl / 3
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def acquire(self):
+        """
+        Queues for the lease and blocks until it is held.
+
+        Returns:
+            None
+        """
+        start = time.time()
+        self.backend.enqueue(self.resource, self.owner)
+        try:
+            while True:
+                self.backend.queue_heartbeat(self.resource, self.owner)
+                head = self.backend.queue_head(self.resource, stale_after=self.ttl)
+                if head == self.owner and self.backend.try_acquire(self.resource, self.owner, self.ttl):
+                    break
+                if self.timeout is not None and time.time() - start > self.timeout:
+                    raise TimeoutError(f'Timed out after {self.timeout} seconds waiting for the lease on '
+                                       f'{self.resource}')
+                holder = self.backend.holder(self.resource)
+                self.logger.info(f'Waiting for the lease on {self.resource}. Held by '
+                                 f'{holder[0] if holder else "nobody"}, front of the queue is {head}.')
+                time.sleep(self.poll_interval)
+        finally:
+            self.backend.dequeue(self.resource, self.owner)
+
+        self.logger.info(f'Acquired the lease on {self.resource} as {self.owner} after {time.time() - start:.1f} '
+                         f'seconds.')
+        self._stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._heartbeat_thread.start()
+
+    def release(self):
+        """
+        Stops the heartbeat and gives up the lease.
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        self.backend.release(self.resource, self.owner)
+        self.logger.info(f'Released the lease on {self.resource}.')
+
+    def check(self):
+        """
+        Raises LeaseLostError if a heartbeat found that the lease is no longer held.
+
+        Returns:
+            None
+        """
+        if self.lost.is_set():
+            raise LeaseLostError(f'The lease on {self.resource} held by {self.owner} was lost.')
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                if not self.backend.heartbeat(self.resource, self.owner, self.ttl):
+                    self.logger.warning(f'The lease on {self.resource} was lost.')
+                    self.lost.set()
+                    return
+            except Exception as e:
+                self.logger.warning(f'Lease heartbeat for {self.resource} failed: {e}')
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -1,6 +1,20 @@
+import atexit
+import glob
+import gzip
 import logging
 import os
+import queue
+import shutil
+import threading
 from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)"
+
+# The listener and queue handler of the current setup, replaced when logging is set up again.
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional['BoundedQueueHandler'] = None
 
 
 class CustomFormatter(logging.Formatter):
@@ -9,7 +23,7 @@ class CustomFormatter(logging.Formatter):
     red = '\033[93m'
     bold_red = '\033[91m'
     reset = '\x1b[0m'
-    format = "%(asctime)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)"
+    format = LOG_FORMAT
 
     FORMATS = {
         logging.DEBUG: grey + format + reset,
@@ -19,13 +33,183 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset
     }
 
+    def __init__(self):
+        super().__init__(LOG_FORMAT)
+        # One formatter per level, built once rather than for every record.
+        self.formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
 
 
-def setup_logging(logging_level: str = None):
+class BatchedFileHandler(logging.FileHandler):
+    """
+    A file handler that writes formatted records in batches instead of one write and flush per record. The batch is
+    written once it holds `batch_size` records, when a record of `flush_level` or above arrives, on `flush`, and when
+    the handler is closed.
+    """
+
+    def __init__(self, filename: str, batch_size: int = 100, flush_level: int = logging.WARNING,
+                 encoding: Optional[str] = None):
+        """
+        Args:
+            filename: The log file.
+            batch_size: The most records to hold before writing them.
+            flush_level: Records at this level or above are written straight away, with the batch before them.
+            encoding: The file encoding.
+        """
+        super().__init__(filename, encoding=encoding)
+        self.batch_size = max(1, batch_size)
+        self.flush_level = flush_level
+        self.buffer: List[str] = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+            if len(self.buffer) >= self.batch_size or record.levelno >= self.flush_level:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(''.join(self.buffer))
+                self.buffer = []
+            super().flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+        finally:
+            self.release()
+            super().close()
+
+
+class FlushingQueueListener(QueueListener):
+    """
+    A QueueListener that flushes its handlers once the queue has been empty for `flush_interval` seconds, so batched
+    records do not wait for the next burst of logging to be written.
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler, flush_interval: float = 1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    A QueueHandler for a bounded queue. When the queue is full, records below `drop_level` are dropped and counted,
+    and records at `drop_level` or above wait for room. A slow console or file then slows logging down instead of
+    growing memory, and only debug output is ever lost.
+    """
+
+    def __init__(self, log_queue: queue.Queue, drop_level: int = logging.INFO):
+        """
+        Args:
+            log_queue: The bounded queue the listener reads.
+            drop_level: Records below this level are dropped when the queue is full.
+        """
+        super().__init__(log_queue)
+        self.drop_level = drop_level
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if record.levelno >= self.drop_level:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def compress_old_logs(directory: str = 'logs', current: Optional[str] = None, keep_runs: int = 0) -> List[str]:
+    """
+    Compresses the logs of earlier runs, `VS_Extractor-*.log`, to `.log.gz` and deletes the oldest compressed logs
+    beyond `keep_runs`.
+
+    Args:
+        directory: The logs folder.
+        current: The log file of this run, which is left alone.
+        keep_runs: The number of compressed run logs to keep. 0 keeps them all.
+
+    Returns:
+        The compressed files written.
+    """
+    compressed = []
+    current = os.path.abspath(current) if current else None
+    for path in sorted(glob.glob(os.path.join(directory, 'VS_Extractor-*.log'))):
+        if os.path.abspath(path) == current:
+            continue
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+        compressed.append(path + '.gz')
+
+    if keep_runs > 0:
+        # The file names start with the UTC start time of the run, so they sort oldest first.
+        for path in sorted(glob.glob(os.path.join(directory, 'VS_Extractor-*.log.gz')))[:-keep_runs]:
+            os.remove(path)
+    return compressed
+
+
+def stop_logging():
+    """
+    Stops the background listener, writing every queued record, and detaches the queue handler, as nothing reads the
+    queue any more. Runs at exit.
+    """
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        if _queue_handler.dropped:
+            logging.getLogger(__name__).warning(f'Dropped {_queue_handler.dropped} debug log records while the log '
+                                                f'queue was full.')
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(logging_level: str = None) -> Optional[QueueListener]:
+    """
+    Logs to the console and to `logs/VS_Extractor-<time>.log`. Unless `LOGGING_QUEUE` is false, records are put on a
+    queue of at most `LOGGING_QUEUE_SIZE` records and written by a background thread, so logging a line of dbt output
+    does not wait for the console or the file. When the queue is full, debug records are dropped and other records
+    wait for room. The file is written in batches of `LOGGING_FILE_BATCH_SIZE` records and at least every
+    `LOGGING_FLUSH_SECONDS`. With `LOGGING_COMPRESS_OLD_LOGS` true, the logs of earlier runs are gzipped in the
+    background and only the last `LOGGING_KEEP_RUNS` are kept.
+
+    Args:
+        logging_level: DEBUG, INFO, WARNING or ERROR. Defaults to the `LOGGING_LEVEL` env var.
+
+    Returns:
+        The QueueListener writing the records, or None when logging synchronously.
+    """
     raw_db = os.environ.get('DATACOVES__LOADER__DATABASE')
     if raw_db == 'RAW_DEV':
         print('WARNING: Using the RAW_DEV development database. Press any key to continue.')
@@ -49,26 +233,45 @@ def setup_logging(logging_level: str = None):
         level = logging.INFO
 
     now_time_str = datetime.now(timezone.utc).replace(tzinfo=None).strftime('%Y-%m-%dT%H_%M_%S')
+    use_queue = os.environ.get('LOGGING_QUEUE', 'true').lower() == 'true'
 
+    global _listener, _queue_handler
+    stop_logging()
     logger = logging.getLogger()
     logger.setLevel(level)
 
-    # logging.basicConfig(level=level,
-    #                     format="%(asctime)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)",
-    #                     datefmt='%Y-%m-%d %H:%M:%S',
-    #                     filename=os.path.join('logs', f'VS_Extractor-{now_time_str}.log'))
-
     # Adding a file handler
     log_filename = os.path.join('logs', f'VS_Extractor-{now_time_str}.log')
-    file_handler = logging.FileHandler(log_filename)
+    if use_queue:
+        file_handler = BatchedFileHandler(log_filename,
+                                          batch_size=int(os.environ.get('LOGGING_FILE_BATCH_SIZE', 100)))
+    else:
+        file_handler = logging.FileHandler(log_filename)
     file_handler.setLevel(level)
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)"))
-
-    logging.getLogger().addHandler(file_handler)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
     # Print log messages to console at the same time.
     console_handler = logging.StreamHandler()
     console_handler.setLevel(level)
     console_handler.setFormatter(CustomFormatter())
-    logging.getLogger().addHandler(console_handler)
+
+    if os.environ.get('LOGGING_COMPRESS_OLD_LOGS', 'false').lower() == 'true':
+        threading.Thread(target=compress_old_logs, name='compress_logs', daemon=True,
+                         kwargs={'current': log_filename,
+                                 'keep_runs': int(os.environ.get('LOGGING_KEEP_RUNS', 0))}).start()
+
+    if not use_queue:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
+        return None
+
+    log_queue = queue.Queue(maxsize=int(os.environ.get('LOGGING_QUEUE_SIZE', 10000)))
+    _listener = FlushingQueueListener(log_queue, file_handler, console_handler,
+                                      flush_interval=float(os.environ.get('LOGGING_FLUSH_SECONDS', 1.0)))
+    _queue_handler = BoundedQueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    _listener.start()
+    return _listener
+
+
+atexit.register(stop_logging)
@@ -1,13 +1,29 @@
+import glob
+import json
 import os
-import time
-import re
 import logging
-from typing import List, Tuple, Optional
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
 
-import snowflake.connector
 import subprocess
+from src.artifact_cache import DepsCache, PartialParseCache
+from src.async_query import AsyncQueryRunner
 from src.clone_database import CloneDB
+from src.dbt_events import DbtRunStatus
+from src.dbt_runner import DbtCommandResult, InProcessDbtRunner
+from src.garbage_collector import DatabaseGarbageCollector
+from src.green_waiter import GreenDatabaseWaiter
+from src.lease import Lease, SnowflakeLeaseBackend
+from src.manifest import Manifest, ManifestDiff
+from src.metrics import PhaseTimer
+from src.phase_graph import PhaseGraph
+from src.process_runner import StreamingProcess
+from src.run_history import RunHistory, default_db_path
+from src.sharded_build import ShardedBuild
+from src.standby import GreenStandby
 from src.utilities import Utilities
+from src.warehouse import WarehouseResizer
 from src.core import Core
 
 
@@ -25,7 +41,21 @@ class DBTBlueGreen(Core):
                  schema: Optional[str] = None,
                  user: Optional[str] = None,
                  password: Optional[str] = None,
-                 query_tag: Optional[str] = None):
+                 query_tag: Optional[str] = None,
+                 dbt_root: Optional[str] = None,
+                 dbt_env: Optional[Dict[str, str]] = None,
+                 execution_mode: Optional[str] = None,
+                 dbt_deps_installed: bool = False):
+        """
+        Args:
+            dbt_root: The dbt project directory. Defaults to `transform` next to the launch root.
+            dbt_env: Environment variables for every dbt command on top of this process's environment, such as the
+                     database the profile builds in, or `DBT_TARGET_PATH` and `DBT_LOG_PATH` to keep the artifacts
+                     of runs sharing a project apart. Requires running dbt as a subprocess.
+            execution_mode: `subprocess`, `in_process` or `auto`. Defaults to the `DBT_EXECUTION_MODE` env var, or
+                            `subprocess`.
+            dbt_deps_installed: The dbt packages are already installed in the project, so `dbt deps` is skipped.
+        """
 
         super().__init__(blue_database,
                          green_database,
@@ -42,11 +72,25 @@ class DBTBlueGreen(Core):
 
         self.logger = logging.getLogger(__name__)
 
+        # `DBT_THREAD_COUNT` fixes the dbt thread count, 6 by default. Set to `auto`, the thread count is worked out
+        # from the selection for each build, up to `DBT_MAX_THREADS` or the `thread_count` argument.
+        thread_setting = os.environ.get('DBT_THREAD_COUNT', '6').lower()
+        self._adaptive_threads = thread_setting == 'auto'
+        self._max_threads = int(os.environ.get('DBT_MAX_THREADS', thread_count))
+        self._min_threads = int(os.environ.get('DBT_MIN_THREADS', 1))
+        self._selection_cache = {}
+
         if not unit_test:
-            self.con = self.snowflake_connection()
-            self._thread_count = int(os.environ.get('DBT_THREAD_COUNT', '6'))
+            if not self._adaptive_threads:
+                self._thread_count = int(thread_setting)
             self._stomp_on_green_timeout = int(os.environ.get('STOMP_ON_GREEN_TIMEOUT', 10))
+            self._stomp_on_green_idle_minutes = float(os.environ.get('STOMP_ON_GREEN_IDLE_MINUTES', 5))
+            self._lease_schema = os.environ.get('BLUE_GREEN_LEASE_SCHEMA')
+            self._lease_ttl = float(os.environ.get('BLUE_GREEN_LEASE_TTL', 300))
 
+        if dbt_root is not None:
+            self._dbt_root = dbt_root
+        elif not unit_test:
             launch_root = Utilities.get_path_to_launch_root()[1:].split('/')[:-2]
             dbt_root = launch_root + ['transform']
             self._dbt_root = '/' + '/'.join(dbt_root)
@@ -54,6 +98,55 @@ class DBTBlueGreen(Core):
         else:
             self._dbt_root = './'
 
+        # `subprocess`, the default, starts a dbt process per command, with log event streaming, timeouts and
+        # `dbt_env`. `in_process` runs dbt through its programmatic runner, which has none of these, and `auto` uses
+        # the programmatic runner when dbt-core is importable.
+        execution_mode = (execution_mode or os.environ.get('DBT_EXECUTION_MODE', 'subprocess')).lower()
+        if execution_mode == 'auto':
+            execution_mode = 'in_process' if InProcessDbtRunner.is_available() else 'subprocess'
+        elif execution_mode == 'in_process' and not InProcessDbtRunner.is_available():
+            self.logger.warning('DBT_EXECUTION_MODE is in_process but dbt-core is not importable. Falling back to '
+                                'running dbt as a subprocess.')
+            execution_mode = 'subprocess'
+        self._in_process_runner = InProcessDbtRunner(self._dbt_root) if execution_mode == 'in_process' else None
+        self._dbt_env = dict(dbt_env or {})
+        if self._dbt_env and self._in_process_runner is not None:
+            self.logger.warning('dbt environment variables can only be set for a dbt subprocess. Running dbt as a '
+                                'subprocess.')
+            self._in_process_runner = None
+        self._target_path = self._dbt_env.get('DBT_TARGET_PATH', os.environ.get('DBT_TARGET_PATH', 'target'))
+        self._log_path = self._dbt_env.get('DBT_LOG_PATH', os.environ.get('DBT_LOG_PATH', 'logs'))
+        # A dbt subprocess is stopped after `DBT_COMMAND_TIMEOUT` seconds, or `DBT_INACTIVITY_TIMEOUT` seconds without
+        # output. Neither is set by default.
+        self._dbt_timeout = float(os.environ['DBT_COMMAND_TIMEOUT']) if os.environ.get('DBT_COMMAND_TIMEOUT') else None
+        self._dbt_inactivity_timeout = float(os.environ['DBT_INACTIVITY_TIMEOUT']) \
+            if os.environ.get('DBT_INACTIVITY_TIMEOUT') else None
+        self._dbt_tail_lines = int(os.environ.get('DBT_OUTPUT_TAIL_LINES', 200))
+
+        self._deps_cache = None
+        if os.environ.get('DBT_DEPS_CACHE', 'true').lower() == 'true' and not unit_test:
+            self._deps_cache = DepsCache(self._dbt_root,
+                                         os.environ.get('DBT_DEPS_CACHE_DIR', '~/.cache/dbt_blue_green/deps'),
+                                         max_entries=int(os.environ.get('DBT_DEPS_CACHE_MAX_ENTRIES', 5)))
+        self._use_manifest_diff = os.environ.get('MANIFEST_DIFF', 'true').lower() == 'true'
+        self._shard_count = int(os.environ.get('DBT_BUILD_SHARDS', 1))
+        self._dbt_project_prepared = False
+        self._deps_installed = dbt_deps_installed
+        self._dbt_project_parsed = False
+        # The manifest of each target parsed during the run.
+        self._manifests: Dict[Optional[str], Manifest] = {}
+        self._parse_cache_dir = None
+        if os.environ.get('DBT_PARSE_CACHE', 'true').lower() == 'true' and not unit_test:
+            self._parse_cache_dir = os.environ.get('DBT_PARSE_CACHE_DIR', '~/.cache/dbt_blue_green/partial_parse')
+        self._standby_max_age = float(os.environ.get('BLUE_GREEN_STANDBY_MAX_AGE_MINUTES', 60))
+        self._run_history_db = None
+        if os.environ.get('BLUE_GREEN_RUN_HISTORY', 'true').lower() == 'true' and not unit_test:
+            self._run_history_db = default_db_path()
+        self._pipeline_phases = os.environ.get('BLUE_GREEN_PIPELINE_PHASES', 'true').lower() == 'true'
+        self._resize_warehouse = os.environ.get('BLUE_GREEN_WAREHOUSE_RESIZE', 'false').lower() == 'true'
+        self._metrics_dir = os.environ.get('BLUE_GREEN_METRICS_DIR', os.path.join(self._dbt_root, 'logs'))
+        self._timer = PhaseTimer()
+
     def main(self,
              snapshot_select: str,
              snapshot_exclude: str,
@@ -73,7 +166,12 @@ class DBTBlueGreen(Core):
              drop_on_existing_db: bool = False,
              fail_fast: bool = False,
              dbt_target: str = None,
-             stomp_on_green: bool = False
+             stomp_on_green: bool = False,
+             clone_by_schema: Optional[bool] = None,
+             schema_swap: bool = False,
+             use_lease: bool = False,
+             use_standby: Optional[bool] = None,
+             warehouse_size: Optional[str] = None
              ):
         """
         Main function to execute the blue green deployment process
@@ -101,29 +199,209 @@ class DBTBlueGreen(Core):
                                  the green database needs to be recreated.
             fail_fast: Run DBT with the `--fail-fast` option. This will stop the run on the first failure.
             dbt_target: The DBT target to run the operation on. Optional, will use default if not defined.
-            stomp_on_green: If set, the script will test if the green DB exists, wait 10 min, then drop the green
-            database if whatever process created it is not complete.
+            stomp_on_green: If set, the script will test if the green DB exists, wait up to 10 min, then drop the green
+            database if whatever process created it is not complete. A green database with no running queries and
+            no activity for `STOMP_ON_GREEN_IDLE_MINUTES` is dropped without waiting for the full timeout.
+            clone_by_schema: Clone the blue database schema by schema on a thread pool instead of in a single
+                             statement. Defaults to the `CLONE_BY_SCHEMA` env var.
+            schema_swap: Only clone, build and swap the schemas that the dbt selection writes to, using
+                         `alter schema ... swap with` instead of swapping the whole database. The schemas of the
+                         models the selection refs are cloned as well, but not swapped.
+            use_lease: Queue for a lease on the green database before touching it, instead of relying on whether the
+                       green database exists. Requires the `BLUE_GREEN_LEASE_SCHEMA` env var.
+            use_standby: Claim the pre-cloned standby database as the green database instead of cloning, and refresh
+                         the standby in the background after a successful swap, or after a `no_swap` run that claimed
+                         it. Defaults to the `BLUE_GREEN_STANDBY` env var. Not used in schema swap mode.
+            warehouse_size: Resize the warehouse to this size for the build. Without it, the warehouse is only resized
+                            when `BLUE_GREEN_WAREHOUSE_RESIZE` is true, to a size picked from the selection.
 
         Returns:
             None
         """
         self.logger.info(f'Starting DBT Blue Green Swap for {self.blue_database} to {self.green_database}')
-        cdb = CloneDB(self.blue_database, self.green_database, self._thread_count, query_tag=query_tag)
+        if use_standby is None:
+            use_standby = os.environ.get('BLUE_GREEN_STANDBY', 'false').lower() == 'true'
+        self._timer = PhaseTimer(labels={'blue_database': self.blue_database, 'green_database': self.green_database})
+        failed = False
+        try:
+            manifest = False if os.environ.get('MANIFEST_FOUND', 'false') == 'false' else True
+            self.logger.info(f'Manifest Found: {manifest}')
+            dbt_kwargs = dict(do_snapshot=do_snapshot, do_seed=do_seed, do_run=do_run, do_test=do_test,
+                              snapshot_select=snapshot_select, snapshot_exclude=snapshot_exclude,
+                              seed_select=seed_select, seed_exclude=seed_exclude, run_select=run_select,
+                              run_exclude=run_exclude, test_select=test_select, test_exclude=test_exclude,
+                              full_refresh=full_refresh, thread_count=self._thread_count, manifest=manifest,
+                              fail_fast=fail_fast, dbt_target=dbt_target)
+
+            if manifest and self._use_manifest_diff and ((do_run and not run_select) or (do_test and not test_select)):
+                # Work out what changed before paying for a clone.
+                with self._timer.span('manifest_diff'):
+                    dbt_kwargs = self._apply_manifest_diff(dbt_kwargs)
+                if dbt_kwargs is None:
+                    self.logger.info('No nodes were modified since the last production run. Nothing to deploy.')
+                    return
+
+            cdb = CloneDB(self.blue_database, self.green_database, self._thread_count, query_tag=query_tag,
+                          clone_by_schema=clone_by_schema)
+            lease = None
+            if use_lease:
+                with self._timer.span('lease_wait'):
+                    lease = self._acquire_green_lease()
+            try:
+                # The deploy runs as a graph of phases. Preparing the dbt project does not need the green database,
+                # so it overlaps the existence check and the clone, and the publish statements are prepared while the
+                # build runs. Only the build waits on both the clone and the project.
+                state = {'schemas': None, 'upstream_schemas': [], 'publish': None, 'standby_claimed': False}
+                graph = PhaseGraph(max_workers=3 if self._pipeline_phases else 1)
+                graph.add('green', lambda: self._prepare_green_database(cdb, stomp_on_green, drop_on_existing_db,
+                                                                        leased=lease is not None))
+                graph.add('project', lambda: self._prepare_build(dbt_kwargs, state, schema_swap))
+
+                def has_work() -> bool:
+                    # In schema swap mode there is nothing to clone, build or publish if no schema is written to.
+                    return not schema_swap or bool(state['schemas'])
+
+                def clone():
+                    # Clone the blue (production) database to the green (temp build) database
+                    with self._timer.span('clone', by_schema=schema_swap) as span:
+                        if schema_swap:
+                            cdb.clone_schemas_to_green(sorted(state['schemas'] + state['upstream_schemas']))
+                        else:
+                            claimed = bool(use_standby) and self._get_standby().claim()
+                            span.attributes['standby'] = claimed
+                            state['standby_claimed'] = claimed
+                            if not claimed:
+                                cdb.clone_blue_db_to_green()
+                graph.add('clone', clone, depends_on=['green', 'project'] if schema_swap else ['green'], when=has_work)
+
+                # Execute DBT Operations
+                graph.add('build', lambda: self._run_dbt(run_deps=False, warehouse_size=warehouse_size, **dbt_kwargs),
+                          depends_on=['clone', 'project'], when=has_work)
+
+                def prepare_publish():
+                    with self._timer.span('publish_prepare'):
+                        state['publish'] = self._publish_statements(state['schemas'], swap=not no_swap)
+                graph.add('publish_prepare', prepare_publish, depends_on=['clone'], when=has_work)
+
+                def publish():
+                    if not no_swap and lease is not None:
+                        # Never swap a green database that another run may have taken over.
+                        lease.check()
+                    # Grant usage to the green database, swap it with the blue database and drop it. This is the
+                    # window between the build finishing and production seeing the new data.
+                    with self._timer.span('publish', swap=not no_swap, by_schema=schema_swap):
+                        self._publish(state['schemas'], swap=not no_swap, statements=state['publish'])
+                graph.add('publish', publish, depends_on=['build', 'publish_prepare'], when=has_work)
+
+                try:
+                    graph.run()
+                except Exception as e:
+                    if 'clone' in graph.started:
+                        with self._timer.span('rollback'):
+                            # Move the failed green database out of the way so the next run can use the name.
+                            self._swap_database_if_failure(cdb)
+                    raise e
+
+                if not has_work():
+                    self.logger.info('The dbt selection does not write to any schemas. Nothing to deploy.')
+                    return
+
+                # Without a swap the blue database is unchanged, so the standby only needs replacing if it was used.
+                if use_standby and not schema_swap and (not no_swap or state['standby_claimed']):
+                    with self._timer.span('standby_refresh'):
+                        try:
+                            self.refresh_standby()
+                        except Exception as e:
+                            # The next run falls back to a clone, so this must not fail the deploy.
+                            self.logger.warning(f'Unable to refresh the standby database: {e}')
+            finally:
+                # Return the session to the pool on every path, so a failed or empty run does not hold it for the
+                # rest of a multi-target process.
+                try:
+                    if lease is not None:
+                        lease.release()
+                finally:
+                    cdb.close()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._export_metrics(success=not failed)
+
+    def _prepare_build(self, dbt_kwargs: dict, state: dict, schema_swap: bool = False):
+        """
+        Gets the dbt project ready to build without touching the green database, so it can overlap the clone: installs
+        packages, restores the partial parse cache and parses the project. In schema swap mode the target schemas are
+        listed into `state['schemas']` and the unselected schemas they ref into `state['upstream_schemas']`. When the
+        build needs the selected nodes, listing them is the parse.
+
+        Args:
+            dbt_kwargs: The keyword arguments for `_run_dbt`.
+            state: The shared state of the deploy phases.
+            schema_swap: List the schemas the selection writes to.
+
+        Returns:
+            None
+        """
+        dbt_target = dbt_kwargs['dbt_target']
+        self._prepare_dbt_project(dbt_target)
+        build_args = self._make_dbt_build_args(**dbt_kwargs)
+        if schema_swap:
+            # Only the schemas written to by the selection are cloned, built and swapped.
+            with self._timer.span('list_schemas'):
+                state['schemas'], state['upstream_schemas'] = self._list_target_schemas(build_args)
+            if state['schemas']:
+                self.logger.info(f'Schema swap mode. Target schemas: {", ".join(state["schemas"])}')
+            if state['upstream_schemas']:
+                self.logger.info(f'Cloning the upstream schemas the selection refs without publishing them: '
+                                 f'{", ".join(state["upstream_schemas"])}')
+        if self._adaptive_threads or self._resize_warehouse or self._shard_count > 1:
+            self._selected_nodes(build_args)
+        elif not schema_swap and self._pipeline_phases and not self._dbt_project_parsed:
+            # Parsing now, while the clone runs, leaves the build a partial parse with nothing left to do.
+            with self._timer.span('parse'):
+                self.execute_dbt_command('parse', ['--target', dbt_target] if dbt_target else [])
+            self._dbt_project_parsed = True
+
+    def _prepare_green_database(self, cdb: CloneDB, stomp_on_green: bool, drop_on_existing_db: bool,
+                                leased: bool = False):
+        """
+        Makes sure the green database does not exist before the clone. An existing green database is dropped, waited
+        on, or causes a failure depending on the flags.
+
+        Args:
+            cdb: The CloneDB used to drop the green database.
+            stomp_on_green: Wait for the run that owns the green database, then drop it.
+            drop_on_existing_db: Drop an existing green database straight away.
+            leased: This run holds the lease on the green database, so any existing green database is not in use.
+
+        Returns:
+            None
+        """
         # Check if the green database exists and fail if it does
-        database_exists = self._check_if_database_exists(self.green_database)
+        with self._timer.span('existence_check'):
+            database_exists = self._check_if_database_exists(self.green_database)
+
+        if leased and database_exists and (stomp_on_green or drop_on_existing_db):
+            # The lease guarantees no other run is using the green database, so there is no need to wait.
+            self.logger.info(f'Green database {self.green_database} is left over from an earlier run. Dropping it.')
+            with self._timer.span('drop'):
+                cdb.drop_database()
 
-        if stomp_on_green and database_exists:
+        elif stomp_on_green and database_exists:
             self.logger.info(
-                f'Green database {self.green_database} exists. Waiting {self._stomp_on_green_timeout} minutes before dropping the database.')
-            for i in range(int(self._stomp_on_green_timeout)):
-                self.logger.info(f'Waiting {i} minutes')
-                time.sleep(60)
-                database_exists = self._check_if_database_exists(self.green_database)
-                if not database_exists:
-                    break
+                f'Green database {self.green_database} exists. Waiting up to {self._stomp_on_green_timeout} minutes '
+                f'before dropping the database.')
+            waiter = GreenDatabaseWaiter(self.con, self.green_database,
+                                         timeout_minutes=self._stomp_on_green_timeout,
+                                         idle_minutes=self._stomp_on_green_idle_minutes,
+                                         ignore_query_tags=[self._query_tag])
+            with self._timer.span('stomp_wait'):
+                database_exists = waiter.wait(self._check_if_database_exists)
             if database_exists:
                 self.logger.info(f'Green database {self.green_database} still exists. Dropping the database.')
-                cdb.drop_database()
+                with self._timer.span('drop'):
+                    cdb.drop_database()
                 database_exists = False
 
         elif database_exists and not drop_on_existing_db:
@@ -132,84 +410,49 @@ class DBTBlueGreen(Core):
                             f'Please drop the database or set `drop_on_existing_db=True` to drop the database.')
         elif database_exists and drop_on_existing_db:
             # Drop existing database in prep for clone.
-            cdb.drop_database()
-
-        try:
-            # Clone the blue (production) database to the green (temp build) database
-            cdb.clone_blue_db_to_green()
+            with self._timer.span('drop'):
+                cdb.drop_database()
 
-            manifest = False if os.environ.get('MANIFEST_FOUND', 'false') == 'false' else True
-            self.logger.info(f'Manifest Found: {manifest}')
+    def refresh_standby(self, wait: bool = False):
+        """
+        Replaces the standby database with a new clone of the blue database. Called after a successful run, or on a
+        schedule through `cmd.py --refresh-standby`.
 
-            # Execute DBT Operations
-            self._run_dbt(do_snapshot=do_snapshot, do_seed=do_seed, do_run=do_run, do_test=do_test,
-                          snapshot_select=snapshot_select, snapshot_exclude=snapshot_exclude, seed_select=seed_select,
-                          seed_exclude=seed_exclude, run_select=run_select,
-                          run_exclude=run_exclude, test_select=test_select, test_exclude=test_exclude,
-                          full_refresh=full_refresh, thread_count=self._thread_count, manifest=manifest,
-                          fail_fast=fail_fast, dbt_target=dbt_target)
-
-            # Grant usage to the green database
-            self.logger.info('Granting usage to green database')
-            self._grant_prd_usage()
-
-            if not no_swap:
-                # Swap the green database with the blue database
-                self.logger.info(f'Swapping databases {self.blue_database} with {self.green_database}')
-                self._swap_database()
-
-                # Drop green DB
-                self.logger.info('Dropping green database')
-                cdb.drop_database()
+        Args:
+            wait: Wait for the clone to finish instead of leaving it running on Snowflake.
 
-        except Exception as e:
-            self._swap_database_if_failure()
-            # In the event of an error, drop the green database. If not dropped, the next run will fail.
-            cdb.drop_database()
-            raise e
+        Returns:
+            None
+        """
+        self._get_standby().refresh(wait=wait)
 
-        # Final check to ensure that the production database exists and hasn't somehow been removed in the process.
-        # This is for debugging purposes.
-        if not self._check_if_database_exists(self.blue_database):
-            raise Exception(f'Green database {self.green_database} does not exist at end of B/G run! \n')
+    def _get_standby(self) -> GreenStandby:
+        return GreenStandby(self.con, self.blue_database, self.green_database,
+                            standby_database=os.environ.get('BLUE_GREEN_STANDBY_DATABASE'),
+                            max_age_minutes=self._standby_max_age)
 
-    @staticmethod
-    def snowflake_connection():
-        con = snowflake.connector.connect(
-            account=os.environ.get('DATACOVES__MAIN__ACCOUNT'),
-            warehouse=os.environ.get('DATACOVES__MAIN__WAREHOUSE'),
-            database=os.environ.get('DATACOVES__MAIN__DATABASE'),
-            role=os.environ.get('DATACOVES__MAIN__ROLE'),
-            schema=os.environ.get('DATACOVES__MAIN__SCHEMA'),
-            user=os.environ.get('DATACOVES__MAIN__USER'),
-            password=os.environ.get('DATACOVES__MAIN__PASSWORD'),
-            session_parameters={
-                'QUERY_TAG': 'blue_green_swap',
-            }
-        )
-
-        return con
-
-    def _check_if_database_exists(self, database):
-        """
-        Check if the green database exists and fail if it does
+    def _acquire_green_lease(self) -> Lease:
+        """
+        Queues for and acquires the lease on the green database. The lease tables live in the schema named by the
+        `BLUE_GREEN_LEASE_SCHEMA` env var.
 
         Returns:
-            None
+            The held Lease
         """
-        query = f"SHOW DATABASES LIKE '{database}'"
-        cursor = self.con.cursor()
-        cursor.execute(query)
-        result = cursor.fetchone()
-        if result is not None:
-            return True
-        else:
-            return False
+        if not self._lease_schema:
+            raise Exception('BLUE_GREEN_LEASE_SCHEMA must be set to use a lease on the green database.')
+        backend = SnowflakeLeaseBackend(self.con, self._lease_schema)
+        backend.setup()
+        lease = Lease(backend, self.green_database, ttl=self._lease_ttl,
+                      timeout=self._stomp_on_green_timeout * 60 if self._stomp_on_green_timeout else None)
+        lease.acquire()
+        return lease
 
     def _run_dbt(self, do_snapshot: bool, do_seed: bool, do_run: bool, do_test: bool, snapshot_select: str,
                  snapshot_exclude: str, seed_select: str, seed_exclude: str, run_select: str, run_exclude: str,
                  test_select: str, test_exclude: str,
-                 full_refresh: bool, thread_count: int, manifest: bool, fail_fast: bool, dbt_target: str = None):
+                 full_refresh: bool, thread_count: int, manifest: bool, fail_fast: bool, dbt_target: str = None,
+                 run_deps: bool = True, warehouse_size: Optional[str] = None, defer: bool = False):
         """
         Run DBT commands
 
@@ -229,19 +472,323 @@ class DBTBlueGreen(Core):
             test_select: The models or tags to include in the test command `--select`
             test_exclude: The models or tags to exclude in the test command `--exclude`
             full_refresh: Boolean to determine if the full-refresh flag should be passed to the dbt run command
-            thread_count: The number of threads to pass to the --threads dbt flag
+            thread_count: The number of threads to pass to the --threads dbt flag. Replaced by a thread count worked out
+                          from the selection when `DBT_THREAD_COUNT` is `auto`.
             manifest: Boolean to determine if the manifest was located and a state based run can be executed. If found,
                       the run will execute with `--defer --state logs -s state:modified+` flags
             fail_fast: Boolean to determine if the fail-fast flag should be passed to the dbt run command
             dbt_target: The DBT target to use for the command
+            run_deps: Run `dbt deps` and restore the partial parse cache before the build. Set to False when
+                      `_prepare_dbt_project` has already run.
+            warehouse_size: Resize the warehouse to this size for the build.
+            defer: Pass `--defer --state logs` even though the run or test selection is set, as it is when the
+                   manifest diff replaced `state:modified+` with the modified nodes.
 
         Returns:
             None
         """
         # Run snapshots
-        self.execute_dbt_command('deps', [])
+        if run_deps:
+            self._prepare_dbt_project(dbt_target)
+        args = self._make_dbt_build_args(do_snapshot=do_snapshot, do_seed=do_seed, do_run=do_run, do_test=do_test,
+                                         snapshot_select=snapshot_select, snapshot_exclude=snapshot_exclude,
+                                         seed_select=seed_select, seed_exclude=seed_exclude, run_select=run_select,
+                                         run_exclude=run_exclude, test_select=test_select, test_exclude=test_exclude,
+                                         full_refresh=full_refresh, thread_count=thread_count, manifest=manifest,
+                                         fail_fast=fail_fast, dbt_target=dbt_target, defer=defer)
+        if self._adaptive_threads:
+            thread_count = self._choose_thread_count(args)
+            args[args.index('--threads') + 1] = str(thread_count)
+
+        try:
+            with self._resized_warehouse(args, full_refresh, thread_count, warehouse_size), \
+                    self._timer.span('build', shards=self._shard_count):
+                if self._shard_count > 1:
+                    self._run_sharded_build(args, dbt_target)
+                else:
+                    self.execute_dbt_command('build', args)
+        finally:
+            if self._parse_cache_dir:
+                self._get_parse_cache(dbt_target).save()
+            if self._run_history_db:
+                self._record_run_history(dbt_target)
+
+    def _record_run_history(self, dbt_target: Optional[str] = None):
+        """
+        Loads the node timings of the build from `target/run_results.json` into the local run history. See
+        RunHistory. Failures are logged and never fail the run.
+
+        Args:
+            dbt_target: The DBT target of the build.
+
+        Returns:
+            None
+        """
+        run_results = os.path.join(self._dbt_root, self._target_path, 'run_results.json')
+        if not os.path.exists(run_results):
+            return
+        try:
+            history = RunHistory(self._run_history_db,
+                                 retention_days=float(os.environ.get('BLUE_GREEN_RUN_HISTORY_RETENTION_DAYS', 90)))
+            history.ingest(run_results, target=dbt_target,
+                           manifest_path=os.path.join(self._dbt_root, self._target_path, 'manifest.json'))
+        except Exception as e:
+            self.logger.warning(f'Unable to record the run history: {e}')
+
+    def _selected_nodes(self, build_args: List[str]) -> List[dict]:
+        """
+        Lists the nodes a `dbt build` selects, with their unique IDs and dependencies. The result is kept for the rest
+        of the run, so the thread count, the warehouse size and the shards share one `dbt ls`.
+
+        Args:
+            build_args: The arguments of the `dbt build` command.
+
+        Returns:
+            A list of dicts with the `unique_id` and `depends_on` of each node.
+        """
+        selection_args = self._selection_args(build_args)
+        key = tuple(selection_args)
+        if key not in self._selection_cache:
+            ls_args = selection_args + ['--output', 'json', '--output-keys', 'unique_id depends_on', '--quiet']
+            with self._timer.span('list_selection'):
+                self._selection_cache[key] = self._list_dbt_nodes(ls_args)
+        return self._selection_cache[key]
+
+    def _choose_thread_count(self, build_args: List[str]) -> int:
+        """
+        Works out the dbt thread count for a build: the widest level of the selected DAG, capped by what the
+        warehouse's clusters can serve and by `DBT_MAX_THREADS`. Falls back to the ceiling if the selection cannot be
+        listed.
+
+        Args:
+            build_args: The arguments of the `dbt build` command.
+
+        Returns:
+            The thread count
+        """
+        limits = [(self._max_threads, f'the ceiling of {self._max_threads}')]
+        try:
+            nodes = self._selected_nodes(build_args)
+            graph = Manifest({'nodes': {x['unique_id']: x for x in nodes}})
+            width = graph.parallel_width(x['unique_id'] for x in nodes)
+            limits.append((width, f'the widest level of the {len(nodes)} selected nodes has {width} nodes'))
+        except Exception as e:
+            self.logger.warning(f'Unable to measure the width of the dbt selection: {e}')
+
+        capacity = self._warehouse_thread_capacity()
+        if capacity is not None:
+            limits.append(capacity)
+
+        thread_count, reason = min(limits, key=lambda x: x[0])
+        thread_count = max(self._min_threads, thread_count)
+        self.logger.info(f'Using {thread_count} dbt threads because {reason}. Limits: '
+                         f'{", ".join(f"{x[0]} ({x[1]})" for x in limits)}.')
+        return thread_count
+
+    def _warehouse_thread_capacity(self) -> Optional[Tuple[int, str]]:
+        """
+        Returns the threads the build warehouse can serve at once, as its maximum cluster count times
+        `BLUE_GREEN_WAREHOUSE_THREADS_PER_CLUSTER`, with a description. When the warehouse is resized for the build
+        with cluster counts, the most clusters the resize may set is used instead. Returns None if it is unknown.
+        """
+        if not self._warehouse or self.con is None:
+            return None
+        threads_per_cluster = int(os.environ.get('BLUE_GREEN_WAREHOUSE_THREADS_PER_CLUSTER', 8))
+        try:
+            resizer = WarehouseResizer.from_env(self.con, self._warehouse)
+            if self._resize_warehouse and resizer.threads_per_cluster:
+                clusters = resizer.max_clusters
+            else:
+                current = resizer.current()
+                if current is None:
+                    return None
+                clusters = current.max_cluster_count or 1
+        except Exception as e:
+            self.logger.warning(f'Unable to read the cluster count of warehouse {self._warehouse}: {e}')
+            return None
+        return (clusters * threads_per_cluster,
+                f'warehouse {self._warehouse} serves {clusters} clusters of {threads_per_cluster} threads')
+
+    @contextmanager
+    def _resized_warehouse(self, build_args: List[str], full_refresh: bool, thread_count: int,
+                           warehouse_size: Optional[str] = None):
+        """
+        Resizes the `DATACOVES__MAIN__WAREHOUSE` warehouse for the build and restores it afterwards. See
+        WarehouseResizer. The selected nodes are only counted with `dbt ls` when the size depends on them.
+
+        Args:
+            build_args: The arguments of the `dbt build` command.
+            full_refresh: The build is a full refresh.
+            thread_count: The dbt thread count.
+            warehouse_size: An explicit size. Resizes the warehouse even when `BLUE_GREEN_WAREHOUSE_RESIZE` is off.
+        """
+        if not self._warehouse or not (warehouse_size or self._resize_warehouse):
+            yield
+            return
+        resizer = WarehouseResizer.from_env(self.con, self._warehouse, size=warehouse_size)
+        node_count = None
+        if resizer.needs_node_count(full_refresh):
+            try:
+                node_count = len(self._selected_nodes(build_args))
+            except Exception as e:
+                self.logger.warning(f'Unable to count the selected nodes: {e}')
+        with resizer.resized(node_count, thread_count, full_refresh):
+            yield
+
+    def _prepare_dbt_project(self, dbt_target: Optional[str] = None):
+        """
+        Installs dbt packages and restores the partial parse file, so the next dbt command only parses what changed.
+        Only runs once per run.
+
+        Args:
+            dbt_target: The DBT target the project will be parsed for.
+
+        Returns:
+            None
+        """
+        if self._dbt_project_prepared:
+            return
+        with self._timer.span('deps'):
+            self.install_dbt_deps()
+        if self._parse_cache_dir:
+            with self._timer.span('parse_cache_restore'):
+                self._get_parse_cache(dbt_target).restore()
+        self._dbt_project_prepared = True
+
+    def _export_metrics(self, success: bool):
+        """
+        Writes the phase timings of the run to `BLUE_GREEN_METRICS_DIR`: a timestamped JSON file with every span, and
+        an OpenMetrics file per blue database that is overwritten each run for the node exporter to scrape. Only the
+        newest `BLUE_GREEN_METRICS_KEEP_RUNS` JSON files of the blue database are kept. 0 keeps them all.
+
+        Args:
+            success: Whether the run succeeded.
+
+        Returns:
+            None
+        """
+        if not self._metrics_dir:
+            return
+        try:
+            timestamp = time.strftime('%Y%m%d%H%M%S', time.gmtime(self._timer.start))
+            json_prefix = f'blue_green_metrics-{self.blue_database}-'.lower()
+            self._timer.export_json(os.path.join(self._metrics_dir, f'{json_prefix}{timestamp}.json'), success)
+            keep_runs = int(os.environ.get('BLUE_GREEN_METRICS_KEEP_RUNS', 100))
+            if keep_runs > 0:
+                # The timestamp in the name sorts the files oldest first.
+                runs = sorted(glob.glob(os.path.join(self._metrics_dir, f'{json_prefix}*.json')))
+                for path in runs[:-keep_runs]:
+                    os.remove(path)
+            self._timer.export_openmetrics(
+                os.path.join(self._metrics_dir, f'dbt_blue_green_{self.blue_database}.prom'.lower()), success)
+        except Exception as e:
+            # Metrics must never fail a deploy.
+            self.logger.warning(f'Unable to export run metrics: {e}')
+
+    def _apply_manifest_diff(self, dbt_kwargs: dict) -> Optional[dict]:
+        """
+        Replaces the `state:modified+` selection with the explicit list of nodes found by diffing the previous
+        production manifest in `logs/` against the current project. The build still defers to the previous manifest.
+        A selection longer than `MANIFEST_DIFF_MAX_SELECT_CHARS` would not fit in a single command line argument, so
+        `state:modified+` is kept instead.
+
+        Args:
+            dbt_kwargs: The keyword arguments for `_run_dbt`.
+
+        Returns:
+            The updated keyword arguments, or None if there is nothing to build.
+        """
+        previous_path = os.path.join(self._dbt_root, 'logs', 'manifest.json')
+        if not os.path.exists(previous_path):
+            self.logger.info(f'No previous manifest at {previous_path}. Using dbt state selection.')
+            return dbt_kwargs
+
+        self._prepare_dbt_project(dbt_kwargs['dbt_target'])
+        current = self._parse_dbt_project(dbt_kwargs['dbt_target'])
+        diff = ManifestDiff(Manifest.load(previous_path), current)
+
+        # Linux limits a single command line argument to 128 KiB.
+        max_chars = int(os.environ.get('MANIFEST_DIFF_MAX_SELECT_CHARS', 100000))
+        dbt_kwargs = dict(dbt_kwargs)
+        for do_key, select_key, resource_types in [('do_run', 'run_select', ['model']),
+                                                   ('do_test', 'test_select', ['test'])]:
+            if not dbt_kwargs[do_key] or dbt_kwargs[select_key]:
+                continue
+            impacted = sorted(diff.impacted_nodes(resource_types))
+            self.logger.info(f'Manifest diff selected {len(impacted)} {resource_types[0]} nodes.')
+            if not impacted:
+                dbt_kwargs[do_key] = False
+                continue
+            select = ' '.join(current.selector(x) for x in impacted)
+            # Each criterion is intersected with its resource type in the build's `--select`.
+            length = len(select) + len(impacted) * len(f'resource_type:{resource_types[0]},')
+            if length > max_chars:
+                self.logger.info(f'The selection of {len(impacted)} nodes is {length} characters long. Keeping the '
+                                 f'state:modified+ selection.')
+                continue
+            dbt_kwargs[select_key] = select
+            dbt_kwargs['defer'] = True
+
+        if not any(dbt_kwargs[x] for x in ['do_run', 'do_test', 'do_seed', 'do_snapshot']):
+            return None
+        return dbt_kwargs
+
+    def _parse_dbt_project(self, dbt_target: Optional[str] = None) -> Manifest:
+        """
+        Parses the dbt project and loads the manifest it writes to the target directory.
+
+        Args:
+            dbt_target: The DBT target to parse for.
+
+        Returns:
+            The current Manifest
+        """
+        self.execute_dbt_command('parse', ['--target', dbt_target] if dbt_target else [])
+        self._dbt_project_parsed = True
+        self._manifests[dbt_target] = Manifest.load(os.path.join(self._dbt_root, self._target_path, 'manifest.json'))
+        return self._manifests[dbt_target]
+
+    def _get_parse_cache(self, dbt_target: Optional[str] = None) -> PartialParseCache:
+        env_vars = os.environ.get('DBT_PARSE_CACHE_ENV_VARS')
+        return PartialParseCache(self._dbt_root, self._parse_cache_dir,
+                                 max_bytes=int(os.environ.get('DBT_PARSE_CACHE_MAX_MB', 500)) * 1024 * 1024,
+                                 target=dbt_target,
+                                 env_vars=env_vars.split(',') if env_vars else None,
+                                 target_path=self._target_path,
+                                 env=self._dbt_env)
+
+    def install_dbt_deps(self):
+        """
+        Installs dbt packages, restoring them from the deps cache when the package definitions and dbt version match
+        a cached install. Only runs once per run.
+
+        Returns:
+            None
+        """
+        if self._deps_installed:
+            return
+        if self._deps_cache is None:
+            self.execute_dbt_command('deps', [])
+        else:
+            key = self._deps_cache.key()
+            if not self._deps_cache.restore(key):
+                self.execute_dbt_command('deps', [])
+                self._deps_cache.save(key)
+        self._deps_installed = True
+
+    def _make_dbt_build_args(self, do_snapshot: bool, do_seed: bool, do_run: bool, do_test: bool, snapshot_select: str,
+                             snapshot_exclude: str, seed_select: str, seed_exclude: str, run_select: str,
+                             run_exclude: str, test_select: str, test_exclude: str, full_refresh: bool,
+                             thread_count: int, manifest: bool, fail_fast: bool, dbt_target: str = None,
+                             defer: bool = False) -> List[str]:
+        """
+        Builds the argument list for the `dbt build` command. See `_run_dbt` for a description of the arguments.
+
+        Returns:
+            A list of command line arguments
+        """
         args = ['--threads', str(thread_count)]
-        if manifest and ((do_run and not run_select) or (do_test and not test_select)):
+        if manifest and (defer or (do_run and not run_select) or (do_test and not test_select)):
             args = args + ['--defer', '--state', 'logs']
         if full_refresh:
             args.append('--full-refresh')
@@ -259,8 +806,148 @@ class DBTBlueGreen(Core):
             args.extend(['--select', select])
         if exclude:
             args.extend(['--exclude', exclude])
+        return args
+
+    def _list_target_schemas(self, build_args: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Uses `dbt ls` to find the schemas that the nodes selected by a `dbt build` write to, and the schemas of the
+        unselected models, seeds and snapshots they ref. The green database only holds the cloned schemas, so the
+        upstream schemas are cloned too for `{{ ref() }}` to resolve. Refs through ephemeral models are followed. Tests
+        are ignored as they do not create relations.
+
+        Args:
+            build_args: The arguments of the `dbt build` command. Only the selection, state and target are used.
+
+        Returns:
+            The sorted upper case names of the target schemas, and of the upstream schemas that are not targets.
+        """
+        ls_args = self._selection_args(build_args)
+        ls_args.extend(['--output', 'json', '--output-keys', 'unique_id resource_type schema depends_on', '--quiet'])
+
+        schemas = set()
+        selected = set()
+        parents = set()
+        for node in self._list_dbt_nodes(ls_args):
+            selected.add(node.get('unique_id'))
+            parents.update((node.get('depends_on') or {}).get('nodes') or [])
+            if node.get('resource_type') in ('test', 'unit_test', 'source') or not node.get('schema'):
+                continue
+            schemas.add(node['schema'].upper())
+
+        upstream = set()
+        parents -= selected
+        if parents:
+            # `dbt ls` writes the manifest of the project it listed.
+            manifest = Manifest.load(os.path.join(self._dbt_root, self._target_path, 'manifest.json'))
+            seen = set()
+            while parents:
+                unique_id = parents.pop()
+                seen.add(unique_id)
+                node = manifest.nodes.get(unique_id) or {}
+                if (node.get('config') or {}).get('materialized') == 'ephemeral':
+                    parents.update(x for x in manifest.parents(unique_id) if x not in seen and x not in selected)
+                elif node.get('resource_type') in ('model', 'seed', 'snapshot') and node.get('schema'):
+                    upstream.add(node['schema'].upper())
+        return sorted(schemas), sorted(upstream - schemas)
+
+    @staticmethod
+    def _selection_args(build_args: List[str]) -> List[str]:
+        """
+        Picks the flags that decide which nodes are selected out of a `dbt build` argument list.
+
+        Args:
+            build_args: The arguments of the `dbt build` command.
+
+        Returns:
+            The `--select`, `--exclude`, `--state` and `--target` flags with their values.
+        """
+        selection_args = []
+        for flag in ['--select', '--exclude', '--state', '--target']:
+            if flag in build_args:
+                selection_args.extend([flag, build_args[build_args.index(flag) + 1]])
+        return selection_args
+
+    def _run_sharded_build(self, build_args: List[str], dbt_target: Optional[str] = None):
+        """
+        Runs the build as several dbt processes in parallel, one per independent part of the selected DAG. See
+        ShardedBuild.
+
+        Args:
+            build_args: The arguments of the `dbt build` command.
+            dbt_target: The DBT target to use for the command
+
+        Returns:
+            None
+        """
+        unique_ids = [x['unique_id'] for x in self._selected_nodes(build_args)]
+        if not unique_ids:
+            self.logger.info('The dbt selection is empty. Nothing to build.')
+            return
 
-        self.execute_dbt_command('build', args)
+        base_args = []
+        skip = False
+        for arg in build_args:
+            if skip:
+                skip = False
+            elif arg in ('--select', '--exclude'):
+                skip = True
+            else:
+                base_args.append(arg)
+
+        manifest = self._manifests.get(dbt_target)
+        manifest_path = os.path.join(self._dbt_root, self._target_path, 'manifest.json')
+        if manifest is None and os.path.exists(manifest_path):
+            # The `dbt ls` that listed the selection wrote the manifest of the current project.
+            manifest = Manifest.load(manifest_path)
+        elif manifest is None:
+            manifest = self._parse_dbt_project(dbt_target)
+
+        warehouses = os.environ.get('DBT_SHARD_WAREHOUSES')
+        sharded_build = ShardedBuild(manifest, self._dbt_root, self._shard_count,
+                                     run_command=lambda command, args, env: self._execute_dbt_subprocess(
+                                         command, args, env=env),
+                                     warehouses=warehouses.split(',') if warehouses else None,
+                                     warehouse_env_var=os.environ.get('DBT_SHARD_WAREHOUSE_ENV_VAR',
+                                                                      'DATACOVES__MAIN__WAREHOUSE'),
+                                     target_path=self._target_path,
+                                     log_path=self._log_path,
+                                     max_select_chars=int(os.environ.get('MANIFEST_DIFF_MAX_SELECT_CHARS', 100000)))
+        failed = [x for x in sharded_build.run(unique_ids, base_args) if not x.success]
+        if failed:
+            raise subprocess.CalledProcessError(returncode=1, cmd=['dbt', 'build'] + base_args,
+                                                output=f'{len(failed)} of the build shards failed.')
+
+    def _list_dbt_nodes(self, ls_args: List[str]) -> List[dict]:
+        """
+        Runs `dbt ls` with JSON output and returns the parsed nodes.
+
+        Args:
+            ls_args: The arguments to pass to `dbt ls`. Must include `--output json`.
+
+        Returns:
+            A list of dicts, one per node, holding the requested output keys.
+        """
+        if self._in_process_runner is not None:
+            result = self._in_process_runner.invoke('ls', ls_args)
+            if not result.success:
+                raise subprocess.CalledProcessError(returncode=result.return_code, cmd=['dbt', 'ls'] + ls_args,
+                                                    output=str(result.exception))
+            return [json.loads(x) for x in result.results or [] if x.strip().startswith('{')]
+
+        dbt_command = ['dbt', 'ls'] + ls_args
+        self.logger.info(f'Running command: {" ".join(dbt_command)}')
+        result = subprocess.run(dbt_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                cwd=self._dbt_root, env=self._subprocess_env())
+        if result.returncode != 0:
+            self.logger.info(f"Command resulted in an error: {result.stderr}")
+            raise subprocess.CalledProcessError(returncode=result.returncode, cmd=dbt_command, output=result.stderr)
+
+        nodes = []
+        for line in result.stdout.splitlines():
+            line = line.strip()
+            if line.startswith('{'):
+                nodes.append(json.loads(line))
+        return nodes
 
     def _make_select_exclude_statement(self, do_snapshot: bool, do_seed: bool, do_run: bool, do_test: bool,
                                        snapshot_select: str, snapshot_exclude: str, seed_select: str, seed_exclude: str,
@@ -375,72 +1062,228 @@ class DBTBlueGreen(Core):
 
         return select_statement, exclude_statement
 
-    def _grant_prd_usage(self):
-        try:
-            sql = f'grant usage on database {self.green_database} to role z_db_{self.blue_database.lower()};'
-            self.con.cursor().execute(sql)
-            sql = f'grant usage on database {self.green_database} to role useradmin;'
-            self.con.cursor().execute(sql)
-        except Exception as e:
-            self.logger.info(f'Error granting usage to green database: {e}')
-            raise e
+    def _publish(self, schemas: Optional[List[str]] = None, swap: bool = True,
+                 statements: Optional[List[str]] = None):
+        """
+        Runs the end of the deploy as a single multi-statement query: grant usage on the green database, swap it into
+        production, drop it, and check that the blue database still exists. One round trip replaces one per
+        statement, which shortens the time between the build finishing and production seeing the new data. Transient
+        failures are retried, and steps that already took effect, such as the swap, are left out of the retry.
+
+        Args:
+            schemas: In schema swap mode, the schemas to swap instead of the whole database.
+            swap: Swap and drop the green database. If False, only grant usage on it.
+            statements: The batch for the first attempt, if it was prepared ahead by `_publish_statements`.
+
+        Returns:
+            None
+        """
+        if swap and schemas is not None:
+            # Swap only the built schemas back into the blue database
+            self.logger.info(f'Swapping schemas {", ".join(schemas)} from {self.green_database} into '
+                             f'{self.blue_database}')
+        elif swap:
+            self.logger.info(f'Swapping databases {self.blue_database} with {self.green_database}')
+
+        attempts = []
+
+        def publish():
+            batch = statements if statements and not attempts else \
+                self._publish_statements(schemas, swap, resume=bool(attempts))
+            attempts.append(batch)
+            return self._execute_batch(*batch, label=f'publish {self.green_database}')
 
-    def _swap_database(self):
         try:
-            sql = f'alter database {self.blue_database} swap with {self.green_database};'
-            self.con.cursor().execute(sql)
+            query = self._retry.call(publish, f'publish {self.green_database}')
         except Exception as e:
-            self.logger.info(f'Error swapping databases: {e}')
+            self.logger.info(f'Error publishing the green database: {e}')
             raise e
+        AsyncQueryRunner(self.con).fetch_elapsed([query])
+        self.logger.info(f'Published {self.green_database} with {len(attempts[-1])} statements in one round trip '
+                         f'({len(attempts)} attempts). Snowflake reports {query.elapsed_seconds} seconds '
+                         f'(query ID {query.query_id}).')
+
+    def _publish_statements(self, schemas: Optional[List[str]] = None, swap: bool = True,
+                            resume: bool = False) -> List[str]:
+        """
+        Builds the publish batch. When resuming after a failed attempt, creation times tell which databases or
+        schemas were already swapped: a swap or rename keeps the creation time, and the green copy was cloned during
+        this run, so it is newer than the production copy it replaces.
+
+        Args:
+            schemas: In schema swap mode, the schemas to swap instead of the whole database.
+            swap: Swap and drop the green database. If False, only grant usage on it.
+            resume: Leave out the steps that an earlier attempt already applied.
+
+        Returns:
+            A list of statements
+        """
+        describe = f'describe database {self.blue_database};'
+        if not swap:
+            return self._grant_statements(schemas) + [describe]
 
-    def _swap_database_if_failure(self):
+        green_exists = True
+        pending = schemas
+        if resume:
+            green_exists = self._check_if_database_exists(self.green_database)
+            if not green_exists:
+                self.logger.info(f'{self.green_database} was already swapped and dropped.')
+                return [describe]
+            if schemas is None:
+                created = {k.upper(): v for k, v in self._created_on(f"show databases like '{self.blue_database}';")
+                           .items()}
+                created.update({k.upper(): v for k, v in
+                                self._created_on(f"show databases like '{self.green_database}';").items()})
+                if created[self.green_database.upper()] < created[self.blue_database.upper()]:
+                    self.logger.info(f'{self.green_database} was already swapped with {self.blue_database}.')
+                    pending = []
+            else:
+                green_created = self._created_on(f'show schemas in database {self.green_database};')
+                blue_created = self._created_on(f'show schemas in database {self.blue_database};')
+                pending = [x for x in schemas if x in green_created and
+                           (x not in blue_created or green_created[x] > blue_created[x])]
+                if len(pending) < len(schemas):
+                    self.logger.info(f'Schemas already swapped into {self.blue_database}: '
+                                     f'{", ".join(x for x in schemas if x not in pending)}')
+
+        statements = []
+        if pending is None or pending:
+            statements += self._grant_statements(pending) + self._swap_statements(pending)
+        if green_exists:
+            statements.append(f'drop database if exists {self.green_database};')
+        return statements + [describe]
+
+    def _grant_statements(self, schemas: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the statements granting usage on the green database to the production roles.
+
+        Args:
+            schemas: In schema swap mode, the green schemas that will be swapped into the blue database. Schema level
+                     grants are not cloned, so usage is granted on each of them as well.
+
+        Returns:
+            A list of grant statements
+        """
+        statements = [f'grant usage on database {self.green_database} to role z_db_{self.blue_database.lower()};',
+                      f'grant usage on database {self.green_database} to role useradmin;']
+        for schema in schemas or []:
+            schema_name = f'{self.green_database}."{schema}"'
+            statements.append(f'grant usage on schema {schema_name} to role z_db_{self.blue_database.lower()};')
+            statements.append(f'grant usage on schema {schema_name} to role useradmin;')
+        return statements
+
+    def _swap_statements(self, schemas: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the statements swapping the green database into production. In schema swap mode each built schema is
+        swapped with the schema of the same name in the blue database, and schemas that are new in this build are
+        moved into the blue database with a rename.
+
+        Args:
+            schemas: The schemas to swap, or None to swap the whole database.
+
+        Returns:
+            A list of alter statements
+        """
+        if schemas is None:
+            return [f'alter database {self.blue_database} swap with {self.green_database};']
+
+        cursor = self.con.cursor()
+        cursor.execute(f'show schemas in database {self.blue_database};')
+        name_index = [x[0] for x in cursor.description].index('name')
+        blue_schemas = set(row[name_index] for row in cursor.fetchall())
+        statements = []
+        for schema in schemas:
+            if schema in blue_schemas:
+                statements.append(f'alter schema {self.blue_database}."{schema}" swap with '
+                                  f'{self.green_database}."{schema}";')
+            else:
+                statements.append(f'alter schema {self.green_database}."{schema}" rename to '
+                                  f'{self.blue_database}."{schema}";')
+        return statements
+
+    def _swap_database_if_failure(self, cdb: CloneDB):
+        """
+        Keeps the failed green database for debugging by renaming it to a timestamped `_ERROR_<timestamp>` name. A
+        rename is a metadata only operation, unlike a clone, and earlier failure snapshots are not replaced. Old
+        snapshots are removed by the garbage collector. If the rename fails the green database is dropped instead.
+
+        Args:
+            cdb: The CloneDB used to drop the green database.
+
+        Returns:
+            None
+        """
+        error_db = DatabaseGarbageCollector.error_database_name(self.green_database)
+        sql = f'alter database if exists {self.green_database} rename to {error_db};'
         try:
-            error_db = f'{self.green_database}_ERROR'
-            sql = f'create or replace database {error_db} clone {self.green_database};'
-            self.con.cursor().execute(sql)
-            sql = f'drop database if exists {self.green_database};'
-            self.con.cursor().execute(sql)
+            self.logger.info(f'Renaming the failed green database {self.green_database} to {error_db}')
+            self._retry.call(lambda: self._execute_ddl(sql), f'rename {self.green_database} to {error_db}')
         except Exception as e:
-            self.logger.info(f'Error swapping databases: {e}')
-            raise e
+            self.logger.info(f'Error renaming the green database to {error_db}: {e}')
+            # In the event of an error, drop the green database. If not dropped, the next run will fail.
+            cdb.drop_database()
 
-    def execute_dbt_command(self, command: str, args: List[str]):
+    def _subprocess_env(self, env: Optional[Dict[str, str]] = None) -> Optional[Dict[str, str]]:
+        """
+        Returns the environment for a dbt subprocess: this process's environment with the run's `dbt_env` and `env` on
+        top, or None to inherit it unchanged.
+        """
+        if not self._dbt_env and not env:
+            return None
+        return dict(os.environ, **self._dbt_env, **(env or {}))
 
+    def execute_dbt_command(self, command: str, args: List[str]) -> DbtCommandResult:
+        """
+        Runs a dbt command, in-process when available and otherwise as a subprocess. A failed command raises a
+        CalledProcessError either way.
+
+        Args:
+            command: The dbt sub command, such as `build`.
+            args: The command line arguments for the sub command.
+
+        Returns:
+            A DbtCommandResult
+        """
+        if self._in_process_runner is not None:
+            result = self._in_process_runner.invoke(command, args)
+            self.logger.info(f'dbt {command} finished: {result.status.summary()}')
+            if not result.success:
+                self.logger.info(f"Command resulted in an error: {result.exception}")
+                raise subprocess.CalledProcessError(returncode=result.return_code, cmd=['dbt', command] + args,
+                                                    output=str(result.exception))
+            return result
+        return self._execute_dbt_subprocess(command, args)
+
+    def _execute_dbt_subprocess(self, command: str, args: List[str],
+                                env: Optional[Dict[str, str]] = None) -> DbtCommandResult:
+        """
+        Runs a dbt command as a subprocess with JSON log output. Events are parsed as they stream in and collected in
+        a DbtRunStatus. stdout and stderr are drained together and only their last lines are kept, for the error.
+        The process is stopped if it hits `DBT_COMMAND_TIMEOUT` or `DBT_INACTIVITY_TIMEOUT`.
+
+        Args:
+            command: The dbt sub command, such as `build`.
+            args: The command line arguments for the sub command.
+            env: Environment variables to set for the dbt process, on top of this process's environment.
+
+        Returns:
+            A DbtCommandResult
+        """
         dbt_command = ['dbt', command] + args
         self.logger.info(f'Running command: {" ".join(dbt_command)}')
-        process = subprocess.Popen(
-            dbt_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,  # Ensure outputs are in text mode rather than bytes
-            cwd=self._dbt_root
-        )
-
-        # Real-time output streaming
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                self.logger.info(output.strip())  # self.logger.info each line of the output
-
-        # Capture and self.logger.info any remaining output after the loop
-        stdout, stderr = process.communicate()
-        if stdout:
-            self.logger.info(stdout.strip())
+        status = DbtRunStatus()
+        process = StreamingProcess(dbt_command + ['--log-format', 'json'], cwd=self._dbt_root,
+                                   env=self._subprocess_env(env), timeout=self._dbt_timeout,
+                                   inactivity_timeout=self._dbt_inactivity_timeout, tail_lines=self._dbt_tail_lines)
+        result = process.run(status.handle_line, on_stderr=lambda line: self.logger.debug(f'dbt stderr: {line}'))
+        self.logger.info(f'dbt {command} finished: {status.summary()}')
 
         # Check exit code
-        if process.returncode != 0:
-            self.logger.info(f"Command resulted in an error: {stderr}")
-            raise subprocess.CalledProcessError(returncode=process.returncode, cmd=dbt_command, output=stderr)
-
-        # Check for errors using a regex method if necessary
-        if self.contains_errors(stdout + stderr):
-            return False
-        return True
+        if result.return_code != 0:
+            self.logger.info(f"Command resulted in an error: {result.stderr}")
+            for error in status.errors:
+                self.logger.info(error)
+            raise subprocess.CalledProcessError(returncode=result.return_code, cmd=dbt_command, output=result.stderr)
 
-    @staticmethod
-    def contains_errors(text):
-        pattern = r"([2-9]|\d{2,})\s+errors?"
-        error_flag = bool(re.search(pattern, text))
-        return error_flag
+        success = status.success is not False and status.error_count == 0
+        return DbtCommandResult(command, success, result.return_code, status=status)
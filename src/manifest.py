@@ -0,0 +1,233 @@
+import json
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class Manifest:
+    """
+    A thin wrapper over a dbt `manifest.json` giving access to the node graph.
+    """
+
+    # Resource types that dbt build creates or runs.
+    BUILDABLE_TYPES = ('model', 'seed', 'snapshot', 'test', 'unit_test')
+
+    def __init__(self, data: dict):
+        """
+        Args:
+            data: The parsed contents of a manifest.json.
+        """
+        self.data = data
+        self.nodes: Dict[str, dict] = data.get('nodes', {})
+        self.macros: Dict[str, dict] = data.get('macros', {})
+        self.child_map: Dict[str, List[str]] = data.get('child_map') or self._build_child_map()
+        self._path_counts: Optional[Counter] = None
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        """
+        Reads a manifest.json file.
+
+        Args:
+            path: The path to the manifest.
+
+        Returns:
+            A Manifest
+        """
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def parents(self, unique_id: str) -> List[str]:
+        """
+        Returns the nodes a node depends on.
+        """
+        node = self.nodes.get(unique_id) or {}
+        return (node.get('depends_on') or {}).get('nodes') or []
+
+    def children(self, unique_id: str) -> List[str]:
+        """
+        Returns the nodes that depend on a node.
+        """
+        return self.child_map.get(unique_id, [])
+
+    def descendants(self, unique_ids: Iterable[str]) -> Set[str]:
+        """
+        Returns the given nodes and everything downstream of them.
+        """
+        seen = set()
+        stack = list(unique_ids)
+        while stack:
+            unique_id = stack.pop()
+            if unique_id in seen:
+                continue
+            seen.add(unique_id)
+            stack.extend(self.children(unique_id))
+        return seen
+
+    def parallel_width(self, unique_ids: Iterable[str]) -> int:
+        """
+        Estimates the most selected nodes dbt can run at the same time. Each selected node is placed one level below
+        its deepest selected ancestor, and the widest level is returned.
+
+        Args:
+            unique_ids: The selected nodes.
+
+        Returns:
+            The number of nodes in the widest level, or 0 for an empty selection.
+        """
+        selected = set(unique_ids)
+        depth = {}
+        for start in selected:
+            # Depth first without recursion, as chains of models can be deeper than the recursion limit.
+            stack = [(start, False)]
+            while stack:
+                unique_id, expanded = stack.pop()
+                if unique_id in depth:
+                    continue
+                if expanded:
+                    depth[unique_id] = max((depth[x] + (x in selected) for x in self.parents(unique_id)), default=0)
+                else:
+                    stack.append((unique_id, True))
+                    stack.extend((x, False) for x in self.parents(unique_id) if x not in depth)
+        return max(Counter(depth[x] for x in selected).values(), default=0)
+
+    def selected_ancestors(self, unique_ids: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        Finds, for each selected node, the nearest selected nodes upstream of it. Unselected nodes in between are
+        followed, so with `a -> b -> c` and only `a` and `c` selected, `a` is an ancestor of `c`.
+
+        Args:
+            unique_ids: The selected nodes.
+
+        Returns:
+            The selected ancestors of each selected node.
+        """
+        selected = set(unique_ids)
+        # The nearest selected ancestors of every node visited, selected or not.
+        reach: Dict[str, Set[str]] = {}
+        for start in selected:
+            # Depth first without recursion, as chains of models can be deeper than the recursion limit.
+            stack = [(start, False)]
+            while stack:
+                unique_id, expanded = stack.pop()
+                if unique_id in reach:
+                    continue
+                parents = self.parents(unique_id)
+                if expanded:
+                    reach[unique_id] = set().union(*({x} if x in selected else reach[x] for x in parents))
+                else:
+                    stack.append((unique_id, True))
+                    stack.extend((x, False) for x in parents if x not in selected and x not in reach)
+        return {x: reach[x] for x in selected}
+
+    def buildable(self, unique_ids: Iterable[str], resource_types: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        Filters a set of unique IDs down to nodes of the given resource types.
+        """
+        resource_types = set(resource_types or self.BUILDABLE_TYPES)
+        return {x for x in unique_ids if self.nodes.get(x, {}).get('resource_type') in resource_types}
+
+    def selector(self, unique_id: str) -> str:
+        """
+        Returns a dbt `--select` criterion matching exactly one node. `fqn:` alone is a prefix match, so a model named
+        like a folder would also select the folder. Nodes are selected by their file path instead, intersected with
+        their fully qualified name when the file defines several nodes, such as the generic tests of a YAML file.
+        """
+        node = self.nodes[unique_id]
+        fqn = 'fqn:' + '.'.join(node['fqn'])
+        path = node.get('original_file_path')
+        if not path:
+            return fqn
+        if self._path_counts is None:
+            self._path_counts = Counter(x.get('original_file_path') for x in self.nodes.values())
+        return f'path:{path},{fqn}' if self._path_counts[path] > 1 else f'path:{path}'
+
+    def _build_child_map(self) -> Dict[str, List[str]]:
+        child_map = {}
+        for unique_id in self.nodes:
+            for parent in self.parents(unique_id):
+                child_map.setdefault(parent, []).append(unique_id)
+        return child_map
+
+
+class ManifestDiff:
+    """
+    Compares the manifest of the last production run with the current one to find the nodes that need to be built.
+    This is a Python version of dbt's `state:modified+` selection, so a deploy with nothing to build can be skipped
+    before any warehouse work happens.
+    """
+
+    # Config keys that do not change what is built.
+    IGNORED_CONFIG_KEYS = {'database', 'meta', 'docs'}
+
+    def __init__(self, previous: Manifest, current: Manifest):
+        """
+        Args:
+            previous: The manifest from the last production run.
+            current: The manifest of the project being deployed.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.previous = previous
+        self.current = current
+
+    def modified_macros(self) -> Set[str]:
+        """
+        Returns the macros that are new or whose SQL changed, plus the macros that call them.
+        """
+        changed = set()
+        for unique_id, macro in self.current.macros.items():
+            old = self.previous.macros.get(unique_id)
+            if old is None or old.get('macro_sql') != macro.get('macro_sql'):
+                changed.add(unique_id)
+
+        # Propagate through macros calling changed macros.
+        callers = {}
+        for unique_id, macro in self.current.macros.items():
+            for dependency in (macro.get('depends_on') or {}).get('macros') or []:
+                callers.setdefault(dependency, []).append(unique_id)
+        stack = list(changed)
+        while stack:
+            for caller in callers.get(stack.pop(), []):
+                if caller not in changed:
+                    changed.add(caller)
+                    stack.append(caller)
+        return changed
+
+    def modified_nodes(self) -> Set[str]:
+        """
+        Returns the nodes that are new, or whose body, config, relation name or macros changed.
+        """
+        changed_macros = self.modified_macros()
+        modified = set()
+        for unique_id, node in self.current.nodes.items():
+            old = self.previous.nodes.get(unique_id)
+            if old is None or self._node_changed(old, node):
+                modified.add(unique_id)
+            elif changed_macros.intersection((node.get('depends_on') or {}).get('macros') or []):
+                modified.add(unique_id)
+        return modified
+
+    def impacted_nodes(self, resource_types: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        Returns the modified nodes and everything downstream of them, limited to buildable resource types.
+
+        Args:
+            resource_types: Only return nodes of these resource types. Defaults to every buildable type.
+
+        Returns:
+            A set of unique IDs
+        """
+        impacted = self.current.buildable(self.current.descendants(self.modified_nodes()), resource_types)
+        self.logger.info(f'Manifest diff found {len(impacted)} impacted nodes.')
+        return impacted
+
+    def _node_changed(self, old: dict, new: dict) -> bool:
+        if (old.get('checksum') or {}).get('checksum') != (new.get('checksum') or {}).get('checksum'):
+            return True
+        for key in ('resource_type', 'schema', 'alias'):
+            if old.get(key) != new.get(key):
+                return True
+        return self._config(old) != self._config(new)
+
+    def _config(self, node: dict) -> dict:
+        return {k: v for k, v in (node.get('config') or {}).items() if k not in self.IGNORED_CONFIG_KEYS}
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Span:
+    """
+    One timed phase of a run.
+    """
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.end = None
+        self.status = 'running'
+
+    @property
+    def seconds(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'start': self.start, 'end': self.end, 'seconds': self.seconds,
+                'status': self.status, 'attributes': self.attributes}
+
+
+class PhaseTimer:
+    """
+    Records how long each phase of a run takes and exports the spans as JSON and as an OpenMetrics text file that
+    the node exporter textfile collector can scrape. Spans may be opened from several threads and may nest.
+    """
+
+    METRIC_PREFIX = 'dbt_blue_green'
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            labels: Labels attached to every exported metric, such as the blue database.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.labels = labels or {}
+        self.spans: List[Span] = []
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the enclosed block as a phase. The span is marked `error` if the block raises.
+
+        Args:
+            name: The phase name, such as `clone`.
+            attributes: Extra details stored with the span in the JSON export.
+
+        Yields:
+            The Span
+        """
+        span = Span(name, attributes)
+        with self._lock:
+            self.spans.append(span)
+        try:
+            yield span
+            span.status = 'ok'
+        except BaseException:
+            span.status = 'error'
+            raise
+        finally:
+            span.end = time.time()
+            self.logger.info(f'Phase {name} took {span.seconds:.2f} seconds ({span.status}).')
+
+    def phase_totals(self) -> Dict[str, float]:
+        """
+        Returns the total seconds spent in each phase. Phases that ran more than once are summed.
+        """
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                if span.seconds is not None:
+                    totals[span.name] = totals.get(span.name, 0) + span.seconds
+        return totals
+
+    def export_json(self, path: str, success: Optional[bool] = None):
+        """
+        Writes every span to a JSON file.
+
+        Args:
+            path: The file to write.
+            success: Whether the run succeeded.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            spans = [x.to_dict() for x in self.spans]
+        data = {'labels': self.labels, 'start': self.start, 'end': time.time(), 'success': success, 'spans': spans}
+        self._write_atomic(path, json.dumps(data, indent=2))
+
+    def export_openmetrics(self, path: str, success: Optional[bool] = None):
+        """
+        Writes the phase durations in the OpenMetrics text format. The file is replaced atomically so a scrape never
+        sees a partial file.
+
+        Args:
+            path: The file to write. The node exporter textfile collector expects a `.prom` extension.
+            success: Whether the run succeeded.
+
+        Returns:
+            None
+        """
+        labels = ','.join(f'{self._label_name(k)}="{self._label_value(v)}"' for k, v in sorted(self.labels.items()))
+        prefix = f'{labels},' if labels else ''
+        p = self.METRIC_PREFIX
+        lines = [f'# HELP {p}_phase_duration_seconds Seconds spent in each phase of the last blue/green run.',
+                 f'# TYPE {p}_phase_duration_seconds gauge']
+        for phase, seconds in sorted(self.phase_totals().items()):
+            lines.append(f'{p}_phase_duration_seconds{{{prefix}phase="{self._label_value(phase)}"}} {seconds:.3f}')
+        lines += [f'# HELP {p}_run_duration_seconds Wall clock seconds of the last blue/green run.',
+                  f'# TYPE {p}_run_duration_seconds gauge',
+                  f'{p}_run_duration_seconds{{{labels}}} {time.time() - self.start:.3f}',
+                  f'# HELP {p}_run_timestamp_seconds Start time of the last blue/green run.',
+                  f'# TYPE {p}_run_timestamp_seconds gauge',
+                  f'{p}_run_timestamp_seconds{{{labels}}} {self.start:.3f}']
+        if success is not None:
+            lines += [f'# HELP {p}_run_success 1 if the last blue/green run succeeded.',
+                      f'# TYPE {p}_run_success gauge',
+                      f'{p}_run_success{{{labels}}} {1 if success else 0}']
+        lines.append('# EOF')
+        self._write_atomic(path, '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def _label_name(name: str) -> str:
+        return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+    @staticmethod
+    def _label_value(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def _write_atomic(path: str, text: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
@@ -0,0 +1,142 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from src.main import DBTBlueGreen
+
+
+class DeployTarget:
+    """
+    One blue/green database pair of a multi-target deploy.
+    """
+
+    def __init__(self, blue_database: str, green_database: Optional[str] = None):
+        self.blue_database = blue_database
+        self.green_database = green_database or f'{blue_database}_STAGING'
+
+    @classmethod
+    def parse(cls, value: str) -> 'DeployTarget':
+        """
+        Reads a target written as `BLUE` or `BLUE:GREEN`.
+        """
+        blue, _, green = value.strip().partition(':')
+        if not blue:
+            raise ValueError(f'Invalid deploy target {value!r}. Expected BLUE or BLUE:GREEN.')
+        return cls(blue, green or None)
+
+
+class DeployOutcome:
+    """
+    The result of the deploy of one target.
+    """
+
+    def __init__(self, target: DeployTarget):
+        self.target = target
+        self.success = False
+        self.exception: Optional[BaseException] = None
+        self.seconds = 0.0
+
+
+class MultiTargetDeploy:
+    """
+    Deploys several databases built from the same dbt project in one process. Up to `max_concurrency` blue/green
+    pipelines run at a time, each on its own thread with its own green database and its own dbt target and log
+    directories. They share the process's Snowflake connection pool, so sessions are reused across databases, and a
+    single `dbt deps`. The partial parse cache is restored into each target directory.
+
+    A failed pipeline rolls back its own green database and the others carry on.
+    """
+
+    def __init__(self,
+                 targets: List[DeployTarget],
+                 max_concurrency: int = 4,
+                 thread_count: int = 20,
+                 query_tag: Optional[str] = None,
+                 dbt_root: Optional[str] = None,
+                 database_env_var: Optional[str] = 'DATACOVES__MAIN__DATABASE'):
+        """
+        Args:
+            targets: The databases to deploy.
+            max_concurrency: The most pipelines to run at once.
+            thread_count: The dbt thread count, or the ceiling of it when the thread count is worked out per build.
+            query_tag: A name to identify the queries of the deploys in Snowflake.
+            dbt_root: The dbt project directory. Defaults to `transform` next to the launch root.
+            database_env_var: The environment variable set to each pipeline's blue database for its dbt commands, as
+                              it would be for a `cmd.py` run of that database alone.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.targets = targets
+        self.max_concurrency = max(1, max_concurrency)
+        self.thread_count = thread_count
+        self.query_tag = query_tag
+        self.dbt_root = dbt_root
+        self.database_env_var = database_env_var
+
+    def make_pipeline(self, target: DeployTarget, dbt_deps_installed: bool = False) -> DBTBlueGreen:
+        """
+        Creates the DBTBlueGreen of one target, with the dbt environment that keeps it apart from the others.
+
+        Args:
+            target: The target to deploy.
+            dbt_deps_installed: Skip `dbt deps`, as another pipeline already installed the packages.
+
+        Returns:
+            A DBTBlueGreen
+        """
+        name = target.blue_database.lower()
+        dbt_env = {'DBT_TARGET_PATH': os.path.join('target', name), 'DBT_LOG_PATH': os.path.join('logs', name)}
+        if self.database_env_var:
+            dbt_env[self.database_env_var] = target.blue_database
+        return DBTBlueGreen(target.blue_database, target.green_database, thread_count=self.thread_count,
+                            query_tag=self.query_tag, dbt_root=self.dbt_root, dbt_env=dbt_env,
+                            execution_mode='subprocess', dbt_deps_installed=dbt_deps_installed)
+
+    def run(self, **main_kwargs) -> List[DeployOutcome]:
+        """
+        Deploys every target.
+
+        Args:
+            main_kwargs: Keyword arguments for `DBTBlueGreen.main`, used for every target.
+
+        Returns:
+            One DeployOutcome per target, in the order of the targets.
+        """
+        outcomes = [DeployOutcome(x) for x in self.targets]
+        if not self.targets:
+            return outcomes
+        self.logger.info(f'Deploying {len(self.targets)} databases, {self.max_concurrency} at a time: '
+                         f'{", ".join(x.blue_database for x in self.targets)}')
+
+        # Install the dbt packages once, through the first pipeline, before any of them start.
+        try:
+            first = self.make_pipeline(self.targets[0])
+            first.install_dbt_deps()
+        except Exception as e:
+            self.logger.error(f'Unable to prepare the dbt project. No database was deployed: {e}')
+            for outcome in outcomes:
+                outcome.exception = e
+            return outcomes
+
+        def deploy(index: int):
+            outcome = outcomes[index]
+            start = time.time()
+            try:
+                pipeline = first if index == 0 else self.make_pipeline(outcome.target, dbt_deps_installed=True)
+                pipeline.main(**main_kwargs)
+                outcome.success = True
+            except Exception as e:
+                outcome.exception = e
+                self.logger.error(f'Deploy of {outcome.target.blue_database} failed: {e}')
+            finally:
+                outcome.seconds = time.time() - start
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(self.targets)),
+                                thread_name_prefix='blue_green') as executor:
+            list(executor.map(deploy, range(len(self.targets))))
+
+        for outcome in outcomes:
+            self.logger.info(f'{outcome.target.blue_database}: {"succeeded" if outcome.success else "failed"} in '
+                             f'{outcome.seconds:.1f} seconds.')
+        return outcomes
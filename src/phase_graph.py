@@ -0,0 +1,118 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class Phase:
+    """
+    One step of a deploy and the steps it has to wait for.
+    """
+
+    def __init__(self, name: str, function: Callable[[], None], depends_on: Iterable[str] = (),
+                 when: Optional[Callable[[], bool]] = None):
+        self.name = name
+        self.function = function
+        self.depends_on = list(depends_on)
+        self.when = when
+        # pending, running, done, skipped (its condition was false), failed or cancelled (after another failure)
+        self.status = 'pending'
+        self.exception: Optional[BaseException] = None
+
+
+class PhaseGraph:
+    """
+    Runs the phases of a deploy as a dependency graph. A phase starts as soon as every phase it depends on is done, so
+    phases without a data dependency between them overlap. Phases are started in the order they were added when more
+    than one is ready, so with `max_workers=1` the graph runs them one after another.
+
+    A phase with a `when` condition that is false once its dependencies are done is skipped without running, and
+    counts as done for the phases that depend on it. When a phase fails no new phase is started, the running phases are
+    waited for, and the first failure is raised.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """
+        Args:
+            max_workers: The most phases to run at once.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_workers = max(1, max_workers)
+        self.phases: Dict[str, Phase] = {}
+        self.failed: Optional[str] = None
+
+    def add(self, name: str, function: Callable[[], None], depends_on: Iterable[str] = (),
+            when: Optional[Callable[[], bool]] = None):
+        """
+        Adds a phase. The phases it depends on must already be in the graph, which keeps the graph free of cycles.
+
+        Args:
+            name: A unique name for the phase.
+            function: The work of the phase.
+            depends_on: The names of the phases that must be done before this one starts.
+            when: Only run the phase if this returns True when it is ready to start.
+
+        Returns:
+            None
+        """
+        if name in self.phases:
+            raise ValueError(f'Phase {name} is already in the graph.')
+        phase = Phase(name, function, depends_on, when)
+        missing = [x for x in phase.depends_on if x not in self.phases]
+        if missing:
+            raise ValueError(f'Phase {name} depends on unknown phases: {", ".join(missing)}')
+        self.phases[name] = phase
+
+    @property
+    def started(self) -> List[str]:
+        """
+        Returns the names of the phases that started, whether or not they finished.
+        """
+        return [x.name for x in self.phases.values() if x.status in ('running', 'done', 'failed')]
+
+    def run(self):
+        """
+        Runs every phase, waiting for each one's dependencies.
+
+        Returns:
+            None
+        """
+        pending = list(self.phases.values())
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='phase') as executor:
+            while pending or running:
+                ready = True
+                while ready and self.failed is None:
+                    ready = False
+                    for phase in list(pending):
+                        if len(running) >= self.max_workers:
+                            break
+                        if all(self.phases[x].status in ('done', 'skipped') for x in phase.depends_on):
+                            pending.remove(phase)
+                            if phase.when is not None and not phase.when():
+                                # Skipping a phase may make the phases after it ready, so look again.
+                                phase.status = 'skipped'
+                                ready = True
+                                continue
+                            phase.status = 'running'
+                            running[executor.submit(phase.function)] = phase
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    phase = running.pop(future)
+                    phase.exception = future.exception()
+                    if phase.exception is None:
+                        phase.status = 'done'
+                        continue
+                    phase.status = 'failed'
+                    if self.failed is None:
+                        self.failed = phase.name
+                        if running:
+                            self.logger.info(f'Phase {phase.name} failed. Waiting for '
+                                             f'{", ".join(x.name for x in running.values())} to finish.')
+
+        for phase in pending:
+            phase.status = 'cancelled'
+        if self.failed is not None:
+            raise self.phases[self.failed].exception
@@ -0,0 +1,170 @@
+import logging
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+# Marks the end of a stream on the line queue.
+_EOF = object()
+
+
+class ProcessResult:
+    """
+    The exit code of a finished process and the last lines it wrote to each stream.
+    """
+
+    def __init__(self, return_code: int, stdout_tail: List[str], stderr_tail: List[str], lines: int):
+        self.return_code = return_code
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+        self.lines = lines
+
+    @property
+    def stderr(self) -> str:
+        return '\n'.join(self.stderr_tail)
+
+
+class StreamingProcess:
+    """
+    Runs a command and hands its output to callbacks line by line as it is written. Each of stdout and stderr is read
+    by its own thread, so a process that writes a lot to one stream never blocks on a full pipe while the other is
+    being read. Only the last `tail_lines` lines of each stream are kept, for error reporting, and the line queue
+    between the readers and the callbacks is bounded, so memory stays flat however much the process writes.
+
+    The process is terminated, then killed, if it runs longer than `timeout` seconds or writes nothing for
+    `inactivity_timeout` seconds.
+    """
+
+    def __init__(self,
+                 command: List[str],
+                 cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None,
+                 timeout: Optional[float] = None,
+                 inactivity_timeout: Optional[float] = None,
+                 tail_lines: int = 200,
+                 max_line_length: int = 1024 * 1024,
+                 kill_grace_seconds: float = 10):
+        """
+        Args:
+            command: The command and its arguments.
+            cwd: The working directory of the process.
+            env: The environment of the process. None inherits this process's environment.
+            timeout: The longest the process may run, in seconds. None for no limit.
+            inactivity_timeout: The longest the process may go without writing a line, in seconds. None for no limit.
+            tail_lines: The number of recent lines of each stream to keep.
+            max_line_length: Longer lines are handed over in pieces of this many characters.
+            kill_grace_seconds: How long a timed out process has to exit after being terminated before it is killed.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.inactivity_timeout = inactivity_timeout
+        self.tail_lines = tail_lines
+        self.max_line_length = max_line_length
+        self.kill_grace_seconds = kill_grace_seconds
+
+    def run(self, on_stdout: Callable[[str], None], on_stderr: Optional[Callable[[str], None]] = None) -> ProcessResult:
+        """
+        Runs the process to completion.
+
+        Args:
+            on_stdout: Called with each line of stdout, on the calling thread.
+            on_stderr: Called with each line of stderr, on the calling thread. If None, stderr is only kept in the tail.
+
+        Returns:
+            A ProcessResult
+
+        Raises:
+            subprocess.TimeoutExpired: The process hit a timeout and was stopped. The output holds the stderr tail.
+        """
+        process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   cwd=self.cwd, env=self.env)
+        lines = queue.Queue(maxsize=1000)
+        tails: Dict[str, Deque[str]] = {'stdout': deque(maxlen=self.tail_lines),
+                                        'stderr': deque(maxlen=self.tail_lines)}
+        callbacks = {'stdout': on_stdout, 'stderr': on_stderr}
+        readers = [threading.Thread(target=self._read, args=(stream, name, lines), name=f'dbt_{name}', daemon=True)
+                   for name, stream in (('stdout', process.stdout), ('stderr', process.stderr))]
+        for reader in readers:
+            reader.start()
+
+        start = last_output = time.monotonic()
+        open_streams = len(readers)
+        count = 0
+        try:
+            while open_streams:
+                reason = self._timed_out(start, last_output)
+                if reason:
+                    self._stop(process)
+                    self.logger.error(f'{" ".join(self.command[:2])} {reason}. Last output:\n'
+                                      + '\n'.join(list(tails['stdout'])[-20:] + list(tails['stderr'])))
+                    raise subprocess.TimeoutExpired(self.command, self.timeout or self.inactivity_timeout,
+                                                    output='\n'.join(tails['stderr']))
+                try:
+                    name, line = lines.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if line is _EOF:
+                    open_streams -= 1
+                    continue
+                last_output = time.monotonic()
+                count += 1
+                line = line.rstrip('\n')
+                tails[name].append(line)
+                if callbacks[name] is not None:
+                    callbacks[name](line)
+
+            remaining = None if self.timeout is None else max(0.0, self.timeout - (time.monotonic() - start))
+            try:
+                return_code = process.wait(timeout=remaining)
+            except subprocess.TimeoutExpired:
+                self._stop(process)
+                raise
+        finally:
+            if process.poll() is None:
+                self._stop(process)
+            self._join(process, readers, lines)
+
+        return ProcessResult(return_code, list(tails['stdout']), list(tails['stderr']), count)
+
+    def _read(self, stream, name: str, lines: queue.Queue):
+        try:
+            for line in iter(lambda: stream.readline(self.max_line_length), ''):
+                lines.put((name, line))
+        except (OSError, ValueError) as e:
+            # The stream was closed under the reader, after the process was stopped.
+            self.logger.debug(f'Stopped reading {name}: {e}')
+        finally:
+            lines.put((name, _EOF))
+
+    def _join(self, process: subprocess.Popen, readers: List[threading.Thread], lines: queue.Queue):
+        # Discard what is left on the queue so a reader blocked on a full queue can reach the end of its stream.
+        deadline = time.monotonic() + self.kill_grace_seconds
+        while any(x.is_alive() for x in readers) and time.monotonic() < deadline:
+            try:
+                lines.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if not any(x.is_alive() for x in readers):
+            for stream in (process.stdout, process.stderr):
+                stream.close()
+
+    def _timed_out(self, start: float, last_output: float) -> Optional[str]:
+        now = time.monotonic()
+        if self.timeout is not None and now - start > self.timeout:
+            return f'ran for more than {self.timeout:g} seconds'
+        if self.inactivity_timeout is not None and now - last_output > self.inactivity_timeout:
+            return f'wrote no output for {self.inactivity_timeout:g} seconds'
+        return None
+
+    def _stop(self, process: subprocess.Popen):
+        process.terminate()
+        try:
+            process.wait(timeout=self.kill_grace_seconds)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
@@ -0,0 +1,126 @@
+import logging
+import os
+import random
+import time
+from typing import Callable, Optional, TypeVar
+
+from snowflake.connector import errors
+
+T = TypeVar('T')
+
+# Snowflake error codes worth another attempt. Set SNOWFLAKE_RETRYABLE_ERRORS to a comma separated list to add more.
+RETRYABLE_ERROR_CODES = {
+    603,  # SQL execution internal error. Processing was aborted on the Snowflake side.
+    604,  # SQL execution canceled, for example by a service restart.
+    625,  # The statement was aborted waiting for a lock held by another statement.
+    250001,  # Could not connect to Snowflake.
+    250002,  # The connection was closed.
+    250003,  # A request to Snowflake failed, usually a network error or an HTTP 5xx.
+    251011,  # The connection timed out.
+}
+
+# Connector exceptions that are transient by nature, whatever their error code.
+RETRYABLE_ERROR_TYPES = tuple(getattr(errors, x) for x in [
+    'OperationalError', 'InterfaceError', 'ServiceUnavailableError', 'GatewayTimeoutError', 'BadGatewayError',
+    'InternalServerError', 'OtherHTTPRetryableError', 'RequestTimeoutError'] if hasattr(errors, x))
+
+
+class RetryPolicy:
+    """
+    Retries Snowflake control statements that fail with a transient error, waiting an exponentially growing, jittered
+    delay between attempts. Statements that are not safe to run twice, such as a clone or a swap, pass an `is_done`
+    check that runs before each retry. If the failed attempt actually took effect on Snowflake, the retry is skipped.
+    """
+
+    def __init__(self,
+                 max_attempts: int = 4,
+                 initial_delay: float = 2,
+                 max_delay: float = 60,
+                 multiplier: float = 2,
+                 retryable_codes: Optional[set] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            max_attempts: The most attempts, including the first one.
+            initial_delay: The base delay in seconds before the first retry.
+            max_delay: The longest delay between attempts.
+            multiplier: The growth of the base delay after each attempt.
+            retryable_codes: Snowflake error codes to retry. Defaults to RETRYABLE_ERROR_CODES.
+            sleep: The function used to wait. Replaced in tests.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_attempts = max(1, max_attempts)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.retryable_codes = set(RETRYABLE_ERROR_CODES if retryable_codes is None else retryable_codes)
+        self.sleep = sleep
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        """
+        Builds a policy from the `SNOWFLAKE_RETRY_*` env vars.
+        """
+        extra_codes = os.environ.get('SNOWFLAKE_RETRYABLE_ERRORS')
+        codes = RETRYABLE_ERROR_CODES | {int(x) for x in extra_codes.split(',') if x.strip()} if extra_codes else None
+        return cls(max_attempts=int(os.environ.get('SNOWFLAKE_RETRY_MAX_ATTEMPTS', 4)),
+                   initial_delay=float(os.environ.get('SNOWFLAKE_RETRY_INITIAL_DELAY', 2)),
+                   max_delay=float(os.environ.get('SNOWFLAKE_RETRY_MAX_DELAY', 60)),
+                   retryable_codes=codes)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """
+        Returns True if an error is likely to go away on its own.
+        """
+        if getattr(error, 'errno', None) in self.retryable_codes:
+            return True
+        if isinstance(error, errors.Error):
+            return isinstance(error, RETRYABLE_ERROR_TYPES)
+        return isinstance(error, ConnectionError)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the wait before the retry following attempt number `attempt`, counting from 1. The delay is picked at
+        random from the upper half of the exponential backoff, so runs that failed together do not retry together.
+        """
+        base = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(base / 2, base)
+
+    def call(self, operation: Callable[[], T], description: str,
+             is_done: Optional[Callable[[], bool]] = None,
+             retryable: Optional[Callable[[BaseException], bool]] = None) -> Optional[T]:
+        """
+        Runs an operation, retrying transient failures.
+
+        Args:
+            operation: The operation to run. Called again on each retry.
+            description: What the operation does, for the logs.
+            is_done: Checks whether a failed attempt took effect anyway. Called before each retry. If it returns True
+                     the operation is not run again.
+            retryable: Decides which errors are retried instead of `is_retryable`.
+
+        Returns:
+            The result of the operation, or None if `is_done` found it had already taken effect.
+        """
+        attempt = 1
+        while True:
+            try:
+                return operation()
+            except Exception as e:
+                if attempt >= self.max_attempts or not (retryable or self.is_retryable)(e):
+                    raise
+                delay = self.delay(attempt)
+                self.logger.warning(f'Attempt {attempt} of {self.max_attempts} to {description} failed with a '
+                                    f'transient error: {e}. Retrying in {delay:.1f} seconds.')
+                self.sleep(delay)
+                attempt += 1
+
+            if is_done is not None:
+                try:
+                    done = is_done()
+                except Exception as e:
+                    self.logger.info(f'Unable to check whether the failed attempt to {description} took effect: {e}')
+                    done = False
+                if done:
+                    self.logger.info(f'The failed attempt to {description} took effect. Not running it again.')
+                    return None
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+A local history of per-node dbt timings, loaded from `target/run_results.json` after every build, and a command line
+tool to query it.
+
+    python -m src.run_history slowest --days 7
+    python -m src.run_history regressions --target prd --threshold 1.5
+    python -m src.run_history tags --days 30
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import statistics
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from src.utilities import Utilities
+
+SCHEMA = """
+create table if not exists node_runs (
+    invocation_id text not null,
+    node_id text not null,
+    target text not null,
+    run_date text not null,
+    started_at text,
+    status text,
+    execution_time real,
+    rows_affected integer,
+    primary key (invocation_id, node_id)
+);
+create index if not exists node_runs_node on node_runs (node_id, target, run_date);
+create index if not exists node_runs_date on node_runs (run_date);
+create table if not exists node_tags (
+    node_id text not null,
+    tag text not null,
+    primary key (node_id, tag)
+);
+"""
+
+
+class RunHistory:
+    """
+    A SQLite store of node timings keyed by node ID, target and date. Each build adds one row per node with its status,
+    execution time and rows affected, and rows older than `retention_days` are pruned on every load.
+    """
+
+    def __init__(self, db_path: str, retention_days: float = 90):
+        """
+        Args:
+            db_path: The SQLite file. Created with its directory if it does not exist.
+            retention_days: Drop rows older than this many days.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.db_path = os.path.expanduser(db_path)
+        self.retention_days = retention_days
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def ingest(self, run_results_path: str, target: Optional[str] = None,
+               manifest_path: Optional[str] = None) -> int:
+        """
+        Loads a run_results.json. Loading the same invocation twice does not add duplicate rows.
+
+        Args:
+            run_results_path: The run_results.json written by the build.
+            target: The dbt target of the build. Defaults to `default`.
+            manifest_path: A manifest.json to read the node tags from.
+
+        Returns:
+            The number of node rows added.
+        """
+        with open(run_results_path) as f:
+            run_results = json.load(f)
+        metadata = run_results.get('metadata', {})
+        invocation_id = metadata.get('invocation_id') or Utilities.get_current_utc_time().isoformat()
+        generated_at = self._parse_time(metadata.get('generated_at')) or Utilities.get_current_utc_time()
+
+        rows = []
+        for result in run_results.get('results', []):
+            started_at = next((x.get('started_at') for x in result.get('timing') or [] if x.get('name') == 'execute'),
+                              None)
+            rows_affected = (result.get('adapter_response') or {}).get('rows_affected')
+            rows.append((invocation_id, result['unique_id'], target or 'default', generated_at.strftime('%Y-%m-%d'),
+                         started_at, result.get('status'), result.get('execution_time'), rows_affected))
+
+        with self._connect() as db:
+            added = db.total_changes
+            db.executemany('insert or ignore into node_runs values (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            added = db.total_changes - added
+            if manifest_path and os.path.exists(manifest_path):
+                self._load_tags(db, manifest_path)
+        self.prune()
+        self.logger.info(f'Added {added} node timings from {run_results_path} to {self.db_path}.')
+        return added
+
+    def _load_tags(self, db: sqlite3.Connection, manifest_path: str):
+        with open(manifest_path) as f:
+            nodes = json.load(f).get('nodes', {})
+        tags = [(unique_id, tag) for unique_id, node in nodes.items() for tag in node.get('tags') or []]
+        db.executemany('delete from node_tags where node_id = ?', [(x,) for x in nodes])
+        db.executemany('insert or ignore into node_tags values (?, ?)', tags)
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """
+        Deletes rows older than the retention period.
+
+        Args:
+            now: The current time in UTC. Defaults to now.
+
+        Returns:
+            The number of rows deleted.
+        """
+        cutoff = ((now or Utilities.get_current_utc_time()) - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        with self._connect() as db:
+            return db.execute('delete from node_runs where run_date < ?', (cutoff,)).rowcount
+
+    def slowest(self, target: Optional[str] = None, days: float = 7, limit: int = 20) -> List[dict]:
+        """
+        Returns the nodes with the highest average execution time over the last `days` days.
+        """
+        sql = """
+            select node_id, count(*), avg(execution_time), max(execution_time), avg(rows_affected)
+            from node_runs
+            where run_date >= ? and (? is null or target = ?) and status in ('success', 'pass', 'warn')
+            group by node_id
+            order by avg(execution_time) desc
+            limit ?
+        """
+        with self._connect() as db:
+            rows = db.execute(sql, (self._since(days), target, target, limit)).fetchall()
+        return [{'node_id': x[0], 'runs': x[1], 'avg_seconds': x[2], 'max_seconds': x[3], 'avg_rows_affected': x[4]}
+                for x in rows]
+
+    def regressions(self, target: Optional[str] = None, days: float = 14, threshold: float = 1.5,
+                    min_seconds: float = 1.0, min_runs: int = 3) -> List[dict]:
+        """
+        Finds nodes whose latest execution time is well above the median of their earlier runs.
+
+        Args:
+            target: Only look at this dbt target.
+            days: The trailing window the median is taken over.
+            threshold: Report nodes whose latest run took at least this many times the median.
+            min_seconds: Ignore nodes whose latest run took less than this, as small timings are mostly noise.
+            min_runs: The fewest earlier runs a median is trusted from.
+
+        Returns:
+            The regressed nodes, largest ratio first.
+        """
+        sql = """
+            select node_id, target, execution_time
+            from node_runs
+            where run_date >= ? and (? is null or target = ?) and status in ('success', 'pass', 'warn')
+                and execution_time is not null
+            order by node_id, target, run_date, started_at
+        """
+        with self._connect() as db:
+            rows = db.execute(sql, (self._since(days), target, target)).fetchall()
+
+        history = {}
+        for node_id, node_target, seconds in rows:
+            history.setdefault((node_id, node_target), []).append(seconds)
+
+        regressions = []
+        for (node_id, node_target), timings in history.items():
+            *earlier, latest = timings
+            if len(earlier) < min_runs or latest < min_seconds:
+                continue
+            median = statistics.median(earlier)
+            if median > 0 and latest / median >= threshold:
+                regressions.append({'node_id': node_id, 'target': node_target, 'latest_seconds': latest,
+                                    'median_seconds': median, 'ratio': latest / median, 'runs': len(earlier)})
+        return sorted(regressions, key=lambda x: x['ratio'], reverse=True)
+
+    def time_by_tag(self, target: Optional[str] = None, days: float = 7) -> List[dict]:
+        """
+        Returns the total execution time of the nodes with each tag over the last `days` days, and the average per
+        build. Nodes without a tag are counted under `(untagged)`.
+        """
+        sql = """
+            select coalesce(t.tag, '(untagged)'), count(distinct r.invocation_id), sum(r.execution_time)
+            from node_runs r
+            left join node_tags t on t.node_id = r.node_id
+            where r.run_date >= ? and (? is null or r.target = ?)
+            group by 1
+            order by 3 desc
+        """
+        with self._connect() as db:
+            rows = db.execute(sql, (self._since(days), target, target)).fetchall()
+        return [{'tag': x[0], 'builds': x[1], 'total_seconds': x[2] or 0.0,
+                 'avg_seconds_per_build': (x[2] or 0.0) / x[1] if x[1] else 0.0} for x in rows]
+
+    @staticmethod
+    def _since(days: float) -> str:
+        return (Utilities.get_current_utc_time() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def _parse_time(value: Optional[str]) -> Optional[datetime]:
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return None
+
+
+def default_db_path() -> str:
+    return os.environ.get('BLUE_GREEN_RUN_HISTORY_DB', '~/.cache/dbt_blue_green/run_history.sqlite')
+
+
+def print_rows(rows: List[dict]):
+    if not rows:
+        print('No matching runs.')
+        return
+    columns = list(rows[0])
+    widths = {x: max(len(x), *(len(format_value(row[x])) for row in rows)) for x in columns}
+    print('  '.join(x.ljust(widths[x]) for x in columns))
+    for row in rows:
+        print('  '.join(format_value(row[x]).ljust(widths[x]) for x in columns))
+
+
+def format_value(value) -> str:
+    return f'{value:.2f}' if isinstance(value, float) else str(value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Query the local history of dbt node timings.')
+    parser.add_argument('report', choices=['slowest', 'regressions', 'tags'],
+                        help='slowest: the nodes with the highest average time. regressions: nodes whose latest run '
+                             'is well above their trailing median. tags: the total build time per tag.')
+    parser.add_argument('--db', default=default_db_path(), help='The history file. Defaults to the '
+                                                                'BLUE_GREEN_RUN_HISTORY_DB env var.')
+    parser.add_argument('--target', help='Only include builds of this dbt target.')
+    parser.add_argument('--days', type=float, help='The trailing window in days. Defaults to 7, or 14 for '
+                                                   'regressions.')
+    parser.add_argument('--limit', type=int, default=20, help='With slowest, the number of nodes to list.')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='With regressions, the ratio to the trailing median that counts as a regression.')
+    parser.add_argument('--min-seconds', type=float, default=1.0,
+                        help='With regressions, ignore nodes whose latest run took less than this.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args(argv)
+
+    history = RunHistory(args.db)
+    if args.report == 'slowest':
+        rows = history.slowest(args.target, days=args.days or 7, limit=args.limit)
+    elif args.report == 'regressions':
+        rows = history.regressions(args.target, days=args.days or 14, threshold=args.threshold,
+                                   min_seconds=args.min_seconds)
+    else:
+        rows = history.time_by_tag(args.target, days=args.days or 7)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_rows(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,258 @@
+import glob
+import heapq
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from src.dbt_runner import DbtCommandResult
+from src.manifest import Manifest
+
+
+class ShardResult:
+    """
+    The outcome of one shard of a sharded build.
+    """
+
+    def __init__(self, index: int, unique_ids: List[str], target_path: str):
+        self.index = index
+        self.unique_ids = unique_ids
+        self.target_path = target_path
+        self.result: Optional[DbtCommandResult] = None
+        self.exception: Optional[BaseException] = None
+        self.seconds = None
+
+    @property
+    def success(self) -> bool:
+        return self.exception is None and self.result is not None and self.result.success
+
+
+class ShardedBuild:
+    """
+    Splits a dbt build into independent shards and runs each shard as its own dbt process, side by side. Shards are
+    made of whole connected components of the selected nodes, so no node in one shard depends on a node in another
+    and the shards need no ordering between them. Components are packed into `shard_count` shards by node count.
+
+    Each shard starts from a copy of the build's partial parse state, so it does not parse the project from scratch. A
+    shard whose selection is longer than `max_select_chars` is run as several dbt commands in dependency order, as
+    Linux limits a single command line argument to 128 KiB.
+    """
+
+    def __init__(self,
+                 manifest: Manifest,
+                 project_dir: str,
+                 shard_count: int,
+                 run_command: Callable[[str, List[str], Dict[str, str]], DbtCommandResult],
+                 warehouses: Optional[List[str]] = None,
+                 warehouse_env_var: str = 'DATACOVES__MAIN__WAREHOUSE',
+                 target_path: str = 'target',
+                 log_path: str = 'logs',
+                 max_select_chars: int = 100000):
+        """
+        Args:
+            manifest: The manifest of the project being built.
+            project_dir: The dbt project directory.
+            shard_count: The number of shards to run at once.
+            run_command: Runs a dbt command in its own process. Takes the command, its arguments and extra
+                         environment variables.
+            warehouses: Optional warehouses to spread the shards over, one per shard in turn.
+            warehouse_env_var: The environment variable the dbt profile reads the warehouse from.
+            target_path: The dbt target directory of the build, relative to the project directory.
+            log_path: The dbt log directory of the build, relative to the project directory.
+            max_select_chars: The longest `--select` argument to pass to one dbt command.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.manifest = manifest
+        self.project_dir = project_dir
+        self.shard_count = max(1, shard_count)
+        self.run_command = run_command
+        self.warehouses = warehouses or []
+        self.warehouse_env_var = warehouse_env_var
+        self.target_path = target_path
+        self.log_path = log_path
+        self.max_select_chars = max_select_chars
+
+    def components(self, unique_ids: List[str]) -> List[List[str]]:
+        """
+        Groups the selected nodes into connected components, ignoring edge direction. Two selected nodes are connected
+        when one is upstream of the other in the full graph, even through unselected nodes, so that a single dbt
+        process keeps them in order.
+
+        Args:
+            unique_ids: The selected nodes.
+
+        Returns:
+            A list of components, largest first.
+        """
+        selected = set(unique_ids)
+        parent = {x: x for x in selected}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for unique_id, ancestors in self.manifest.selected_ancestors(selected).items():
+            for ancestor in ancestors:
+                parent[find(unique_id)] = find(ancestor)
+
+        groups = {}
+        for unique_id in sorted(selected):
+            groups.setdefault(find(unique_id), []).append(unique_id)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def plan(self, unique_ids: List[str]) -> List[List[str]]:
+        """
+        Packs the components of the selection into at most `shard_count` shards of similar size.
+
+        Args:
+            unique_ids: The selected nodes.
+
+        Returns:
+            A list of shards, each a list of unique IDs.
+        """
+        shards = [[] for _ in range(self.shard_count)]
+        for component in self.components(unique_ids):
+            min(shards, key=len).extend(component)
+        return [x for x in shards if x]
+
+    def batches(self, unique_ids: List[str]) -> List[List[str]]:
+        """
+        Splits a shard into batches whose `--select` fits in `max_select_chars`. The batches are in dependency order,
+        so running them one after another builds every node after the selected nodes upstream of it.
+
+        Args:
+            unique_ids: The nodes of the shard.
+
+        Returns:
+            A list of batches, each a list of unique IDs.
+        """
+        lengths = {x: len(self.manifest.selector(x)) + 1 for x in unique_ids}
+        if sum(lengths.values()) <= self.max_select_chars:
+            return [list(unique_ids)] if unique_ids else []
+
+        # Kahn's algorithm, taking the ready nodes in sorted order so the batches are stable between runs.
+        ancestors = self.manifest.selected_ancestors(unique_ids)
+        waiting = {x: len(ancestors[x]) for x in unique_ids}
+        children = {}
+        for unique_id, parents in ancestors.items():
+            for parent in parents:
+                children.setdefault(parent, []).append(unique_id)
+        ready = [x for x, count in waiting.items() if count == 0]
+        heapq.heapify(ready)
+
+        batches, batch, length = [], [], 0
+        while ready:
+            unique_id = heapq.heappop(ready)
+            if batch and length + lengths[unique_id] > self.max_select_chars:
+                batches.append(batch)
+                batch, length = [], 0
+            batch.append(unique_id)
+            length += lengths[unique_id]
+            for child in children.get(unique_id, []):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, child)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def run(self, unique_ids: List[str], build_args: List[str]) -> List[ShardResult]:
+        """
+        Builds the selected nodes shard by shard in parallel and merges the shards' run results into
+        `<target_path>/run_results.json`.
+
+        Args:
+            unique_ids: The selected nodes.
+            build_args: Arguments for `dbt build` other than the selection, such as `--threads` and `--target`.
+
+        Returns:
+            One ShardResult per shard.
+        """
+        shards = self.plan(unique_ids)
+        self.logger.info(f'Sharded build of {len(unique_ids)} nodes into {len(shards)} shards of sizes '
+                         f'{", ".join(str(len(x)) for x in shards)}.')
+        results = [ShardResult(i, shard, os.path.join(self.target_path, f'shard_{i}'))
+                   for i, shard in enumerate(shards)]
+        with ThreadPoolExecutor(max_workers=len(results) or 1) as executor:
+            list(executor.map(lambda x: self._run_shard(x, build_args), results))
+
+        self.merge_run_results(results)
+        for shard in results:
+            self.logger.info(f'Shard {shard.index}: {len(shard.unique_ids)} nodes, '
+                             f'{"succeeded" if shard.success else "failed"} in {shard.seconds:.1f} seconds.')
+        return results
+
+    def merge_run_results(self, shards: List[ShardResult]) -> Optional[dict]:
+        """
+        Combines the run results of each shard, one file per dbt command, into one report at
+        `<target_path>/run_results.json`.
+
+        Args:
+            shards: The finished shards.
+
+        Returns:
+            The merged run results, or None if no shard wrote any.
+        """
+        merged = None
+        paths = []
+        for shard in shards:
+            paths.extend(sorted(glob.glob(os.path.join(self.project_dir, shard.target_path, 'run_results*.json'))))
+        for path in paths:
+            with open(path) as f:
+                run_results = json.load(f)
+            if merged is None:
+                merged = run_results
+            else:
+                merged['results'].extend(run_results.get('results', []))
+                merged['elapsed_time'] = max(merged.get('elapsed_time', 0), run_results.get('elapsed_time', 0))
+        if merged is not None:
+            os.makedirs(os.path.join(self.project_dir, self.target_path), exist_ok=True)
+            with open(os.path.join(self.project_dir, self.target_path, 'run_results.json'), 'w') as f:
+                json.dump(merged, f)
+        return merged
+
+    def _run_shard(self, shard: ShardResult, build_args: List[str]):
+        start = time.time()
+        batches = self.batches(shard.unique_ids)
+        if len(batches) > 1:
+            self.logger.info(f'Shard {shard.index} selects too many nodes for one command. Building it in '
+                             f'{len(batches)} batches.')
+        env = {}
+        if self.warehouses:
+            env[self.warehouse_env_var] = self.warehouses[shard.index % len(self.warehouses)]
+        try:
+            self._prepare_target(shard.target_path)
+            for i, batch in enumerate(batches):
+                args = build_args + ['--select', ' '.join(self.manifest.selector(x) for x in batch),
+                                     '--target-path', shard.target_path,
+                                     '--log-path', os.path.join(self.log_path, f'shard_{shard.index}')]
+                shard.result = self.run_command('build', args, env)
+                run_results = os.path.join(self.project_dir, shard.target_path, 'run_results.json')
+                if len(batches) > 1 and os.path.exists(run_results):
+                    # The next batch writes its own run_results.json.
+                    os.replace(run_results, os.path.join(self.project_dir, shard.target_path,
+                                                         f'run_results_{i}.json'))
+                if not shard.result.success:
+                    break
+        except Exception as e:
+            self.logger.info(f'Shard {shard.index} failed: {e}')
+            shard.exception = e
+        shard.seconds = time.time() - start
+
+    def _prepare_target(self, target_path: str):
+        """
+        Clears the run results of an earlier build from a shard's target directory and copies in the build's partial
+        parse state, so dbt only re-parses what changed since.
+        """
+        shard_dir = os.path.join(self.project_dir, target_path)
+        os.makedirs(shard_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(shard_dir, 'run_results*.json')):
+            os.remove(path)
+        parse_file = os.path.join(self.project_dir, self.target_path, 'partial_parse.msgpack')
+        if os.path.exists(parse_file):
+            shutil.copy2(parse_file, os.path.join(shard_dir, 'partial_parse.msgpack'))
@@ -0,0 +1,122 @@
+import logging
+from typing import Optional
+
+from snowflake.connector import SnowflakeConnection
+
+from src.async_query import AsyncQuery, AsyncQueryRunner
+
+
+class StandbyStatus:
+    """
+    The state of the standby database when it was checked.
+    """
+
+    def __init__(self, age_seconds: Optional[float], blue_changed: bool):
+        self.age_seconds = age_seconds
+        # True if a table in the blue database was altered after the standby was cloned.
+        self.blue_changed = blue_changed
+
+
+class GreenStandby:
+    """
+    Keeps a pre-cloned copy of the blue database ready so a deploy can claim it with a rename instead of waiting on a
+    clone. The standby is refreshed after each successful run, or on a schedule, and is only claimed while it is
+    younger than `max_age_minutes` and no table in the blue database has changed since it was cloned.
+    """
+
+    def __init__(self,
+                 con: SnowflakeConnection,
+                 blue_database: str,
+                 green_database: str,
+                 standby_database: Optional[str] = None,
+                 max_age_minutes: float = 60):
+        """
+        Args:
+            con: The Snowflake connection to use.
+            blue_database: The production database the standby is cloned from.
+            green_database: The green database the standby is renamed to when claimed.
+            standby_database: The name of the standby. Defaults to `<green>_STANDBY`.
+            max_age_minutes: Never claim a standby older than this.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.con = con
+        self.blue_database = blue_database
+        self.green_database = green_database
+        self.standby_database = standby_database or f'{green_database}_STANDBY'
+        self.max_age_minutes = max_age_minutes
+
+    def status(self) -> Optional[StandbyStatus]:
+        """
+        Reads the age of the standby and whether the blue database changed after it was cloned. Both are worked out
+        from Snowflake's own clock.
+
+        Returns:
+            A StandbyStatus, or None if there is no standby.
+        """
+        sql = f"""
+            select datediff('second', s.created, current_timestamp()) as age_seconds,
+                   coalesce((select max(last_altered) from {self.blue_database}.information_schema.tables)
+                            > s.created, false) as blue_changed
+            from {self.blue_database}.information_schema.databases s
+            where s.database_name = '{self.standby_database.upper()}'
+        """
+        cursor = self.con.cursor()
+        cursor.execute(sql)
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return StandbyStatus(row[0], bool(row[1]))
+
+    def claim(self) -> bool:
+        """
+        Renames a fresh standby to the green database. A stale standby is dropped instead.
+
+        Returns:
+            True if the standby was claimed and the green database is ready to build in.
+        """
+        try:
+            status = self.status()
+        except Exception as e:
+            self.logger.info(f'Unable to check the standby database {self.standby_database}: {e}')
+            return False
+
+        if status is None:
+            self.logger.info(f'No standby database {self.standby_database}.')
+            return False
+        if status.blue_changed or status.age_seconds is None or status.age_seconds > self.max_age_minutes * 60:
+            reason = 'the blue database changed after it was cloned' if status.blue_changed else \
+                f'it is {status.age_seconds} seconds old'
+            self.logger.info(f'The standby database {self.standby_database} is stale because {reason}. Dropping it.')
+            AsyncQueryRunner(self.con).run(f'drop database if exists {self.standby_database};')
+            return False
+
+        try:
+            # Fails if another run claimed the standby first.
+            AsyncQueryRunner(self.con).run(f'alter database {self.standby_database} rename to {self.green_database};')
+        except Exception as e:
+            self.logger.info(f'Unable to claim the standby database {self.standby_database}: {e}')
+            return False
+        self.logger.info(f'Claimed the standby database {self.standby_database} ({status.age_seconds} seconds old) as '
+                         f'green database {self.green_database}.')
+        return True
+
+    def refresh(self, wait: bool = False) -> AsyncQuery:
+        """
+        Replaces the standby with a new clone of the blue database.
+
+        Args:
+            wait: Wait for the clone to finish. Otherwise the clone is left running on Snowflake, which finishes it
+                  after this process exits as long as ABORT_DETACHED_QUERY is not set.
+
+        Returns:
+            The clone query
+        """
+        runner = AsyncQueryRunner(self.con)
+        query = runner.submit(f'create or replace database {self.standby_database} clone {self.blue_database};')
+        if wait:
+            runner.wait([query])
+            self.logger.info(f'Refreshed the standby database {self.standby_database}.')
+        else:
+            self.logger.info(f'Refreshing the standby database {self.standby_database} in the background '
+                             f'(query ID {query.query_id}).')
+        return query
@@ -0,0 +1,237 @@
+import logging
+import math
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from snowflake.connector import SnowflakeConnection
+
+from src.retry import RetryPolicy
+
+# Warehouse sizes from smallest to largest, as `alter warehouse` accepts them.
+WAREHOUSE_SIZES = ['XSMALL', 'SMALL', 'MEDIUM', 'LARGE', 'XLARGE', 'XXLARGE', 'XXXLARGE', 'X4LARGE', 'X5LARGE',
+                   'X6LARGE']
+
+# `show warehouses` reports sizes such as `X-Small` and `2X-Large`.
+_SIZE_ALIASES = {'2XLARGE': 'XXLARGE', '3XLARGE': 'XXXLARGE', '4XLARGE': 'X4LARGE', '5XLARGE': 'X5LARGE',
+                 '6XLARGE': 'X6LARGE'}
+
+
+def normalize_size(size: str) -> str:
+    """
+    Converts a warehouse size as written by a user or reported by `show warehouses` to the form `alter warehouse`
+    accepts, such as `X-Small` to `XSMALL`.
+    """
+    normalized = size.upper().replace('-', '').replace('_', '').replace(' ', '')
+    normalized = _SIZE_ALIASES.get(normalized, normalized)
+    if normalized not in WAREHOUSE_SIZES:
+        raise ValueError(f'Unknown warehouse size {size}. Expected one of {", ".join(WAREHOUSE_SIZES)}.')
+    return normalized
+
+
+class WarehouseSettings:
+    """
+    The size and cluster counts of a warehouse.
+    """
+
+    def __init__(self, size: str, min_cluster_count: Optional[int] = None, max_cluster_count: Optional[int] = None):
+        self.size = size
+        self.min_cluster_count = min_cluster_count
+        self.max_cluster_count = max_cluster_count
+
+    def __eq__(self, other):
+        return isinstance(other, WarehouseSettings) and \
+            (self.size, self.min_cluster_count, self.max_cluster_count) == \
+            (other.size, other.min_cluster_count, other.max_cluster_count)
+
+    def __repr__(self):
+        return f'WarehouseSettings({self.size}, {self.min_cluster_count}, {self.max_cluster_count})'
+
+
+class WarehouseResizer:
+    """
+    Resizes the build warehouse for the duration of the dbt build and puts the original settings back afterwards,
+    whether the build succeeded or not. The size is an explicit setting, the full refresh size for a full refresh, or
+    picked from the number of selected nodes. On a multi-cluster warehouse the maximum cluster count is also set so
+    the clusters match the dbt thread count.
+
+    Runs that share a warehouse should not resize it, as each run restores the settings it found when it started.
+    """
+
+    DEFAULT_SIZE_BY_NODES = {0: 'XSMALL', 100: 'SMALL', 500: 'MEDIUM', 2000: 'LARGE'}
+
+    def __init__(self,
+                 con: SnowflakeConnection,
+                 warehouse: str,
+                 size: Optional[str] = None,
+                 full_refresh_size: Optional[str] = 'LARGE',
+                 size_by_nodes: Optional[Dict[int, str]] = None,
+                 threads_per_cluster: Optional[int] = None,
+                 min_clusters: int = 1,
+                 max_clusters: int = 10,
+                 retry: Optional[RetryPolicy] = None):
+        """
+        Args:
+            con: The Snowflake connection to use.
+            warehouse: The warehouse dbt builds with.
+            size: Always use this size.
+            full_refresh_size: The size for a full refresh. If None, a full refresh is sized like any other build.
+            size_by_nodes: The size to use from each number of selected nodes upwards.
+            threads_per_cluster: The dbt threads one cluster serves. If None, the cluster counts are left alone.
+            min_clusters: The minimum cluster count while building, when the cluster counts are set.
+            max_clusters: Never set a maximum cluster count higher than this.
+            retry: The retry policy for the alter statements.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.con = con
+        self.warehouse = warehouse
+        self.size = normalize_size(size) if size else None
+        self.full_refresh_size = normalize_size(full_refresh_size) if full_refresh_size else None
+        self.size_by_nodes = {k: normalize_size(v) for k, v in (size_by_nodes or self.DEFAULT_SIZE_BY_NODES).items()}
+        self.threads_per_cluster = threads_per_cluster
+        self.min_clusters = min_clusters
+        self.max_clusters = max_clusters
+        self.retry = retry or RetryPolicy()
+
+    @classmethod
+    def from_env(cls, con: SnowflakeConnection, warehouse: str, size: Optional[str] = None) -> 'WarehouseResizer':
+        """
+        Builds a resizer from the `BLUE_GREEN_WAREHOUSE_*` env vars.
+
+        Args:
+            con: The Snowflake connection to use.
+            warehouse: The warehouse dbt builds with.
+            size: An explicit size, which takes precedence over `BLUE_GREEN_WAREHOUSE_SIZE`.
+        """
+        size_by_nodes = None
+        if os.environ.get('BLUE_GREEN_WAREHOUSE_SIZE_BY_NODES'):
+            # Such as `0=XSMALL,100=SMALL,500=MEDIUM`
+            size_by_nodes = {int(k): v for k, _, v in (x.partition('=') for x in
+                             os.environ['BLUE_GREEN_WAREHOUSE_SIZE_BY_NODES'].split(',') if x.strip())}
+        threads_per_cluster = os.environ.get('BLUE_GREEN_WAREHOUSE_THREADS_PER_CLUSTER')
+        return cls(con, warehouse,
+                   size=size or os.environ.get('BLUE_GREEN_WAREHOUSE_SIZE'),
+                   full_refresh_size=os.environ.get('BLUE_GREEN_WAREHOUSE_FULL_REFRESH_SIZE', 'LARGE') or None,
+                   size_by_nodes=size_by_nodes,
+                   threads_per_cluster=int(threads_per_cluster) if threads_per_cluster else None,
+                   min_clusters=int(os.environ.get('BLUE_GREEN_WAREHOUSE_MIN_CLUSTERS', 1)),
+                   max_clusters=int(os.environ.get('BLUE_GREEN_WAREHOUSE_MAX_CLUSTERS', 10)),
+                   retry=RetryPolicy.from_env())
+
+    def needs_node_count(self, full_refresh: bool) -> bool:
+        """
+        Returns True if the size depends on the number of selected nodes, so they need to be counted.
+        """
+        return not self.size and not (full_refresh and self.full_refresh_size)
+
+    def choose_size(self, node_count: Optional[int], full_refresh: bool = False) -> Optional[str]:
+        """
+        Picks the warehouse size for a build.
+
+        Args:
+            node_count: The number of selected nodes, or None if unknown.
+            full_refresh: The build is a full refresh.
+
+        Returns:
+            The size, or None to leave the warehouse as it is.
+        """
+        if self.size:
+            return self.size
+        if full_refresh and self.full_refresh_size:
+            return self.full_refresh_size
+        if node_count is None:
+            return None
+        size = None
+        for threshold in sorted(self.size_by_nodes):
+            if node_count >= threshold:
+                size = self.size_by_nodes[threshold]
+        return size
+
+    def target_settings(self, current: WarehouseSettings, size: Optional[str],
+                        thread_count: int) -> WarehouseSettings:
+        """
+        Works out the settings to build with from the current ones.
+
+        Args:
+            current: The settings of the warehouse now.
+            size: The size to build with, or None to keep the current size.
+            thread_count: The dbt thread count.
+
+        Returns:
+            The settings to build with
+        """
+        target = WarehouseSettings(size or current.size, current.min_cluster_count, current.max_cluster_count)
+        if self.threads_per_cluster and current.max_cluster_count is not None:
+            clusters = max(1, math.ceil(thread_count / self.threads_per_cluster))
+            target.max_cluster_count = min(self.max_clusters, clusters)
+            target.min_cluster_count = min(self.min_clusters, target.max_cluster_count)
+        return target
+
+    def current(self) -> Optional[WarehouseSettings]:
+        """
+        Reads the size and cluster counts of the warehouse.
+
+        Returns:
+            The WarehouseSettings, or None if the warehouse is not visible to the role.
+        """
+        cursor = self.con.cursor()
+        cursor.execute(f"show warehouses like '{self.warehouse}';")
+        columns = [x[0].lower() for x in cursor.description]
+        for row in cursor.fetchall():
+            values = dict(zip(columns, row))
+            if str(values.get('name', '')).upper() != self.warehouse.upper():
+                continue
+            min_clusters, max_clusters = values.get('min_cluster_count'), values.get('max_cluster_count')
+            return WarehouseSettings(normalize_size(values['size']),
+                                     int(min_clusters) if min_clusters not in (None, '') else None,
+                                     int(max_clusters) if max_clusters not in (None, '') else None)
+        return None
+
+    def apply(self, settings: WarehouseSettings):
+        """
+        Alters the warehouse to the given settings in one statement.
+        """
+        sql = f"alter warehouse {self.warehouse} set warehouse_size = '{settings.size}'"
+        if settings.min_cluster_count is not None and settings.max_cluster_count is not None:
+            sql += f' min_cluster_count = {settings.min_cluster_count} max_cluster_count = {settings.max_cluster_count}'
+        self.retry.call(lambda: self.con.cursor().execute(sql + ';'), f'resize warehouse {self.warehouse}')
+
+    @contextmanager
+    def resized(self, node_count: Optional[int], thread_count: int, full_refresh: bool = False) -> Iterator[None]:
+        """
+        Resizes the warehouse for the duration of the block and restores the original settings when it exits, even if
+        the block raises. A failure to resize is logged and the block runs on the warehouse as it is.
+
+        Args:
+            node_count: The number of selected nodes, or None if unknown.
+            thread_count: The dbt thread count.
+            full_refresh: The build is a full refresh.
+        """
+        original = None
+        try:
+            size = self.choose_size(node_count, full_refresh)
+            current = self.current()
+            if current is None:
+                self.logger.warning(f'Warehouse {self.warehouse} not found. Not resizing it.')
+            else:
+                target = self.target_settings(current, size, thread_count)
+                if target != current:
+                    self.logger.info(f'Resizing warehouse {self.warehouse} from {current.size} to {target.size} '
+                                     f'(clusters {target.min_cluster_count}-{target.max_cluster_count}) for '
+                                     f'{"a full refresh of " if full_refresh else ""}'
+                                     f'{"an unknown number of" if node_count is None else node_count} nodes.')
+                    original = current
+                    self.apply(target)
+        except Exception as e:
+            self.logger.warning(f'Unable to resize warehouse {self.warehouse}. Building on it as it is: {e}')
+
+        try:
+            yield
+        finally:
+            if original is not None:
+                try:
+                    self.apply(original)
+                    self.logger.info(f'Restored warehouse {self.warehouse} to {original.size}.')
+                except Exception as e:
+                    self.logger.error(f'Unable to restore warehouse {self.warehouse} to {original}. It must be '
+                                      f'resized by hand: {e}')
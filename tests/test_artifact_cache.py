@@ -0,0 +1,122 @@
+import io
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+from src.artifact_cache import ArtifactCache, DepsCache, PartialParseCache
+
+
+class DepsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.project_dir = os.path.join(self.tmp.name, 'project')
+        os.makedirs(os.path.join(self.project_dir, 'dbt_packages', 'dbt_utils'))
+        with open(os.path.join(self.project_dir, 'packages.yml'), 'w') as f:
+            f.write('packages:\n  - package: dbt-labs/dbt_utils\n    version: 1.1.1\n')
+        with open(os.path.join(self.project_dir, 'dbt_packages', 'dbt_utils', 'macro.sql'), 'w') as f:
+            f.write('select 1')
+        self.cache = DepsCache(self.project_dir, os.path.join(self.tmp.name, 'cache'), max_entries=2)
+
+    def test_save_and_restore(self):
+        key = self.cache.key()
+        self.assertFalse(self.cache.restore(key))
+        self.cache.save(key)
+        os.remove(os.path.join(self.project_dir, 'dbt_packages', 'dbt_utils', 'macro.sql'))
+        self.assertTrue(self.cache.restore(key))
+        self.assertTrue(os.path.exists(os.path.join(self.project_dir, 'dbt_packages', 'dbt_utils', 'macro.sql')))
+
+    def test_key_changes_with_packages(self):
+        key = self.cache.key()
+        with open(os.path.join(self.project_dir, 'packages.yml'), 'a') as f:
+            f.write('  - package: calogica/dbt_expectations\n')
+        self.assertNotEqual(key, self.cache.key())
+
+    def test_refuses_members_outside_packages_dir(self):
+        key = self.cache.key()
+        os.makedirs(self.cache.cache_dir, exist_ok=True)
+        with tarfile.open(self.cache._archive_path(key), 'w:gz') as tar:
+            data = b'owned'
+            member = tarfile.TarInfo('dbt_packages/../../escaped.txt')
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+        self.assertFalse(self.cache.restore(key))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'escaped.txt')))
+        self.assertFalse(os.path.exists(self.cache._archive_path(key)))
+
+
+class ArtifactCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ArtifactCache(tmp, max_entries=2)
+            for i, name in enumerate(['a', 'b', 'c']):
+                path = os.path.join(tmp, name)
+                with open(path, 'w') as f:
+                    f.write(name)
+                os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+            cache.touch(os.path.join(tmp, 'a'))
+            cache.evict()
+            self.assertEqual(['a', 'c'], sorted(os.listdir(tmp)))
+
+
+class PartialParseCacheTest(unittest.TestCase):
+
+    def test_restores_newest_parse_when_project_changed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            project_dir = os.path.join(tmp, 'project')
+            os.makedirs(os.path.join(project_dir, 'models'))
+            os.makedirs(os.path.join(project_dir, 'target'))
+            model = os.path.join(project_dir, 'models', 'a.sql')
+            with open(model, 'w') as f:
+                f.write('select 1')
+            parse_file = os.path.join(project_dir, 'target', 'partial_parse.msgpack')
+            with open(parse_file, 'wb') as f:
+                f.write(b'parse-1')
+
+            cache = PartialParseCache(project_dir, os.path.join(tmp, 'cache'), target='prd', env_vars=[])
+            content_key = cache.content_key()
+            cache.save()
+            os.remove(parse_file)
+            with open(model, 'w') as f:
+                f.write('select 2')
+            self.assertNotEqual(content_key, cache.content_key())
+            self.assertTrue(cache.restore())
+            with open(parse_file, 'rb') as f:
+                self.assertEqual(b'parse-1', f.read())
+
+            # A save in progress in another run is never restored.
+            with open(os.path.join(tmp, 'cache', cache.family_key(), '.tmpabc'), 'wb') as f:
+                f.write(b'partial')
+            os.remove(parse_file)
+            self.assertTrue(cache.restore())
+            with open(parse_file, 'rb') as f:
+                self.assertEqual(b'parse-1', f.read())
+
+            other_target = PartialParseCache(project_dir, os.path.join(tmp, 'cache'), target='dev', env_vars=[])
+            self.assertFalse(other_target.restore())
+
+    def test_family_key_uses_project_env_vars_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'models'))
+            with open(os.path.join(tmp, 'models', 'a.sql'), 'w') as f:
+                f.write("select '{{ env_var('DBT_REGION') }}', '{{ env_var(\"DBT_API_TOKEN\") }}'")
+            with open(os.path.join(tmp, 'profiles.yml'), 'w') as f:
+                f.write("password: \"{{ env_var('DBT_HOST') }}\"")
+
+            def family_key(**env):
+                return PartialParseCache(tmp, os.path.join(tmp, 'cache'), target='prd', env=env).family_key()
+
+            cache = PartialParseCache(tmp, os.path.join(tmp, 'cache'))
+            self.assertEqual(['DBT_API_TOKEN', 'DBT_REGION'], cache.project_env_vars())
+            key = family_key(DBT_REGION='eu')
+            self.assertNotEqual(key, family_key(DBT_REGION='us'))
+            self.assertNotEqual(key, family_key(DBT_REGION='eu', DBT_TARGET='dev'))
+            self.assertEqual(key, family_key(DBT_REGION='eu', DBT_API_TOKEN='secret'))
+            self.assertEqual(key, family_key(DBT_REGION='eu', DBT_HOST='other', DBT_LOG_PATH='/tmp/run-2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from benchmarks.bench_orchestration import run_scenario
+
+
+class OrchestrationBenchmarkTest(unittest.TestCase):
+
+    def run_scenario(self, scenario):
+        return run_scenario(scenario, nodes=5, lines_per_node=1, node_seconds=0, threads=2, latency={},
+                            default_latency=0, login_latency=0)
+
+    def test_database_clone(self):
+        result = self.run_scenario('database_clone')
+        self.assertTrue(result.succeeded)
+        self.assertGreater(result.round_trips.get('execute_async', 0), 0)
+        self.assertLessEqual(result.overhead_seconds, result.wall_seconds)
+
+    def test_build_failure(self):
+        result = self.run_scenario('build_failure')
+        self.assertFalse(result.succeeded)
@@ -0,0 +1,106 @@
+import threading
+import unittest
+
+from snowflake.connector import errors
+
+from src.async_query import QueryStatusUnknown
+from src.clone_database import CloneDB
+from src.retry import RetryPolicy
+
+
+class FakeStatus:
+    name = 'SUCCESS'
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+        self.description = [('created_on',), ('name',)]
+        self.sfqid = None
+        self._rows = []
+
+    def execute(self, sql):
+        if sql.startswith('show schemas'):
+            self._rows = [(None, name) for name in self.con.schemas]
+        elif 'query_history_by_session' in sql:
+            self._rows = [(query_id, 1500) for query_id in self.con.query_ids]
+        return self
+
+    def execute_async(self, sql):
+        with self.con.lock:
+            self.con.statements.append(sql)
+            self.sfqid = f'query-{len(self.con.statements)}'
+            self.con.query_ids.append(self.sfqid)
+        return self
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self.statements = []
+        self.query_ids = []
+        self.lock = threading.Lock()
+        # Errors to raise from the next status checks, in order.
+        self.status_errors = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        if self.status_errors:
+            raise self.status_errors.pop(0)
+        return FakeStatus()
+
+    def is_still_running(self, status):
+        return False
+
+
+class CloneDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cdb = CloneDB('BLUE', 'BLUE_STAGING', thread_count=4, unit_test=True, clone_by_schema=True)
+        self.cdb.con = FakeConnection(['INFORMATION_SCHEMA', 'PUBLIC', 'STAGING', 'MARTS', 'SECURITY', 'UTILS'])
+
+    def test_clone_by_schema_copies_every_schema(self):
+        # The green database replaces production on swap, so it must hold every schema a database clone would.
+        self.cdb.clone_blue_db_to_green()
+        statements = self.cdb.con.statements
+        self.assertEqual(['create database BLUE_STAGING;', 'drop schema if exists BLUE_STAGING."PUBLIC";'],
+                         statements[:2])
+        for schema in ['PUBLIC', 'STAGING', 'MARTS', 'SECURITY', 'UTILS']:
+            self.assertIn(f'create schema BLUE_STAGING."{schema}" clone BLUE."{schema}";', statements)
+        self.assertEqual(7, len(statements))
+
+    def test_clone_listed_schemas(self):
+        timings = self.cdb.clone_database_schemas('BLUE', 'BLUE_STAGING', ['MARTS', 'NEW'])
+        self.assertEqual({'MARTS': 1.5}, timings)
+        self.assertEqual(['create database BLUE_STAGING;', 'create schema if not exists BLUE_STAGING."NEW";',
+                          'create schema BLUE_STAGING."MARTS" clone BLUE."MARTS";'], self.cdb.con.statements)
+
+    def test_poll_error_does_not_resubmit_clone(self):
+        self.cdb._retry = RetryPolicy(max_attempts=3, sleep=lambda x: None)
+        self.cdb.con.status_errors = [errors.OperationalError('connection reset')]
+        self.cdb.clone_database('BLUE', 'BLUE_STAGING')
+        self.assertEqual(['create database BLUE_STAGING clone BLUE;'], self.cdb.con.statements)
+
+        self.cdb.con.statements = []
+        self.cdb.con.status_errors = [errors.OperationalError('connection reset')] * 3
+        with self.assertRaises(QueryStatusUnknown):
+            self.cdb.clone_database('BLUE', 'BLUE_STAGING')
+        self.assertEqual(['create database BLUE_STAGING clone BLUE;'], self.cdb.con.statements)
+
+    def test_failed_clone_is_resubmitted(self):
+        self.cdb._retry = RetryPolicy(max_attempts=3, sleep=lambda x: None)
+        self.cdb._check_if_database_exists = lambda database: False
+        self.cdb.con.status_errors = [errors.ProgrammingError('aborted', errno=604)]
+        self.cdb.clone_database('BLUE', 'BLUE_STAGING')
+        self.assertEqual(2, len(self.cdb.con.statements))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from src.connection_pool import ConnectionPool
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+
+    def execute(self, sql):
+        self.con.statements.append(sql)
+        return self
+
+
+class FakeConnection:
+
+    def __init__(self, query_tag):
+        self.query_tag = query_tag
+        self.statements = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(pool_size=2, connect_function=lambda query_tag, **kwargs: FakeConnection(query_tag))
+
+    def test_same_query_tag_shares_session(self):
+        first = self.pool.acquire('tag_a')
+        second = self.pool.acquire('tag_a')
+        self.assertIs(first, second)
+        self.assertEqual(1, self.pool.logins)
+
+    def test_idle_session_is_retagged_when_full(self):
+        a = self.pool.acquire('tag_a')
+        self.pool.acquire('tag_b')
+        self.pool.release(a)
+        c = self.pool.acquire('tag_c')
+        self.assertIs(a, c)
+        self.assertEqual(2, self.pool.logins)
+        self.assertEqual(["alter session set query_tag = 'tag_c';"], c.statements)
+
+    def test_closed_session_is_replaced(self):
+        a = self.pool.acquire('tag_a')
+        a.closed = True
+        b = self.pool.acquire('tag_a')
+        self.assertIsNot(a, b)
+        self.assertEqual(2, self.pool.logins)
+
+
+if __name__ == '__main__':
+    unittest.main()
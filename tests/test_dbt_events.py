@@ -0,0 +1,46 @@
+import json
+import unittest
+from src.dbt_events import DbtRunStatus
+
+
+def event(name, msg='', level='info', **data):
+    return json.dumps({'info': {'name': name, 'msg': msg, 'level': level}, 'data': data})
+
+
+class DbtRunStatusTest(unittest.TestCase):
+
+    def test_stream_of_events(self):
+        status = DbtRunStatus()
+        lines = [
+            'plain text line',
+            event('NodeStart', node_info={'unique_id': 'model.p.a', 'node_started_at': 't0'}),
+            event('NodeFinished', node_info={'unique_id': 'model.p.a', 'node_finished_at': 't1'},
+                  run_result={'status': 'success', 'execution_time': 2.5}),
+            event('NodeStart', node_info={'unique_id': 'test.p.b'}),
+            event('NodeFinished', node_info={'unique_id': 'test.p.b'},
+                  run_result={'status': 'fail', 'execution_time': 0.5, 'message': 'Got 3 results'}),
+            event('StatsLine', stats={'pass': 1, 'error': 0, 'warn': 0, 'skip': 0, 'total': 2}),
+            event('CommandCompleted', success=False, elapsed=3.1),
+        ]
+        parsed = [status.handle_line(x) for x in lines]
+        self.assertEqual([False] + [True] * 6, parsed)
+        self.assertEqual('success', status.nodes['model.p.a'].status)
+        self.assertEqual(2.5, status.nodes['model.p.a'].execution_time)
+        self.assertEqual(['test.p.b'], [x.unique_id for x in status.failed_nodes])
+        self.assertEqual('Got 3 results', status.nodes['test.p.b'].message)
+        self.assertFalse(status.success)
+        self.assertEqual(3.1, status.elapsed)
+        self.assertIn('slowest model.p.a', status.summary())
+
+    def test_single_error_is_counted(self):
+        # The old regex check only flagged two or more errors.
+        status = DbtRunStatus()
+        status.handle_line(event('NodeFinished', node_info={'unique_id': 'model.p.a'},
+                                 run_result={'status': 'error', 'execution_time': 1.0}))
+        self.assertEqual(1, status.error_count)
+        status.handle_line(event('StatsLine', stats={'error': 1, 'pass': 0}))
+        self.assertEqual(1, status.error_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
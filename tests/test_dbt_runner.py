@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+from src import dbt_runner
+from src.dbt_runner import InProcessDbtRunner
+
+
+class FakeResult:
+
+    def __init__(self, success, result=None):
+        self.success = success
+        self.result = result
+        self.exception = None
+
+
+class FakeDbtRunner:
+    invocations = []
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest
+
+    def invoke(self, args):
+        FakeDbtRunner.invocations.append((args[0], self.manifest))
+        if args[0] == 'parse':
+            return FakeResult(True, result=f'manifest-{len(FakeDbtRunner.invocations)}')
+        return FakeResult(True)
+
+
+class InProcessDbtRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeDbtRunner.invocations = []
+        patcher = mock.patch.object(dbt_runner, 'dbtRunner', FakeDbtRunner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.runner = InProcessDbtRunner('./')
+
+    def test_manifest_is_parsed_once_and_reused(self):
+        self.runner.invoke('build', ['--target', 'prd', '--select', 'a'])
+        self.runner.invoke('build', ['--target', 'prd', '--select', 'b'])
+        self.assertEqual([('parse', None), ('build', 'manifest-1'), ('build', 'manifest-1')],
+                         FakeDbtRunner.invocations)
+
+    def test_deps_and_target_change_invalidate_manifest(self):
+        self.runner.invoke('build', ['--target', 'prd'])
+        self.runner.invoke('deps', [])
+        self.runner.invoke('build', ['--target', 'prd'])
+        self.runner.invoke('build', ['--target', 'dev'])
+        self.assertEqual(['parse', 'build', 'deps', 'parse', 'build', 'parse', 'build'],
+                         [x[0] for x in FakeDbtRunner.invocations])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from src.garbage_collector import DatabaseGarbageCollector
+from src.utilities import Utilities
+
+
+class FakeStatus:
+    name = 'SUCCESS'
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+        self.description = [('created_on',), ('name',)]
+        self.sfqid = None
+        self._rows = []
+
+    def execute(self, sql):
+        if sql.startswith('show databases'):
+            self._rows = self.con.databases
+        else:
+            # Query history: nothing running
+            self._rows = []
+        return self
+
+    def execute_async(self, sql):
+        self.con.statements.append(sql)
+        self.sfqid = f'query-{len(self.con.statements)}'
+        return self
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+
+    def __init__(self, databases):
+        self.databases = databases
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        return FakeStatus()
+
+    def is_still_running(self, status):
+        return False
+
+
+def hours_ago(hours):
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
+
+class DatabaseGarbageCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = DatabaseGarbageCollector('BLUE', unit_test=True, staging_retention_hours=24,
+                                                  error_retention_hours=48, keep_errors=1)
+        now = Utilities.get_current_utc_time()
+        error = DatabaseGarbageCollector.error_database_name
+        self.newest_error = error('BLUE_STAGING', now - timedelta(hours=1))
+        self.collector.con = FakeConnection([
+            (hours_ago(1000), 'BLUE'),
+            (hours_ago(30), 'BLUE_STAGING'),
+            (hours_ago(2), 'BLUE_PR_1_STAGING'),
+            (hours_ago(1000), error('BLUE_STAGING', now - timedelta(hours=100))),
+            (hours_ago(1000), error('BLUE_STAGING', now - timedelta(hours=90))),
+            (hours_ago(1000), self.newest_error),
+            (hours_ago(1000), 'BLUE_STAGING_ERROR'),
+            # Databases that only share a prefix with the blue or green database.
+            (hours_ago(1000), 'BLUEBERRY_STAGING'),
+            (hours_ago(1000), 'BLUE_STAGING_ERROR_OLD'),
+            (hours_ago(1000), 'BLUE_STAGING_COPY'),
+        ])
+
+    def test_list_orphans(self):
+        orphans = self.collector.list_orphans()
+        self.assertEqual(4, len([x for x in orphans if x.kind == 'error']))
+        self.assertEqual(['BLUE_STAGING'], [x.name for x in orphans if x.kind == 'staging'])
+
+    def test_other_staging_is_opt_in(self):
+        self.collector.drop_other_staging = True
+        self.collector.con.databases.append((hours_ago(1000), 'BLUE_PR_2_STAGING_ERROR_20240101120000'))
+        orphans = self.collector.list_orphans()
+        self.assertEqual(['BLUE_STAGING', 'BLUE_PR_1_STAGING'], [x.name for x in orphans if x.kind == 'staging'])
+        self.assertEqual(5, len([x for x in orphans if x.kind == 'error']))
+        self.assertNotIn('BLUEBERRY_STAGING', [x.name for x in orphans])
+
+    def test_collect_drops_expired(self):
+        dropped = self.collector.collect()
+        self.assertEqual(4, len(dropped))
+        self.assertIn('BLUE_STAGING', dropped)
+        self.assertIn('BLUE_STAGING_ERROR', dropped)
+        self.assertNotIn('BLUE_PR_1_STAGING', dropped)
+        self.assertNotIn('BLUEBERRY_STAGING', dropped)
+        # The newest error database is kept.
+        self.assertNotIn(self.newest_error, dropped)
+        self.assertEqual(4, len(self.collector.con.statements))
+
+    def test_dry_run(self):
+        self.assertEqual(4, len(self.collector.collect(dry_run=True)))
+        self.assertEqual([], self.collector.con.statements)
@@ -0,0 +1,111 @@
+import re
+import unittest
+from unittest import mock
+
+from src.green_waiter import GreenDatabaseWaiter
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+        self._rows = []
+
+    def execute(self, sql):
+        self.con.queries.append(sql)
+        if self.con.error:
+            raise self.con.error
+        self._rows = self.con.rows.pop(0) if len(self.con.rows) > 1 else self.con.rows[0]
+        return self
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+
+    def __init__(self, rows=None, error=None):
+        # One list of query history rows per check. The last one repeats.
+        self.rows = rows or [[]]
+        self.error = error
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class GreenDatabaseWaiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('src.green_waiter.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def waiter(self, con, **kwargs):
+        kwargs = dict(dict(timeout_minutes=1, idle_minutes=5, initial_interval=5, max_interval=20, backoff=2), **kwargs)
+        return GreenDatabaseWaiter(con, 'BLUE_STAGING', **kwargs)
+
+    def test_backoff_until_timeout(self):
+        waiter = self.waiter(FakeConnection(error=RuntimeError('no access to query history')))
+        self.assertTrue(waiter.wait(lambda database: True))
+        self.assertEqual([5, 10, 20, 20, 5], self.clock.sleeps)
+
+    def test_removed_by_owner(self):
+        checks = iter([True, True, False])
+        waiter = self.waiter(FakeConnection([[('RUNNING', None, 'run_1', None)]]))
+        self.assertFalse(waiter.wait(lambda database: next(checks)))
+        self.assertEqual([5, 10], self.clock.sleeps)
+
+    def test_running_queries_wait_for_the_timeout(self):
+        waiter = self.waiter(FakeConnection([[('RUNNING', None, 'run_1', None), ('SUCCESS', None, 'run_1', 900)]]))
+        self.assertTrue(waiter.wait(lambda database: True))
+        self.assertEqual(60, sum(self.clock.sleeps))
+
+    def test_idle_database_is_stomped_straight_away(self):
+        rows = [('SUCCESS', None, 'run_1', 900), ('FAILED_WITH_ERROR', None, None, 400)]
+        waiter = self.waiter(FakeConnection([rows]))
+        self.assertTrue(waiter.wait(lambda database: True))
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_get_activity(self):
+        con = FakeConnection([[('RUNNING', None, 'run_2', None), ('QUEUED', None, 'run_1', None),
+                               ('SUCCESS', None, 'run_1', 30), ('SUCCESS', None, None, 10)]])
+        activity = self.waiter(con).get_activity()
+        self.assertEqual(2, activity.running)
+        self.assertEqual(10, activity.last_activity_seconds)
+        self.assertEqual(['run_1', 'run_2'], activity.query_tags)
+        self.assertIn("database_name = 'BLUE_STAGING'", con.queries[0])
+        self.assertNotIn('ilike', con.queries[0])
+
+    def test_shared_query_tags_are_not_followed(self):
+        con = FakeConnection()
+        self.waiter(con, ignore_query_tags=["run's_blue_green"]).get_activity()
+        self.assertIn("query_tag not in ('blue_green_tag_not_set', 'run''s_blue_green')", con.queries[0])
+
+    def test_name_pattern_matches_whole_identifiers(self):
+        pattern = re.compile(GreenDatabaseWaiter.name_pattern('blue_staging'), re.I)
+        self.assertTrue(pattern.search('create table blue_staging.marts.orders as select 1'))
+        self.assertTrue(pattern.search('drop database "BLUE_STAGING"'))
+        self.assertTrue(pattern.search('BLUE_STAGING'))
+        self.assertFalse(pattern.search('alter database BLUE_STAGING_STANDBY rename to x'))
+        self.assertFalse(pattern.search('drop database BLUE_STAGING_ERROR_20240101120000'))
+        self.assertFalse(pattern.search('select * from OLD_BLUE_STAGING.marts.orders'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from src.lease import Lease, LeaseBackend, LeaseLostError, SQLiteLeaseBackend
+
+
+class LeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SQLiteLeaseBackend()
+        self.backend.setup()
+
+    def test_acquire_and_release(self):
+        lease = Lease(self.backend, 'BLUE_STAGING', owner='a', ttl=30)
+        lease.acquire()
+        self.assertEqual('a', self.backend.holder('BLUE_STAGING')[0])
+        self.assertFalse(self.backend.try_acquire('BLUE_STAGING', 'b', 30))
+        lease.release()
+        self.assertIsNone(self.backend.holder('BLUE_STAGING'))
+        self.assertTrue(self.backend.try_acquire('BLUE_STAGING', 'b', 30))
+
+    def test_expired_lease_can_be_taken(self):
+        self.assertTrue(self.backend.try_acquire('BLUE_STAGING', 'a', 0.01))
+        time.sleep(0.05)
+        self.assertTrue(self.backend.try_acquire('BLUE_STAGING', 'b', 30))
+        self.assertFalse(self.backend.heartbeat('BLUE_STAGING', 'a', 30))
+
+    def test_client_clock_is_not_used(self):
+        self.assertTrue(self.backend.try_acquire('BLUE_STAGING', 'a', 30))
+        # A contender whose clock runs an hour ahead must not see the lease as expired.
+        with mock.patch('time.time', return_value=time.time() + 3600):
+            self.assertFalse(self.backend.try_acquire('BLUE_STAGING', 'b', 30))
+            self.assertEqual('a', self.backend.holder('BLUE_STAGING')[0])
+
+    def test_backend_is_abstract(self):
+        self.assertRaises(TypeError, LeaseBackend, None)
+
+    def test_contender_waits_in_queue(self):
+        first = Lease(self.backend, 'BLUE_STAGING', owner='a', ttl=30)
+        first.acquire()
+        second = Lease(self.backend, 'BLUE_STAGING', owner='b', ttl=30, poll_interval=0.01)
+        acquired = threading.Event()
+
+        def contend():
+            second.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=contend)
+        thread.start()
+        time.sleep(0.05)
+        self.assertFalse(acquired.is_set())
+        first.release()
+        thread.join(timeout=5)
+        self.assertTrue(acquired.is_set())
+        self.assertEqual('b', self.backend.holder('BLUE_STAGING')[0])
+        second.release()
+
+    def test_queue_is_first_in_first_out(self):
+        self.backend.enqueue('BLUE_STAGING', 'a')
+        self.backend.enqueue('BLUE_STAGING', 'b')
+        self.assertEqual('a', self.backend.queue_head('BLUE_STAGING', stale_after=30))
+        self.backend.dequeue('BLUE_STAGING', 'a')
+        self.assertEqual('b', self.backend.queue_head('BLUE_STAGING', stale_after=30))
+
+    def test_lost_lease_is_reported(self):
+        lease = Lease(self.backend, 'BLUE_STAGING', owner='a', ttl=30, heartbeat_interval=0.01)
+        lease.acquire()
+        self.backend.release('BLUE_STAGING', 'a')
+        self.backend.try_acquire('BLUE_STAGING', 'b', 30)
+        lease.lost.wait(timeout=5)
+        self.assertRaises(LeaseLostError, lease.check)
+        lease.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
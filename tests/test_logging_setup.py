@@ -0,0 +1,90 @@
+import gzip
+import logging
+import os
+import queue
+import tempfile
+import time
+import unittest
+
+from src.logging_setup import BatchedFileHandler, BoundedQueueHandler, CustomFormatter, FlushingQueueListener, \
+    compress_old_logs
+
+
+def make_record(message: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord('test', level, __file__, 1, message, None, None)
+
+
+class TestLoggingSetup(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'VS_Extractor-2024-01-03T00_00_00.log')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, path=None) -> str:
+        with open(path or self.path) as f:
+            return f.read()
+
+    def test_batched_file_handler(self):
+        handler = BatchedFileHandler(self.path, batch_size=3)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.handle(make_record('one'))
+        handler.handle(make_record('two'))
+        self.assertEqual('', self.read())
+        handler.handle(make_record('three'))
+        self.assertEqual('one\ntwo\nthree\n', self.read())
+        handler.handle(make_record('four'))
+        handler.handle(make_record('five', logging.WARNING))
+        self.assertEqual('one\ntwo\nthree\nfour\nfive\n', self.read())
+        handler.handle(make_record('six'))
+        handler.close()
+        self.assertEqual('one\ntwo\nthree\nfour\nfive\nsix\n', self.read())
+
+    def test_listener_flushes_when_idle(self):
+        handler = BatchedFileHandler(self.path, batch_size=100)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log_queue = queue.Queue()
+        listener = FlushingQueueListener(log_queue, handler, flush_interval=0.01)
+        listener.start()
+        try:
+            log_queue.put(make_record('queued'))
+            deadline = time.time() + 2
+            while not self.read() and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual('queued\n', self.read())
+        finally:
+            listener.stop()
+            handler.close()
+
+    def test_bounded_queue_drops_debug_records(self):
+        log_queue = queue.Queue(maxsize=2)
+        handler = BoundedQueueHandler(log_queue)
+        handler.handle(make_record('one'))
+        handler.handle(make_record('two', logging.DEBUG))
+        handler.handle(make_record('three', logging.DEBUG))
+        self.assertEqual(1, handler.dropped)
+        self.assertEqual(['one', 'two'], [log_queue.get_nowait().getMessage() for _ in range(2)])
+
+    def test_custom_formatter_caches_formatters(self):
+        formatter = CustomFormatter()
+        formatters = dict(formatter.formatters)
+        self.assertIn('hello', formatter.format(make_record('hello', logging.ERROR)))
+        self.assertEqual(formatters, formatter.formatters)
+
+    def test_compress_old_logs(self):
+        names = [f'VS_Extractor-2024-01-0{x}T00_00_00.log' for x in range(1, 4)]
+        for name in names:
+            with open(os.path.join(self.directory.name, name), 'w') as f:
+                f.write(name)
+        compressed = compress_old_logs(self.directory.name, current=self.path, keep_runs=1)
+
+        self.assertEqual(2, len(compressed))
+        self.assertEqual(sorted(os.listdir(self.directory.name)), [names[1] + '.gz', names[2]])
+        with gzip.open(os.path.join(self.directory.name, names[1] + '.gz'), 'rt') as f:
+            self.assertEqual(names[1], f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
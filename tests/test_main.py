@@ -1,6 +1,11 @@
+import json
+import os
+import tempfile
 import unittest
+import unittest.mock
 from typing import Tuple
 from src.main import DBTBlueGreen
+from src.manifest import Manifest
 
 class DbtBuildTest(unittest.TestCase):
 
@@ -110,5 +115,209 @@ class DbtBuildTest(unittest.TestCase):
         self.assertEqual('resource_type:seed resource_type:model,state:modified+ resource_type:test,state:modified+', select)
         self.assertEqual('resource_type:snapshot resource_type:test,exclude_test', exclude)
 
+    def test_list_target_schemas(self):
+        calls = []
+
+        def fake_list_dbt_nodes(ls_args):
+            calls.append(ls_args)
+            return [{'unique_id': 'model.proj.a', 'resource_type': 'model', 'schema': 'marts'},
+                    {'unique_id': 'seed.proj.b', 'resource_type': 'seed', 'schema': 'seeds'},
+                    {'unique_id': 'model.proj.c', 'resource_type': 'model', 'schema': 'MARTS'},
+                    {'unique_id': 'test.proj.d', 'resource_type': 'test', 'schema': 'dbt_test__audit'}]
+
+        self.bg._list_dbt_nodes = fake_list_dbt_nodes
+        schemas, upstream = self.bg._list_target_schemas(['--threads', '6', '--full-refresh', '--select', 'tag:hourly',
+                                                          '--target', 'prd'])
+        self.assertEqual(['MARTS', 'SEEDS'], schemas)
+        self.assertEqual([], upstream)
+        self.assertEqual(['--select', 'tag:hourly', '--target', 'prd', '--output', 'json', '--output-keys',
+                          'unique_id resource_type schema depends_on', '--quiet'], calls[0])
+
+    def test_list_target_schemas_includes_cross_schema_refs(self):
+        def node(schema, parents=(), resource_type='model', materialized='table'):
+            return {'resource_type': resource_type, 'schema': schema, 'config': {'materialized': materialized},
+                    'depends_on': {'nodes': list(parents)}}
+
+        nodes = {
+            'model.proj.staging': node('staging'),
+            'model.proj.lookup': node('reference'),
+            'model.proj.inline': node('ignored', ['model.proj.lookup'], materialized='ephemeral'),
+            'model.proj.orders': node('marts', ['model.proj.staging', 'model.proj.inline', 'model.proj.customers']),
+            'model.proj.customers': node('marts'),
+        }
+        self.bg._list_dbt_nodes = lambda ls_args: [dict(nodes['model.proj.orders'], unique_id='model.proj.orders')]
+        with tempfile.TemporaryDirectory() as dbt_root:
+            os.makedirs(os.path.join(dbt_root, 'target'))
+            with open(os.path.join(dbt_root, 'target', 'manifest.json'), 'w') as f:
+                json.dump({'nodes': nodes}, f)
+            self.bg._dbt_root = dbt_root
+            schemas, upstream = self.bg._list_target_schemas(['--select', 'orders'])
+        self.assertEqual(['MARTS'], schemas)
+        self.assertEqual(['REFERENCE', 'STAGING'], upstream)
+
+    def test_apply_manifest_diff(self):
+        def node(name, checksum='a'):
+            return {'fqn': ['proj', name], 'resource_type': 'model', 'original_file_path': f'models/{name}.sql',
+                    'checksum': {'checksum': checksum}, 'config': {}, 'depends_on': {'nodes': []}}
+
+        previous = {'nodes': {f'model.proj.m{i}': node(f'm{i}') for i in range(50)}}
+        current = Manifest({'nodes': {f'model.proj.m{i}': node(f'm{i}', 'b' if i < 3 else 'a') for i in range(50)}})
+        dbt_kwargs = dict(do_snapshot=False, do_seed=False, do_run=True, do_test=False, snapshot_select=None,
+                          snapshot_exclude=None, seed_select=None, seed_exclude=None, run_select=None,
+                          run_exclude=None, test_select=None, test_exclude=None, full_refresh=False, thread_count=4,
+                          manifest=True, fail_fast=False, dbt_target=None)
+        with tempfile.TemporaryDirectory() as dbt_root:
+            os.makedirs(os.path.join(dbt_root, 'logs'))
+            with open(os.path.join(dbt_root, 'logs', 'manifest.json'), 'w') as f:
+                json.dump(previous, f)
+            self.bg._dbt_root = dbt_root
+            self.bg._prepare_dbt_project = lambda dbt_target: None
+            self.bg._parse_dbt_project = lambda dbt_target: current
+
+            diffed = self.bg._apply_manifest_diff(dbt_kwargs)
+            self.assertEqual('path:models/m0.sql path:models/m1.sql path:models/m2.sql', diffed['run_select'])
+            args = self.bg._make_dbt_build_args(**diffed)
+            self.assertEqual(['--defer', '--state', 'logs'], args[2:5])
+
+            # A selection too long for one argument keeps state:modified+.
+            with unittest.mock.patch.dict(os.environ, {'MANIFEST_DIFF_MAX_SELECT_CHARS': '50'}):
+                diffed = self.bg._apply_manifest_diff(dbt_kwargs)
+            self.assertIsNone(diffed['run_select'])
+            self.assertIn('resource_type:model,state:modified+', self.bg._make_dbt_build_args(**diffed))
+
+    def test_export_metrics_keeps_recent_runs(self):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            for i in range(4):
+                open(os.path.join(metrics_dir, f'blue_green_metrics-test-2024010100000{i}.json'), 'w').close()
+            open(os.path.join(metrics_dir, 'blue_green_metrics-test_2-20240101000000.json'), 'w').close()
+            self.bg._metrics_dir = metrics_dir
+            with unittest.mock.patch.dict(os.environ, {'BLUE_GREEN_METRICS_KEEP_RUNS': '2'}):
+                self.bg._export_metrics(success=True)
+            files = os.listdir(metrics_dir)
+        # This run's file and the newest earlier one are kept, and other databases' files are left alone.
+        self.assertEqual(4, len(files))
+        self.assertIn('blue_green_metrics-test-20240101000003.json', files)
+        self.assertIn('blue_green_metrics-test_2-20240101000000.json', files)
+        self.assertIn('dbt_blue_green_test.prom', files)
+
+    def test_main_releases_session_on_failure(self):
+        def fail(*args, **kwargs):
+            raise RuntimeError('green database check failed')
+
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                unittest.mock.patch('src.main.CloneDB') as clone_db, \
+                unittest.mock.patch.dict(os.environ, {'MANIFEST_FOUND': 'false'}):
+            self.bg._metrics_dir = metrics_dir
+            self.bg._prepare_green_database = fail
+            self.bg._prepare_build = lambda *args: None
+            with self.assertRaises(RuntimeError):
+                self.bg.main(do_snapshot=False, do_seed=False, do_run=True, do_test=False, snapshot_select=None,
+                             snapshot_exclude=None, seed_select=None, seed_exclude=None, run_select=None,
+                             run_exclude=None, test_select=None, test_exclude=None)
+        clone_db.return_value.close.assert_called_once_with()
+
+    def test_standby_refreshed_only_after_swap_or_claim(self):
+        def run(no_swap, claimed):
+            refreshed = []
+            with tempfile.TemporaryDirectory() as metrics_dir, \
+                    unittest.mock.patch('src.main.CloneDB'), \
+                    unittest.mock.patch.dict(os.environ, {'MANIFEST_FOUND': 'false'}):
+                self.bg._metrics_dir = metrics_dir
+                self.bg._prepare_green_database = lambda *args, **kwargs: None
+                self.bg._prepare_build = lambda *args: None
+                self.bg._run_dbt = lambda **kwargs: None
+                self.bg._publish_statements = lambda *args, **kwargs: []
+                self.bg._publish = lambda *args, **kwargs: None
+                self.bg._get_standby = lambda: unittest.mock.Mock(claim=lambda: claimed)
+                self.bg.refresh_standby = lambda: refreshed.append(True)
+                self.bg.main(do_snapshot=False, do_seed=False, do_run=True, do_test=False, snapshot_select=None,
+                             snapshot_exclude=None, seed_select=None, seed_exclude=None, run_select=None,
+                             run_exclude=None, test_select=None, test_exclude=None, no_swap=no_swap,
+                             use_standby=True)
+            return bool(refreshed)
+
+        self.assertTrue(run(no_swap=False, claimed=False))
+        self.assertFalse(run(no_swap=True, claimed=False))
+        self.assertTrue(run(no_swap=True, claimed=True))
+
+    def test_publish_is_one_batch(self):
+        submitted = []
+
+        class FakeStatus:
+            name = 'SUCCESS'
+
+        class FakeCursor:
+            sfqid = 'query-1'
+
+            def execute_async(self, sql, num_statements=None):
+                submitted.append((sql, num_statements))
+
+            def execute(self, sql):
+                return self
+
+            def fetchall(self):
+                return []
+
+        class FakeConnection:
+            def cursor(self):
+                return FakeCursor()
+
+            def get_query_status_throw_if_error(self, query_id):
+                return FakeStatus()
+
+            def is_still_running(self, status):
+                return False
+
+        self.bg.con = FakeConnection()
+        self.bg._publish()
+        self.assertEqual(1, len(submitted))
+        sql, num_statements = submitted[0]
+        self.assertEqual(5, num_statements)
+        self.assertEqual(['grant usage on database TEST_STAGING to role z_db_test;',
+                          'grant usage on database TEST_STAGING to role useradmin;',
+                          'alter database TEST swap with TEST_STAGING;',
+                          'drop database if exists TEST_STAGING;',
+                          'describe database TEST;'], sql.split('\n'))
+
+    def test_publish_resumes_after_swap(self):
+        from datetime import datetime
+        self.bg._check_if_database_exists = lambda database: True
+        self.bg._created_on = lambda sql: {'TEST_STAGING': datetime(2024, 1, 1)} if 'STAGING' in sql else \
+            {'TEST': datetime(2024, 6, 1)}
+        self.assertEqual(['drop database if exists TEST_STAGING;', 'describe database TEST;'],
+                         self.bg._publish_statements(resume=True))
+
+        self.bg._check_if_database_exists = lambda database: False
+        self.assertEqual(['describe database TEST;'], self.bg._publish_statements(resume=True))
+
+
+    def test_choose_thread_count(self):
+        nodes = [{'unique_id': f'model.p.m{i}', 'depends_on': {'nodes': []}} for i in range(12)]
+        nodes.append({'unique_id': 'model.p.final', 'depends_on': {'nodes': [x['unique_id'] for x in nodes]}})
+        self.bg._selected_nodes = lambda build_args: nodes
+        self.bg._max_threads = 20
+        self.bg._warehouse_thread_capacity = lambda: None
+        self.assertEqual(12, self.bg._choose_thread_count([]))
+        self.bg._warehouse_thread_capacity = lambda: (8, 'one cluster')
+        self.assertEqual(8, self.bg._choose_thread_count([]))
+        self.bg._max_threads = 4
+        self.assertEqual(4, self.bg._choose_thread_count([]))
+
+    def test_runs_dbt_as_subprocess_by_default(self):
+        with unittest.mock.patch.dict(os.environ), \
+                unittest.mock.patch('src.main.InProcessDbtRunner.is_available', return_value=True):
+            os.environ.pop('DBT_EXECUTION_MODE', None)
+            self.assertIsNone(DBTBlueGreen(blue_database='TEST', unit_test=True)._in_process_runner)
+            os.environ['DBT_EXECUTION_MODE'] = 'in_process'
+            self.assertIsNotNone(DBTBlueGreen(blue_database='TEST', unit_test=True)._in_process_runner)
+
+    def test_thread_count_is_fixed_unless_auto(self):
+        with unittest.mock.patch.dict(os.environ):
+            os.environ.pop('DBT_THREAD_COUNT', None)
+            self.assertFalse(DBTBlueGreen(blue_database='TEST', unit_test=True)._adaptive_threads)
+            os.environ['DBT_THREAD_COUNT'] = 'auto'
+            self.assertTrue(DBTBlueGreen(blue_database='TEST', unit_test=True)._adaptive_threads)
+
+
 if __name__ == '__main__':
     unittest.main()
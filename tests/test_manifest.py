@@ -0,0 +1,85 @@
+import copy
+import unittest
+from src.manifest import Manifest, ManifestDiff
+
+
+def node(unique_id, resource_type='model', checksum='a', parents=(), macros=(), **config):
+    return {'unique_id': unique_id, 'resource_type': resource_type, 'fqn': ['proj'] + unique_id.split('.')[2:],
+            'schema': 'marts', 'alias': unique_id.split('.')[-1], 'checksum': {'checksum': checksum},
+            'config': dict(materialized='table', **config),
+            'depends_on': {'nodes': list(parents), 'macros': list(macros)}}
+
+
+def make_manifest():
+    return {
+        'nodes': {
+            'model.proj.stg': node('model.proj.stg'),
+            'model.proj.orders': node('model.proj.orders', parents=['model.proj.stg'], macros=['macro.proj.cents']),
+            'model.proj.customers': node('model.proj.customers'),
+            'test.proj.not_null_orders': node('test.proj.not_null_orders', resource_type='test',
+                                              parents=['model.proj.orders']),
+        },
+        'macros': {'macro.proj.cents': {'macro_sql': '{{ x }} * 100', 'depends_on': {'macros': []}}},
+    }
+
+
+class ManifestDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = make_manifest()
+        self.current = copy.deepcopy(self.previous)
+
+    def diff(self):
+        return ManifestDiff(Manifest(self.previous), Manifest(self.current))
+
+    def test_no_changes(self):
+        self.assertEqual(set(), self.diff().impacted_nodes())
+
+    def test_body_change_includes_downstream(self):
+        self.current['nodes']['model.proj.stg']['checksum']['checksum'] = 'b'
+        self.assertEqual({'model.proj.stg', 'model.proj.orders', 'test.proj.not_null_orders'},
+                         self.diff().impacted_nodes())
+        self.assertEqual({'model.proj.stg', 'model.proj.orders'}, self.diff().impacted_nodes(['model']))
+
+    def test_config_change(self):
+        self.current['nodes']['model.proj.customers']['config']['materialized'] = 'incremental'
+        self.assertEqual({'model.proj.customers'}, self.diff().impacted_nodes())
+
+    def test_ignored_config_change(self):
+        self.current['nodes']['model.proj.customers']['config']['meta'] = {'owner': 'x'}
+        self.assertEqual(set(), self.diff().impacted_nodes())
+
+    def test_macro_change(self):
+        self.current['macros']['macro.proj.cents']['macro_sql'] = '{{ x }} * 1000'
+        self.assertEqual({'model.proj.orders', 'test.proj.not_null_orders'}, self.diff().impacted_nodes())
+
+    def test_new_node(self):
+        self.current['nodes']['model.proj.new'] = node('model.proj.new')
+        self.assertEqual({'model.proj.new'}, self.diff().impacted_nodes())
+
+    def test_selector(self):
+        self.assertEqual('fqn:proj.orders', Manifest(self.current).selector('model.proj.orders'))
+        self.current['nodes']['model.proj.orders']['original_file_path'] = 'models/orders.sql'
+        self.current['nodes']['model.proj.customers']['original_file_path'] = 'models/schema.yml'
+        self.current['nodes']['test.proj.not_null_orders']['original_file_path'] = 'models/schema.yml'
+        manifest = Manifest(self.current)
+        self.assertEqual('path:models/orders.sql', manifest.selector('model.proj.orders'))
+        self.assertEqual('path:models/schema.yml,fqn:proj.not_null_orders',
+                         manifest.selector('test.proj.not_null_orders'))
+
+    def test_parallel_width(self):
+        manifest = Manifest(self.current)
+        self.assertEqual(2, manifest.parallel_width(manifest.nodes))
+        # The test still runs after stg, through the unselected orders model.
+        self.assertEqual(2, manifest.parallel_width(['model.proj.stg', 'model.proj.customers',
+                                                     'test.proj.not_null_orders']))
+        self.assertEqual(0, manifest.parallel_width([]))
+
+    def test_selected_ancestors(self):
+        manifest = Manifest(self.current)
+        self.assertEqual({'model.proj.stg': set(), 'test.proj.not_null_orders': {'model.proj.stg'}},
+                         manifest.selected_ancestors(['model.proj.stg', 'test.proj.not_null_orders']))
+
+
+if __name__ == '__main__':
+    unittest.main()
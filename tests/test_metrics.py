@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+from src.metrics import PhaseTimer
+
+
+class PhaseTimerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = PhaseTimer(labels={'blue_database': 'PRD'})
+        self.dir = tempfile.mkdtemp()
+
+    def test_failed_span_is_recorded(self):
+        with self.timer.span('clone'):
+            pass
+        with self.assertRaises(ValueError):
+            with self.timer.span('build'):
+                raise ValueError('boom')
+        self.assertEqual(['ok', 'error'], [x.status for x in self.timer.spans])
+        self.assertTrue(all(x.seconds is not None for x in self.timer.spans))
+
+    def test_repeated_phases_are_summed(self):
+        for _ in range(2):
+            with self.timer.span('drop'):
+                pass
+        self.assertEqual(['drop'], list(self.timer.phase_totals()))
+
+    def test_export(self):
+        with self.timer.span('swap', by_schema=True):
+            pass
+        json_path = os.path.join(self.dir, 'metrics.json')
+        prom_path = os.path.join(self.dir, 'metrics.prom')
+        self.timer.export_json(json_path, success=True)
+        self.timer.export_openmetrics(prom_path, success=True)
+
+        with open(json_path) as f:
+            data = json.load(f)
+        self.assertTrue(data['success'])
+        self.assertEqual({'by_schema': True}, data['spans'][0]['attributes'])
+
+        with open(prom_path) as f:
+            text = f.read()
+        self.assertIn('dbt_blue_green_phase_duration_seconds{blue_database="PRD",phase="swap"}', text)
+        self.assertIn('dbt_blue_green_run_success{blue_database="PRD"} 1', text)
+        self.assertTrue(text.endswith('# EOF\n'))
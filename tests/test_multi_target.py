@@ -0,0 +1,74 @@
+import threading
+import time
+import unittest
+
+from src.multi_target import DeployTarget, MultiTargetDeploy
+
+
+class FakePipeline:
+
+    def __init__(self, deploy, target, dbt_deps_installed):
+        self.deploy = deploy
+        self.target = target
+        self.dbt_deps_installed = dbt_deps_installed
+
+    def install_dbt_deps(self):
+        self.deploy.deps_runs += 1
+
+    def main(self, **kwargs):
+        with self.deploy.lock:
+            self.deploy.running += 1
+            self.deploy.max_running = max(self.deploy.max_running, self.deploy.running)
+        time.sleep(0.02)
+        with self.deploy.lock:
+            self.deploy.running -= 1
+        if self.target.blue_database == 'FAIL':
+            raise RuntimeError('build failed')
+        self.deploy.deployed.append((self.target.blue_database, kwargs))
+
+
+class FakeMultiTargetDeploy(MultiTargetDeploy):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.deps_runs = 0
+        self.deployed = []
+        self.pipelines = []
+
+    def make_pipeline(self, target, dbt_deps_installed=False):
+        pipeline = FakePipeline(self, target, dbt_deps_installed)
+        self.pipelines.append(pipeline)
+        return pipeline
+
+
+class TestMultiTargetDeploy(unittest.TestCase):
+
+    def test_parse_target(self):
+        target = DeployTarget.parse('CLIENT_A:CLIENT_A_GREEN')
+        self.assertEqual(('CLIENT_A', 'CLIENT_A_GREEN'), (target.blue_database, target.green_database))
+        self.assertEqual('CLIENT_B_STAGING', DeployTarget.parse('CLIENT_B').green_database)
+        with self.assertRaises(ValueError):
+            DeployTarget.parse(':GREEN')
+
+    def test_failures_are_isolated(self):
+        names = ['A', 'FAIL', 'B', 'C', 'D']
+        deploy = FakeMultiTargetDeploy([DeployTarget(x) for x in names], max_concurrency=2)
+        outcomes = deploy.run(do_run=True)
+        self.assertEqual([True, False, True, True, True], [x.success for x in outcomes])
+        self.assertIsInstance(outcomes[1].exception, RuntimeError)
+        self.assertEqual({'A', 'B', 'C', 'D'}, {x[0] for x in deploy.deployed})
+        self.assertEqual({'do_run': True}, deploy.deployed[0][1])
+        self.assertLessEqual(deploy.max_running, 2)
+
+    def test_deps_run_once(self):
+        deploy = FakeMultiTargetDeploy([DeployTarget(x) for x in ['A', 'B', 'C']])
+        deploy.run()
+        self.assertEqual(1, deploy.deps_runs)
+        self.assertEqual([False, True, True], [x.dbt_deps_installed for x in deploy.pipelines])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+
+from src.phase_graph import PhaseGraph
+
+
+class TestPhaseGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def phase(self, name, seconds=0.0, error=None):
+        def run():
+            with self.lock:
+                self.events.append(f'{name} start')
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(f'{name} end')
+            if error:
+                raise error
+        return run
+
+    def test_independent_phases_overlap(self):
+        graph = PhaseGraph(max_workers=3)
+        graph.add('green', self.phase('green', 0.05))
+        graph.add('project', self.phase('project', 0.05))
+        graph.add('clone', self.phase('clone'), depends_on=['green'])
+        graph.add('build', self.phase('build'), depends_on=['clone', 'project'])
+        graph.run()
+        self.assertEqual({'green start', 'project start'}, set(self.events[:2]))
+        self.assertEqual(['build start', 'build end'], self.events[-2:])
+
+    def test_one_worker_runs_in_order(self):
+        graph = PhaseGraph(max_workers=1)
+        for name in ['green', 'project', 'clone']:
+            graph.add(name, self.phase(name))
+        graph.run()
+        self.assertEqual(['green start', 'green end', 'project start', 'project end', 'clone start', 'clone end'],
+                         self.events)
+
+    def test_failure_waits_for_running_phases_and_cancels_the_rest(self):
+        graph = PhaseGraph(max_workers=2)
+        graph.add('green', self.phase('green', error=RuntimeError('deps failed')))
+        graph.add('clone', self.phase('clone', 0.05))
+        graph.add('build', self.phase('build'), depends_on=['green', 'clone'])
+        with self.assertRaises(RuntimeError):
+            graph.run()
+        self.assertIn('clone end', self.events)
+        self.assertNotIn('build start', self.events)
+        self.assertEqual('green', graph.failed)
+        self.assertEqual(['green', 'clone'], graph.started)
+        self.assertEqual('cancelled', graph.phases['build'].status)
+
+    def test_skipped_phase_unblocks_dependents(self):
+        graph = PhaseGraph()
+        graph.add('clone', self.phase('clone'), when=lambda: False)
+        graph.add('build', self.phase('build'), depends_on=['clone'])
+        graph.run()
+        self.assertEqual(['build start', 'build end'], self.events)
+        self.assertEqual('skipped', graph.phases['clone'].status)
+
+    def test_unknown_dependency(self):
+        graph = PhaseGraph()
+        with self.assertRaises(ValueError):
+            graph.add('build', self.phase('build'), depends_on=['clone'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import time
+import unittest
+
+from src.process_runner import StreamingProcess
+
+
+def python(code: str):
+    return [sys.executable, '-c', code]
+
+
+class TestStreamingProcess(unittest.TestCase):
+
+    def test_chatty_stderr_does_not_stall_stdout(self):
+        # Far more stderr than a pipe buffer holds, written before any stdout.
+        code = ('import sys\n'
+                'for i in range(20000): sys.stderr.write(f"warning {i}\\n")\n'
+                'for i in range(5): print(f"line {i}")\n'
+                'sys.exit(3)')
+        stdout = []
+        result = StreamingProcess(python(code), tail_lines=10, timeout=60).run(stdout.append)
+        self.assertEqual([f'line {i}' for i in range(5)], stdout)
+        self.assertEqual(3, result.return_code)
+        self.assertEqual([f'warning {i}' for i in range(19990, 20000)], result.stderr_tail)
+        self.assertEqual(20005, result.lines)
+
+    def test_long_lines_are_split(self):
+        stdout = []
+        StreamingProcess(python('print("x" * 25)'), max_line_length=10).run(stdout.append)
+        self.assertEqual(['x' * 10, 'x' * 10, 'x' * 5], stdout)
+
+    def test_inactivity_timeout(self):
+        code = 'import time\nprint("started", flush=True)\ntime.sleep(30)'
+        stdout = []
+        start = time.time()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            StreamingProcess(python(code), inactivity_timeout=0.5, kill_grace_seconds=2).run(stdout.append)
+        self.assertEqual(['started'], stdout)
+        self.assertLess(time.time() - start, 10)
+
+    def test_timeout(self):
+        code = 'import time\nwhile True:\n    print("working", flush=True)\n    time.sleep(0.05)'
+        start = time.time()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            StreamingProcess(python(code), timeout=0.5, inactivity_timeout=5, kill_grace_seconds=2).run(lambda x: None)
+        self.assertLess(time.time() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from snowflake.connector import errors
+
+from src.retry import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.policy = RetryPolicy(max_attempts=3, initial_delay=2, max_delay=3, sleep=self.sleeps.append)
+
+    def test_is_retryable(self):
+        self.assertTrue(self.policy.is_retryable(errors.ProgrammingError('aborted', errno=604)))
+        self.assertTrue(self.policy.is_retryable(errors.OperationalError('network')))
+        self.assertTrue(self.policy.is_retryable(ConnectionResetError()))
+        self.assertFalse(self.policy.is_retryable(errors.ProgrammingError('syntax error', errno=1003)))
+        self.assertFalse(self.policy.is_retryable(ValueError()))
+
+    def test_delay_is_jittered_and_capped(self):
+        for _ in range(20):
+            self.assertTrue(1 <= self.policy.delay(1) <= 2)
+            self.assertTrue(1.5 <= self.policy.delay(5) <= 3)
+
+    def test_retries_transient_errors(self):
+        calls = []
+
+        def operation():
+            calls.append(1)
+            if len(calls) < 3:
+                raise errors.OperationalError('network')
+            return 'done'
+
+        self.assertEqual('done', self.policy.call(operation, 'test'))
+        self.assertEqual(3, len(calls))
+        self.assertEqual(2, len(self.sleeps))
+
+    def test_gives_up_after_max_attempts(self):
+        def operation():
+            raise errors.OperationalError('network')
+
+        with self.assertRaises(errors.OperationalError):
+            self.policy.call(operation, 'test')
+        self.assertEqual(2, len(self.sleeps))
+
+    def test_does_not_retry_other_errors(self):
+        def operation():
+            raise errors.ProgrammingError('syntax error', errno=1003)
+
+        with self.assertRaises(errors.ProgrammingError):
+            self.policy.call(operation, 'test')
+        self.assertEqual([], self.sleeps)
+
+    def test_skips_retry_when_done(self):
+        calls = []
+
+        def operation():
+            calls.append(1)
+            raise errors.OperationalError('connection lost after the swap')
+
+        self.assertIsNone(self.policy.call(operation, 'swap', is_done=lambda: True))
+        self.assertEqual(1, len(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
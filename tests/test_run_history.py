@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+
+from src.run_history import RunHistory
+from src.utilities import Utilities
+
+
+class TestRunHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.history = RunHistory(os.path.join(self.tmp.name, 'history', 'runs.sqlite'), retention_days=30)
+        self.manifest = os.path.join(self.tmp.name, 'manifest.json')
+        with open(self.manifest, 'w') as f:
+            json.dump({'nodes': {'model.p.orders': {'tags': ['finance']}, 'model.p.users': {'tags': []}}}, f)
+        self.runs = 0
+
+    def ingest(self, timings, days_ago=0):
+        self.runs += 1
+        generated_at = Utilities.get_current_utc_time() - timedelta(days=days_ago)
+        path = os.path.join(self.tmp.name, 'run_results.json')
+        with open(path, 'w') as f:
+            json.dump({'metadata': {'invocation_id': f'run-{self.runs}',
+                                    'generated_at': generated_at.isoformat() + 'Z'},
+                       'results': [{'unique_id': k, 'status': 'success', 'execution_time': v,
+                                    'adapter_response': {'rows_affected': 10}, 'timing': []}
+                                   for k, v in timings.items()]}, f)
+        return self.history.ingest(path, target='prd', manifest_path=self.manifest)
+
+    def test_ingest_is_idempotent(self):
+        self.assertEqual(2, self.ingest({'model.p.orders': 5.0, 'model.p.users': 1.0}))
+        self.runs -= 1
+        self.assertEqual(0, self.ingest({'model.p.orders': 5.0, 'model.p.users': 1.0}))
+
+    def test_slowest_and_tags(self):
+        self.ingest({'model.p.orders': 5.0, 'model.p.users': 1.0})
+        self.ingest({'model.p.orders': 7.0, 'model.p.users': 1.0})
+        slowest = self.history.slowest()
+        self.assertEqual(['model.p.orders', 'model.p.users'], [x['node_id'] for x in slowest])
+        self.assertEqual(6.0, slowest[0]['avg_seconds'])
+        tags = {x['tag']: x for x in self.history.time_by_tag()}
+        self.assertEqual(12.0, tags['finance']['total_seconds'])
+        self.assertEqual(6.0, tags['finance']['avg_seconds_per_build'])
+        self.assertEqual(2.0, tags['(untagged)']['total_seconds'])
+
+    def test_regressions(self):
+        for seconds in [10.0, 11.0, 9.0, 30.0]:
+            self.ingest({'model.p.orders': seconds, 'model.p.users': 2.0})
+        regressions = self.history.regressions(target='prd')
+        self.assertEqual(['model.p.orders'], [x['node_id'] for x in regressions])
+        self.assertEqual(3.0, regressions[0]['ratio'])
+
+    def test_prune(self):
+        self.ingest({'model.p.orders': 5.0}, days_ago=40)
+        self.ingest({'model.p.orders': 5.0})
+        self.assertEqual(1, self.history.slowest(days=365)[0]['runs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from src.dbt_runner import DbtCommandResult
+from src.manifest import Manifest
+from src.sharded_build import ShardedBuild
+
+
+def make_manifest():
+    def node(unique_id, parents=()):
+        return {'fqn': ['proj', unique_id.split('.')[-1]], 'resource_type': 'model',
+                'depends_on': {'nodes': list(parents)}}
+
+    return Manifest({'nodes': {
+        'model.proj.a': node('model.proj.a'),
+        'model.proj.b': node('model.proj.b', ['model.proj.a']),
+        'model.proj.c': node('model.proj.c', ['model.proj.b']),
+        'model.proj.d': node('model.proj.d'),
+        'model.proj.e': node('model.proj.e', ['model.proj.d']),
+        'model.proj.f': node('model.proj.f'),
+    }})
+
+
+class ShardedBuildTest(unittest.TestCase):
+
+    def test_components_never_split(self):
+        sharded_build = ShardedBuild(make_manifest(), './', 2, run_command=None)
+        self.assertEqual([['model.proj.a', 'model.proj.b', 'model.proj.c'], ['model.proj.d', 'model.proj.e'],
+                          ['model.proj.f']], sharded_build.components(list(make_manifest().nodes)))
+        shards = sharded_build.plan(list(make_manifest().nodes))
+        self.assertEqual([['model.proj.a', 'model.proj.b', 'model.proj.c'],
+                          ['model.proj.d', 'model.proj.e', 'model.proj.f']], shards)
+
+    def test_unselected_parent_keeps_component(self):
+        sharded_build = ShardedBuild(make_manifest(), './', 4, run_command=None)
+        self.assertEqual([['model.proj.a', 'model.proj.c'], ['model.proj.f']],
+                         sharded_build.components(['model.proj.a', 'model.proj.c', 'model.proj.f']))
+        self.assertEqual([['model.proj.a', 'model.proj.c']], sharded_build.plan(['model.proj.a', 'model.proj.c']))
+
+    def test_run_merges_results(self):
+        calls = []
+        lock = threading.Lock()
+
+        with tempfile.TemporaryDirectory() as project_dir:
+            def run_command(command, args, env):
+                target_path = args[args.index('--target-path') + 1]
+                os.makedirs(os.path.join(project_dir, target_path), exist_ok=True)
+                with open(os.path.join(project_dir, target_path, 'run_results.json'), 'w') as f:
+                    json.dump({'results': [{'unique_id': target_path}], 'elapsed_time': 1}, f)
+                with lock:
+                    calls.append((args[args.index('--select') + 1], env))
+                return DbtCommandResult(command, True)
+
+            sharded_build = ShardedBuild(make_manifest(), project_dir, 2, run_command=run_command,
+                                         warehouses=['WH_A', 'WH_B'], warehouse_env_var='WH')
+            results = sharded_build.run(list(make_manifest().nodes), ['--threads', '4'])
+            self.assertTrue(all(x.success for x in results))
+            self.assertIn(('fqn:proj.a fqn:proj.b fqn:proj.c', {'WH': 'WH_A'}), calls)
+            with open(os.path.join(project_dir, 'target', 'run_results.json')) as f:
+                self.assertEqual(2, len(json.load(f)['results']))
+
+    def test_long_selection_runs_in_batches(self):
+        calls = []
+
+        with tempfile.TemporaryDirectory() as project_dir:
+            os.makedirs(os.path.join(project_dir, 'target'))
+            with open(os.path.join(project_dir, 'target', 'partial_parse.msgpack'), 'wb') as f:
+                f.write(b'parse')
+
+            def run_command(command, args, env):
+                target_path = args[args.index('--target-path') + 1]
+                with open(os.path.join(project_dir, target_path, 'partial_parse.msgpack'), 'rb') as f:
+                    self.assertEqual(b'parse', f.read())
+                select = args[args.index('--select') + 1]
+                calls.append(select)
+                with open(os.path.join(project_dir, target_path, 'run_results.json'), 'w') as f:
+                    json.dump({'results': [{'unique_id': x} for x in select.split()], 'elapsed_time': 1}, f)
+                return DbtCommandResult(command, True)
+
+            # Room for two selectors per command.
+            sharded_build = ShardedBuild(make_manifest(), project_dir, 1, run_command=run_command,
+                                         max_select_chars=26)
+            self.assertEqual([['model.proj.a', 'model.proj.b'], ['model.proj.c', 'model.proj.d'],
+                              ['model.proj.e', 'model.proj.f']], sharded_build.batches(list(make_manifest().nodes)))
+            results = sharded_build.run(list(make_manifest().nodes), [])
+            self.assertTrue(results[0].success)
+            self.assertEqual(['fqn:proj.a fqn:proj.b', 'fqn:proj.c fqn:proj.d', 'fqn:proj.e fqn:proj.f'], calls)
+            with open(os.path.join(project_dir, 'target', 'run_results.json')) as f:
+                self.assertEqual(6, len(json.load(f)['results']))
+
+
+if __name__ == '__main__':
+    unittest.main()
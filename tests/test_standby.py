@@ -0,0 +1,71 @@
+import unittest
+from src.standby import GreenStandby
+
+
+class FakeStatus:
+    name = 'SUCCESS'
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+        self.sfqid = None
+        self._row = None
+
+    def execute(self, sql):
+        if 'information_schema.databases' in sql:
+            self._row = self.con.standby
+        return self
+
+    def execute_async(self, sql):
+        self.con.statements.append(sql)
+        self.sfqid = f'query-{len(self.con.statements)}'
+        return self
+
+    def fetchone(self):
+        return self._row
+
+
+class FakeConnection:
+
+    def __init__(self, standby):
+        # (age_seconds, blue_changed), or None if there is no standby
+        self.standby = standby
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        return FakeStatus()
+
+    def is_still_running(self, status):
+        return False
+
+
+class GreenStandbyTest(unittest.TestCase):
+
+    def standby(self, row):
+        return GreenStandby(FakeConnection(row), 'BLUE', 'BLUE_STAGING', max_age_minutes=60)
+
+    def test_claim_fresh_standby(self):
+        standby = self.standby((120, False))
+        self.assertTrue(standby.claim())
+        self.assertEqual(['alter database BLUE_STAGING_STANDBY rename to BLUE_STAGING;'], standby.con.statements)
+
+    def test_no_standby(self):
+        standby = self.standby(None)
+        self.assertFalse(standby.claim())
+        self.assertEqual([], standby.con.statements)
+
+    def test_stale_standby_is_dropped(self):
+        for row in [(7200, False), (120, True)]:
+            standby = self.standby(row)
+            self.assertFalse(standby.claim())
+            self.assertEqual(['drop database if exists BLUE_STAGING_STANDBY;'], standby.con.statements)
+
+    def test_refresh(self):
+        standby = self.standby(None)
+        standby.refresh()
+        self.assertEqual(['create or replace database BLUE_STAGING_STANDBY clone BLUE;'], standby.con.statements)
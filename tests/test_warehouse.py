@@ -0,0 +1,76 @@
+import unittest
+
+from src.retry import RetryPolicy
+from src.warehouse import WarehouseResizer, WarehouseSettings, normalize_size
+
+
+class FakeCursor:
+
+    def __init__(self, con):
+        self.con = con
+        self.description = [('name',), ('state',), ('type',), ('size',), ('min_cluster_count',),
+                            ('max_cluster_count',)]
+
+    def execute(self, sql):
+        self.con.statements.append(sql)
+        return self
+
+    def fetchall(self):
+        return [('BUILD_WH', 'SUSPENDED', 'STANDARD', self.con.size, 1, self.con.max_clusters)]
+
+
+class FakeConnection:
+
+    def __init__(self, size='X-Small', max_clusters=1):
+        self.size = size
+        self.max_clusters = max_clusters
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class TestWarehouseResizer(unittest.TestCase):
+
+    def setUp(self):
+        self.con = FakeConnection()
+        self.resizer = WarehouseResizer(self.con, 'BUILD_WH', retry=RetryPolicy(sleep=lambda x: None))
+
+    def test_normalize_size(self):
+        self.assertEqual('XSMALL', normalize_size('X-Small'))
+        self.assertEqual('XXLARGE', normalize_size('2X-Large'))
+        self.assertEqual('X4LARGE', normalize_size('4X-Large'))
+        with self.assertRaises(ValueError):
+            normalize_size('huge')
+
+    def test_choose_size(self):
+        self.assertEqual('XSMALL', self.resizer.choose_size(10))
+        self.assertEqual('MEDIUM', self.resizer.choose_size(800))
+        self.assertEqual('LARGE', self.resizer.choose_size(10, full_refresh=True))
+        self.assertIsNone(self.resizer.choose_size(None))
+        self.resizer.size = 'XLARGE'
+        self.assertEqual('XLARGE', self.resizer.choose_size(10, full_refresh=True))
+
+    def test_clusters_follow_thread_count(self):
+        self.resizer.threads_per_cluster = 8
+        target = self.resizer.target_settings(WarehouseSettings('SMALL', 1, 1), 'MEDIUM', 20)
+        self.assertEqual(WarehouseSettings('MEDIUM', 1, 3), target)
+
+    def test_restores_after_failure(self):
+        with self.assertRaises(RuntimeError):
+            with self.resizer.resized(800, thread_count=6):
+                raise RuntimeError('build failed')
+        self.assertEqual(["show warehouses like 'BUILD_WH';",
+                          "alter warehouse BUILD_WH set warehouse_size = 'MEDIUM' min_cluster_count = 1 "
+                          "max_cluster_count = 1;",
+                          "alter warehouse BUILD_WH set warehouse_size = 'XSMALL' min_cluster_count = 1 "
+                          "max_cluster_count = 1;"], self.con.statements)
+
+    def test_no_change_needed(self):
+        with self.resizer.resized(10, thread_count=6):
+            pass
+        self.assertEqual(["show warehouses like 'BUILD_WH';"], self.con.statements)
+
+
+if __name__ == '__main__':
+    unittest.main()